@@ -1,22 +1,45 @@
 import numpy as np
 import pandas as pd
 from sklearn.ensemble import IsolationForest
+import multiprocessing as mp
+import os
+import pickle
 import sqlite3
 import json
 from datetime import datetime
+from metrics import span
 
 # Replace with your actual SQLite database path
 DATABASE_PATH = 'vehicles.db'
 
-# Connect to the database
-conn = sqlite3.connect(DATABASE_PATH)
-cursor = conn.cursor()
+# Where to read the vehicles from: 'sqlite', or 'parquet' for the typed copy staged by parquetstage.py
+DATA_SOURCE = 'sqlite'
+
+# Features to analyze
+features = ['price', 'year', 'odometer']
+
+# Configuration for the analysis
+analysis_config = {
+    'mode': 'in_memory',    # 'in_memory' loads the columns into a DataFrame, 'out_of_core' streams them in chunks
+    'chunk_size': 100000,   # Rows per chunk in out_of_core mode
+    'sample_size': 100000,  # Reservoir sample each detector is trained on in out_of_core mode
+    'sketch_size': 4096,    # Values kept per level of the median sketch; larger is more exact
+    'incremental': False,   # Score only rows inserted since the last run with the persisted models and statistics (SQLite only)
+    'model_file': 'vehicles_anomaly_model.pkl',  # Fitted models and running statistics kept for incremental runs
+    'store_json': True,     # Also write the flagged rows as a JSON array into data_meta.anomalies (the old format)
+    'n_jobs': None,         # Processes fitting the detectors in parallel; None uses one per feature up to the core count
+    'multivariate': False,  # Also score (price, year, odometer) jointly, stored under the feature name 'price,year,odometer'
+    'contamination': 0.1,
+    'random_state': 42
+}
 
 # Create the data_meta table if it doesn't exist
+# run_id tells apart several runs on the same analysis_date; it is the run's start time in ISO format
 create_table_query = """
 CREATE TABLE IF NOT EXISTS data_meta (
     table_name    TEXT,
     analysis_date TEXT,
+    run_id        TEXT,
     feature_name  TEXT,
     mean          REAL,
     median        REAL,
@@ -27,68 +50,474 @@ CREATE TABLE IF NOT EXISTS data_meta (
     anomalies     TEXT
 );
 """
-cursor.execute(create_table_query)
-conn.commit()
 
-# Load the vehicles data
-vehicles_df = pd.read_sql_query('SELECT * FROM vehicles', conn)
+# Flagged rows, one per anomaly, indexed for "latest anomalies of a feature" lookups and joins back to vehicles
+create_anomalies_table_query = """
+CREATE TABLE IF NOT EXISTS data_anomalies (
+    table_name    TEXT,
+    feature_name  TEXT,
+    analysis_date TEXT,
+    run_id        TEXT,
+    id            INTEGER,
+    value         REAL,
+    score         REAL
+);
+"""
+create_anomalies_index_queries = [
+    "CREATE INDEX IF NOT EXISTS idx_data_anomalies_feature ON data_anomalies (table_name, feature_name, analysis_date)",
+    "CREATE INDEX IF NOT EXISTS idx_data_anomalies_run ON data_anomalies (table_name, feature_name, run_id)",
+    "CREATE INDEX IF NOT EXISTS idx_data_anomalies_id ON data_anomalies (id)"
+]
 
-# Initialize a list to hold the meta data
-meta_data = []
+# Every row inserted into vehicles, in insertion order: listing ids are not assigned in increasing order, so
+# incremental runs find new rows by this sequence instead of by id. The trigger adds a write to every insert.
+create_load_log_queries = [
+    "CREATE TABLE IF NOT EXISTS vehicles_load_log (seq INTEGER PRIMARY KEY AUTOINCREMENT, id INTEGER NOT NULL)",
+    """CREATE TRIGGER IF NOT EXISTS vehicles_load_log_insert AFTER INSERT ON vehicles
+       BEGIN INSERT INTO vehicles_load_log (id) VALUES (NEW.id); END"""
+]
 
-# Features to analyze
-features = ['price', 'year', 'odometer']
+# Insert the meta data into the data_meta table
+insert_query = """
+INSERT INTO data_meta (table_name, analysis_date, run_id, feature_name, mean, median, std_dev, min_value, max_value, anomaly_count, anomalies)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+insert_anomalies_query = """
+INSERT INTO data_anomalies (table_name, feature_name, analysis_date, run_id, id, value, score)
+VALUES (?, ?, ?, ?, ?, ?, ?)
+"""
+
+meta_columns = ['table_name', 'analysis_date', 'run_id', 'feature_name', 'mean', 'median', 'std_dev', 'min_value', 'max_value', 'anomaly_count', 'anomalies']
+
+def add_run_id_columns(conn):
+    # Tables created before run_id existed get the column; their old rows keep a NULL run_id
+    for table_name in ('data_meta', 'data_anomalies'):
+        if 'run_id' not in [row[1] for row in conn.execute(f"PRAGMA table_info({table_name})")]:
+            conn.execute(f"ALTER TABLE {table_name} ADD COLUMN run_id TEXT")
+
+def load_vehicles(conn, columns):
+    # Only the id and the analyzed columns are read, so descriptions and URLs never leave the database
+    if DATA_SOURCE == 'parquet':
+        from parquetstage import read_vehicles
+        return read_vehicles(columns=['id'] + columns)
+    return pd.read_sql_query(f"SELECT id, {', '.join(columns)} FROM vehicles", conn)
 
-# Current date for analysis_date
-analysis_date = datetime.now().strftime('%Y-%m-%d')
-
-# Compute statistics and detect anomalies for each feature
-for feature in features:
-    if feature in vehicles_df.columns:
-        data = vehicles_df[feature].dropna().values.reshape(-1, 1)
-        data_df = vehicles_df[[feature, 'id']].dropna().reset_index(drop=True)
-        
-        # Compute statistics
-        mean = np.mean(data)
-        median = np.median(data)
-        std_dev = np.std(data)
-        min_value = np.min(data)
-        max_value = np.max(data)
-        
-        # Detect anomalies
-        clf = IsolationForest(contamination=0.1, random_state=42)
-        clf.fit(data)
-        predictions = clf.predict(data)
-        anomaly_count = np.sum(predictions == -1)
-        
-        # Collect anomaly information
-        anomalies = data_df.loc[predictions == -1, ['id', feature]].to_dict(orient='records')
-        
-        # Append the computed values to the meta_data list
+def compute_statistics(values):
+    # One vectorized pass per statistic over every feature column; NaN marks a missing value
+    return {
+        'mean': np.nanmean(values, axis=0),
+        'median': np.nanmedian(values, axis=0),
+        'std_dev': np.nanstd(values, axis=0),
+        'min_value': np.nanmin(values, axis=0),
+        'max_value': np.nanmax(values, axis=0)
+    }
+
+def detect_anomalies(data, contamination=0.1, random_state=42):
+    # Fit an IsolationForest on the (rows, features) array and score the same rows; negative scores are anomalies
+    clf = fit_detector(data, contamination, random_state)
+    return clf, clf.decision_function(data)
+
+def fit_detector(data, contamination=0.1, random_state=42):
+    return IsolationForest(contamination=contamination, random_state=random_state).fit(data)
+
+def fit_detectors(datasets, n_jobs=None, contamination=0.1, random_state=42, function=detect_anomalies):
+    # Each detector is independent, so the fits run side by side in a process pool
+    processes = min(len(datasets), n_jobs or os.cpu_count() or 1)
+    arguments = [(data, contamination, random_state) for data in datasets]
+    if processes <= 1:
+        return [function(*args) for args in arguments]
+    with mp.Pool(processes) as pool:
+        return pool.starmap(function, arguments)
+
+def anomaly_records(ids, values, names, integer_columns=()):
+    # Same records as DataFrame.to_dict(orient='records') on the flagged rows, without building the frame;
+    # a column read without missing values as integers stays integer in the JSON
+    columns = [ids.tolist()] + [values[:, index].astype(np.int64).tolist() if name in integer_columns
+                                else values[:, index].tolist() for index, name in enumerate(names)]
+    return [dict(zip(['id'] + names, record)) for record in zip(*columns)]
+
+def detector_names(columns, multivariate):
+    # One detector per feature, plus the joint one scoring every feature together
+    return columns + [','.join(columns)] if multivariate else list(columns)
+
+def detector_rows(values, index, column_count):
+    # Rows a detector scores (its features are all present) and the columns it reads
+    present_mask = ~np.isnan(values)
+    if index < column_count:
+        return present_mask[:, index], values[:, [index]]
+    return present_mask.all(axis=1), values
+
+def flag_rows(ids, data, scores):
+    # Keep only the rows the detector predicts as anomalies
+    mask = scores < 0
+    return ids[mask], data[mask], scores[mask]
+
+def concatenate_flagged(parts, width):
+    if not parts:
+        return np.empty(0, dtype=np.int64), np.empty((0, width)), np.empty(0)
+    return tuple(np.concatenate(arrays) for arrays in zip(*parts))
+
+def build_results(columns, analysis_date, run_id, statistics, flagged, integer_columns=()):
+    """data_meta rows and data_anomalies rows from per-feature statistics and per-detector flagged rows.
+
+    statistics holds (mean, median, std_dev, min, max) for each column; flagged holds
+    (ids, values, scores) for each detector in detector_names() order. integer_columns
+    are written to the JSON as integers.
+    """
+    meta_data = []
+    anomaly_data = []
+    for index, name in enumerate(detector_names(columns, len(flagged) > len(columns))):
+        ids, values, scores = flagged[index]
+        names = [name] if index < len(columns) else columns
+
+        # The joint detector has no single-column statistics or value
         meta_data.append((
             'vehicles',
             analysis_date,
-            feature,
-            mean,
-            median,
-            std_dev,
-            min_value,
-            max_value,
-            anomaly_count,
-            json.dumps(anomalies)
+            run_id,
+            name,
+            *(statistics[index] if index < len(columns) else (None,) * 5),
+            len(ids),
+            json.dumps(anomaly_records(ids, values, names, integer_columns)) if analysis_config['store_json'] else None
         ))
+        row_values = values[:, 0].tolist() if index < len(columns) else [None] * len(ids)
+        anomaly_data.extend(zip(['vehicles'] * len(ids), [name] * len(ids), [analysis_date] * len(ids), [run_id] * len(ids),
+                                ids.tolist(), row_values, scores.tolist()))
+    return meta_data, anomaly_data
 
-# Insert the meta data into the data_meta table
-insert_query = """
-INSERT INTO data_meta (table_name, analysis_date, feature_name, mean, median, std_dev, min_value, max_value, anomaly_count, anomalies)
-VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-"""
-cursor.executemany(insert_query, meta_data)
-conn.commit()
+def analyze(vehicles_df, analysis_date, run_id):
+    present = [feature for feature in features if feature in vehicles_df.columns]
+    ids = vehicles_df['id'].to_numpy()
+    values = vehicles_df[present].to_numpy(dtype=float)
+    present_mask = ~np.isnan(values)
+    multivariate = analysis_config['multivariate']
+
+    with span('anomalies', 'statistics') as statistics:
+        stats = compute_statistics(values)
+        statistics.add(rows=len(values))
+
+    # One dataset per feature with that feature's missing values dropped, plus the joint one if requested
+    detectors = [detector_rows(values, index, len(present)) for index in range(len(detector_names(present, multivariate)))]
+    datasets = [data[rows] for rows, data in detectors]
+
+    with span('anomalies', 'detect') as detect:
+        results = fit_detectors(datasets, analysis_config['n_jobs'], analysis_config['contamination'],
+                                analysis_config['random_state'])
+        detect.add(rows=sum(len(data) for data in datasets))
+
+    flagged = [flag_rows(ids[rows], data, scores) for (rows, _), data, (_, scores) in zip(detectors, datasets, results)]
+    statistics = [tuple(stats[name][index] for name in ('mean', 'median', 'std_dev', 'min_value', 'max_value'))
+                  for index in range(len(present))]
+    integer_columns = [column for column in present if pd.api.types.is_integer_dtype(vehicles_df[column])]
+    meta_data, anomaly_data = build_results(present, analysis_date, run_id, statistics, flagged, integer_columns)
+
+    # Running statistics and sketches let later incremental runs extend these results
+    state = new_state(present, multivariate, analysis_date, [model for model, _ in results])
+    state['stats'].update(values)
+    for index, sketch in enumerate(state['sketches']):
+        sketch.update(values[:, index])
+    return meta_data, anomaly_data, state
+
+class RunningStats:
+    """Count, mean, variance, min and max of every column, merged chunk by chunk (Welford/Chan) and ignoring NaN."""
+
+    def __init__(self, width):
+        self.count = np.zeros(width)
+        self.mean = np.zeros(width)
+        self.m2 = np.zeros(width)
+        self.min = np.full(width, np.inf)
+        self.max = np.full(width, -np.inf)
+
+    def update(self, values):
+        present = ~np.isnan(values)
+        count = present.sum(axis=0)
+        filled = np.where(present, values, 0.0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.where(count > 0, filled.sum(axis=0) / count, 0.0)
+        m2 = (np.where(present, values - mean, 0.0) ** 2).sum(axis=0)
+
+        total = self.count + count
+        delta = mean - self.mean
+        with np.errstate(invalid='ignore', divide='ignore'):
+            self.mean = np.where(total > 0, self.mean + delta * count / total, 0.0)
+            self.m2 = np.where(total > 0, self.m2 + m2 + delta ** 2 * self.count * count / total, 0.0)
+        self.count = total
+        self.min = np.fmin(self.min, np.nanmin(np.where(present, values, np.inf), axis=0))
+        self.max = np.fmax(self.max, np.nanmax(np.where(present, values, -np.inf), axis=0))
+
+    @property
+    def std_dev(self):
+        # Population standard deviation, as np.std computes it
+        return np.sqrt(self.m2 / self.count)
+
+class QuantileSketch:
+    """Quantile sketch in the KLL style: full levels are sorted and every other value is promoted
+    with twice the weight, so memory grows with log(n) while rank error stays around 1/sketch_size."""
+
+    def __init__(self, size=4096, seed=42):
+        self.size = size
+        self.levels = [np.empty(0)]
+        self.rng = np.random.default_rng(seed)
+
+    def update(self, values):
+        self.levels[0] = np.concatenate([self.levels[0], values[~np.isnan(values)]])
+        level = 0
+        while len(self.levels[level]) >= 2 * self.size:
+            compacted = np.sort(self.levels[level])
+            keep = len(compacted) % 2
+            if level + 1 == len(self.levels):
+                self.levels.append(np.empty(0))
+            self.levels[level + 1] = np.concatenate([self.levels[level + 1], compacted[keep + self.rng.integers(2)::2]])
+            self.levels[level] = compacted[:keep]
+            level += 1
+
+    def quantile(self, q):
+        values = np.concatenate(self.levels)
+        if not len(values):
+            return np.nan
+        weights = np.concatenate([np.full(len(level), 2.0 ** height) for height, level in enumerate(self.levels)])
+        order = np.argsort(values, kind='stable')
+        cumulative = np.cumsum(weights[order])
+        return values[order][np.searchsorted(cumulative, q * cumulative[-1])]
+
+class Reservoir:
+    """Uniform sample of at most size rows from a stream of row chunks (Algorithm R, one chunk at a time)."""
+
+    def __init__(self, size, width, seed=42):
+        self.size = size
+        self.rows = np.empty((size, width))
+        self.seen = 0
+        self.rng = np.random.default_rng(seed)
+
+    def add(self, rows):
+        # Fill the empty slots first, then row t replaces a random slot with probability size / (t + 1)
+        fill = min(max(self.size - self.seen, 0), len(rows))
+        self.rows[self.seen:self.seen + fill] = rows[:fill]
+        rest = rows[fill:]
+        positions = self.seen + fill + np.arange(len(rest))
+        slots = self.rng.integers(0, positions + 1) if len(rest) else positions
+        chosen = slots < self.size
+        self.rows[slots[chosen]] = rest[chosen]
+        self.seen += len(rows)
+
+    @property
+    def sample(self):
+        return self.rows[:min(self.seen, self.size)]
+
+def current_load_seq(conn):
+    return conn.execute("SELECT coalesce(max(seq), 0) FROM vehicles_load_log").fetchone()[0]
+
+def iter_vehicle_chunks(conn, columns, chunk_size, load_seqs=None):
+    """Yield (ids, values) arrays chunk by chunk; missing values are NaN.
+
+    load_seqs, a (low, high) pair, restricts the rows to those inserted with a
+    vehicles_load_log sequence in (low, high]; it needs the SQLite source.
+    """
+    if DATA_SOURCE == 'parquet':
+        if load_seqs is not None:
+            raise ValueError("Incremental runs need the SQLite source; Parquet has no insertion order.")
+        from parquetstage import iter_vehicle_batches
+        for batch in iter_vehicle_batches(columns=['id'] + columns, batch_size=chunk_size):
+            frame = batch.to_pandas()
+            yield frame['id'].to_numpy(), frame[columns].to_numpy(dtype=float)
+        return
+
+    cursor = conn.cursor()
+    if load_seqs is None:
+        cursor.execute(f"SELECT id, {', '.join(columns)} FROM vehicles")
+    else:
+        # A row replaced several times is logged several times but scored once
+        cursor.execute(f"SELECT id, {', '.join(columns)} FROM vehicles WHERE id IN "
+                       f"(SELECT id FROM vehicles_load_log WHERE seq > ? AND seq <= ?)", load_seqs)
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            break
+        chunk = np.array(rows, dtype=float)
+        yield chunk[:, 0].astype(np.int64), chunk[:, 1:]
+    cursor.close()
+
+def new_state(columns, multivariate, analysis_date, models):
+    return {
+        'features': list(features),
+        'columns': columns,
+        'multivariate': multivariate,
+        'analysis_date': analysis_date,
+        'load_seq': None,
+        'models': models,
+        'stats': RunningStats(len(columns)),
+        'sketches': [QuantileSketch(analysis_config['sketch_size'], analysis_config['random_state'] + index)
+                     for index in range(len(columns))]
+    }
+
+def running_statistics(state):
+    stats = state['stats']
+    return [(stats.mean[index], sketch.quantile(0.5), stats.std_dev[index], stats.min[index], stats.max[index])
+            for index, sketch in enumerate(state['sketches'])]
+
+def score_chunks(conn, state, load_seqs=None):
+    """Stream the rows (all, or those inserted within load_seqs) through the state's models, updating its statistics.
+
+    Returns the flagged (ids, values, scores) of every detector and the number of rows read.
+    """
+    columns = state['columns']
+    parts = [[] for _ in state['models']]
+    row_count = 0
+    for ids, values in iter_vehicle_chunks(conn, columns, analysis_config['chunk_size'], load_seqs):
+        state['stats'].update(values)
+        for index, sketch in enumerate(state['sketches']):
+            sketch.update(values[:, index])
+        for index, model in enumerate(state['models']):
+            rows, data = detector_rows(values, index, len(columns))
+            if rows.any():
+                parts[index].append(flag_rows(ids[rows], data[rows], model.decision_function(data[rows])))
+        row_count += len(ids)
+    flagged = [concatenate_flagged(part, 1 if index < len(columns) else len(columns)) for index, part in enumerate(parts)]
+    return flagged, row_count
+
+def analyze_out_of_core(conn, analysis_date, run_id):
+    """Same output as analyze() with memory bounded by the chunk, sample and sketch sizes.
+
+    The first pass streams the table into reservoir samples; the detectors are trained
+    on the samples; the second pass scores every row chunk by chunk while running
+    statistics and median sketches accumulate. The median is approximate, the rest exact.
+    """
+    columns = [column for column in features if column in vehicle_columns(conn)]
+    seed = analysis_config['random_state']
+    multivariate = analysis_config['multivariate']
+    # One seed per detector: with a shared seed, columns without missing values would all sample the same rows
+    reservoirs = [Reservoir(analysis_config['sample_size'], 1, seed + index) for index in range(len(columns))]
+    if multivariate:
+        reservoirs.append(Reservoir(analysis_config['sample_size'], len(columns), seed + len(columns)))
+
+    with span('anomalies', 'sample') as sample:
+        for ids, values in iter_vehicle_chunks(conn, columns, analysis_config['chunk_size']):
+            for index, reservoir in enumerate(reservoirs):
+                rows, data = detector_rows(values, index, len(columns))
+                reservoir.add(data[rows])
+            sample.add(rows=len(ids))
+
+    with span('anomalies', 'fit') as fit:
+        models = fit_detectors([reservoir.sample for reservoir in reservoirs], analysis_config['n_jobs'],
+                               analysis_config['contamination'], seed, function=fit_detector)
+        fit.add(rows=sum(len(reservoir.sample) for reservoir in reservoirs))
+
+    state = new_state(columns, multivariate, analysis_date, models)
+    with span('anomalies', 'score') as score:
+        flagged, row_count = score_chunks(conn, state)
+        score.add(rows=row_count)
+
+    meta_data, anomaly_data = build_results(columns, analysis_date, run_id, running_statistics(state), flagged)
+    return meta_data, anomaly_data, state
+
+def analyze_incremental(conn, analysis_date, run_id, state):
+    """Score only the rows inserted since the run that saved state, reusing its fitted models.
+
+    New rows are found through vehicles_load_log, not by id: listing ids are not
+    assigned in increasing order. The data_meta statistics cover every row analyzed
+    so far; anomaly_count covers this run.
+    """
+    previous_date, previous_seq = state['analysis_date'], state['load_seq']
+    load_seq = current_load_seq(conn)
+    with span('anomalies', 'score_incremental') as score:
+        flagged, row_count = score_chunks(conn, state, (previous_seq, load_seq))
+        score.add(rows=row_count)
+    print(f"Scored {row_count} rows inserted since {previous_date} (load sequence {previous_seq} to {load_seq}).")
+    state['analysis_date'] = analysis_date
+    state['load_seq'] = load_seq
+    meta_data, anomaly_data = build_results(state['columns'], analysis_date, run_id, running_statistics(state), flagged)
+    return meta_data, anomaly_data, state
+
+def load_state(model_file):
+    # The saved state only applies while the analyzed features and detectors are unchanged
+    if not model_file or not os.path.exists(model_file):
+        return None
+    with open(model_file, 'rb') as f:
+        state = pickle.load(f)
+    if state['features'] != features or state['multivariate'] != analysis_config['multivariate']:
+        print(f"Ignoring '{model_file}': it was saved for different features; running a full analysis.")
+        return None
+    if state.get('load_seq') is None:
+        print(f"Ignoring '{model_file}': it has no load sequence to continue from; running a full analysis.")
+        return None
+    return state
+
+def save_state(model_file, state):
+    # Write to a temporary file and rename it so a crash never leaves a half-written model file
+    temp_file = f'{model_file}.tmp'
+    with open(temp_file, 'wb') as f:
+        pickle.dump(state, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_file, model_file)
+
+def vehicle_columns(conn):
+    if DATA_SOURCE == 'parquet':
+        from parquetstage import vehicles_dataset
+        return vehicles_dataset().schema.names
+    return [row[1] for row in conn.execute("PRAGMA table_info(vehicles)")]
+
+def main():
+    # Connect to the database
+    conn = sqlite3.connect(DATABASE_PATH)
+    cursor = conn.cursor()
+    cursor.execute(create_table_query)
+    cursor.execute(create_anomalies_table_query)
+    add_run_id_columns(conn)
+    for query in create_anomalies_index_queries:
+        cursor.execute(query)
+    if DATA_SOURCE == 'sqlite':
+        for query in create_load_log_queries:
+            cursor.execute(query)
+    conn.commit()
+
+    # Current date for analysis_date; the full start time identifies this run among the day's runs
+    started_at = datetime.now()
+    analysis_date = started_at.strftime('%Y-%m-%d')
+    run_id = started_at.isoformat(timespec='microseconds')
+
+    # Compute statistics and detect anomalies for every feature
+    state = None
+    if analysis_config['incremental'] and DATA_SOURCE != 'sqlite':
+        print("Incremental runs need the SQLite source to find new rows; running a full analysis.")
+    elif analysis_config['incremental']:
+        state = load_state(analysis_config['model_file'])
+    # A full run covers every row logged so far; rows inserted while it reads may be scored again by the next run
+    load_seq = current_load_seq(conn) if DATA_SOURCE == 'sqlite' and state is None else None
+    if state is not None:
+        meta_data, anomaly_data, state = analyze_incremental(conn, analysis_date, run_id, state)
+    elif analysis_config['mode'] == 'out_of_core':
+        meta_data, anomaly_data, state = analyze_out_of_core(conn, analysis_date, run_id)
+    else:
+        with span('anomalies', f'read_{DATA_SOURCE}') as read:
+            vehicles_df = load_vehicles(conn, features)
+            read.add(rows=len(vehicles_df), bytes=int(vehicles_df.memory_usage(deep=True).sum()))
+        meta_data, anomaly_data, state = analyze(vehicles_df, analysis_date, run_id)
+    if load_seq is not None:
+        state['load_seq'] = load_seq
+
+    # The summary rows and the flagged rows are committed together
+    with span('anomalies', 'write') as write:
+        cursor.executemany(insert_query, meta_data)
+        cursor.executemany(insert_anomalies_query, anomaly_data)
+        conn.commit()
+        write.add(rows=len(meta_data) + len(anomaly_data))
+
+    # Saved only after the commit, so a failed write is retried from the previous state
+    if analysis_config['model_file']:
+        save_state(analysis_config['model_file'], state)
+        # The saved state has moved past these log entries, so they are no longer needed
+        if state['load_seq'] is not None:
+            conn.execute("DELETE FROM vehicles_load_log WHERE seq <= ?", (state['load_seq'],))
+            conn.commit()
+
+    # Print the meta data
+    meta_df = pd.DataFrame(meta_data, columns=meta_columns)
+    print(meta_df)
 
-# Print the meta data
-meta_df = pd.DataFrame(meta_data, columns=['table_name', 'analysis_date', 'feature_name', 'mean', 'median', 'std_dev', 'min_value', 'max_value', 'anomaly_count', 'anomalies'])
-print(meta_df)
+    # Close the connection
+    conn.close()
 
-# Close the connection
-conn.close()
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+import filecmp
+import json
+import os
+import sys
+import tempfile
+import time
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import csvtojson
+
+# Benchmark settings
+sample_csv_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'vehiclestest.csv')
+repeat_count = 2000  # Copies of the sample rows in the benchmark input
+chunk_size = 50000
+
+def legacy_process_csv(csv_file_path, chunk_size=50000):
+    # The previous implementation: pandas to_json, then json.loads + json.dumps for every record
+    chunk_number = 0
+    for chunk in pd.read_csv(csv_file_path, chunksize=chunk_size, encoding='utf-8'):
+        json_data = chunk.to_json(orient='records', lines=True)
+        json_objects = json_data.splitlines()
+        with open(f'output_{chunk_number}.json', 'w', encoding='utf-8') as json_file:
+            for json_obj in json_objects:
+                json_file.write(json.dumps(json.loads(json_obj), ensure_ascii=False) + '\n')
+        chunk_number += 1
+
+def build_input(directory):
+    # Repeat the sample rows to get an input large enough to time
+    with open(sample_csv_file, 'r', encoding='utf-8', newline='') as f:
+        header = f.readline()
+        body = f.read()
+    if not body.endswith('\n'):
+        body += '\n'
+    input_file = os.path.join(directory, 'input.csv')
+    with open(input_file, 'w', encoding='utf-8', newline='') as f:
+        f.write(header)
+        for _ in range(repeat_count):
+            f.write(body)
+    return input_file
+
+def run(name, function, input_file, directory, **kwargs):
+    os.makedirs(directory)
+    os.chdir(directory)
+    start_time = time.perf_counter()
+    function(input_file, chunk_size, **kwargs)
+    elapsed = time.perf_counter() - start_time
+    output_bytes = sum(os.path.getsize(file_name) for file_name in os.listdir(directory))
+    print(f"{name:<16} {elapsed:8.2f}s  {output_bytes / 1e6:8.1f} MB")
+    return sorted(os.listdir(directory))
+
+def main():
+    with tempfile.TemporaryDirectory() as directory:
+        input_file = build_input(directory)
+        print(f"Input: {os.path.getsize(input_file) / 1e6:.1f} MB")
+        legacy_dir = os.path.join(directory, 'legacy')
+        current_dir = os.path.join(directory, 'current')
+        legacy_files = run('legacy (pandas)', legacy_process_csv, input_file, legacy_dir)
+        current_files = run('single pass', csvtojson.process_csv, input_file, current_dir)
+        if csvtojson.orjson is not None:
+            run('single pass+orjson', csvtojson.process_csv, input_file, os.path.join(directory, 'orjson'), encoder='orjson')
+        run('single pass+gzip', csvtojson.process_csv, input_file, os.path.join(directory, 'gzip'), compression='gzip')
+        run('parallel', csvtojson.process_csv_parallel, input_file, os.path.join(directory, 'parallel'))
+        os.chdir(directory)
+
+        # The default single-pass output must match the legacy files byte for byte
+        match = legacy_files == current_files and all(
+            filecmp.cmp(os.path.join(legacy_dir, name), os.path.join(current_dir, name), shallow=False)
+            for name in legacy_files)
+        print(f"Byte-identical to legacy output: {match}")
+
+if __name__ == "__main__":
+    main()
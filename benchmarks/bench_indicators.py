@@ -0,0 +1,117 @@
+import argparse
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import indicators
+from pricestore import PriceStore
+
+# Benchmark settings: a synthetic S&P 500 with three years of daily bars
+ticker_count = 500
+day_count = 756
+seed = 42
+repeat_count = 3  # Best of this many runs is reported
+
+def synthetic_panel(tickers, days):
+    # Geometric random walks with a plausible spread of prices, ranges and volumes
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range('2021-10-18', periods=days).to_numpy()
+    close = rng.uniform(20, 500, (tickers, 1)) * np.exp(np.cumsum(rng.normal(0, 0.02, (tickers, days)), axis=1))
+    spread = close * rng.uniform(0.002, 0.03, (tickers, days))
+    panel = {
+        'Close': close.astype(np.float32).astype(float),
+        'High': (close + spread).astype(np.float32).astype(float),
+        'Low': (close - spread).astype(np.float32).astype(float),
+        'Volume': rng.integers(100000, 50000000, (tickers, days)).astype(float)
+    }
+    return dates, panel
+
+def legacy_indicators(dates, panel, config):
+    # One pandas frame per ticker, one rolling/ewm call per indicator, as plot_transactional_data did for its moving averages
+    results = []
+    for row in range(len(panel['Close'])):
+        data = pd.DataFrame({column: panel[column][row] for column in indicators.panel_columns}, index=dates)
+        close = data['Close']
+        for window in config['sma']:
+            data[f'sma_{window}'] = close.rolling(window=window).mean()
+        for ema_span in config['ema']:
+            data[f'ema_{ema_span}'] = close.ewm(span=ema_span, adjust=False).mean()
+        change = close.diff()
+        gain = change.clip(lower=0).ewm(alpha=1 / config['rsi'], adjust=False).mean()
+        loss = (-change).clip(lower=0).ewm(alpha=1 / config['rsi'], adjust=False).mean()
+        data[f"rsi_{config['rsi']}"] = 100 * gain / (gain + loss)
+        window, width = config['bollinger']
+        middle = close.rolling(window).mean()
+        deviation = close.rolling(window).std(ddof=0)
+        data['bollinger_middle'] = middle
+        data['bollinger_upper'] = middle + width * deviation
+        data['bollinger_lower'] = middle - width * deviation
+        typical = (data['High'] + data['Low'] + close) / 3
+        data[f"vwap_{config['vwap']}"] = (typical * data['Volume']).rolling(config['vwap']).sum() / data['Volume'].rolling(config['vwap']).sum()
+        data['returns'] = close.pct_change()
+        data[f"volatility_{config['volatility']}"] = np.log(close / close.shift()).rolling(config['volatility']).std() \
+            * np.sqrt(config['periods_per_year'])
+        results.append(data)
+    return results
+
+def best_time(function, *args, **kwargs):
+    elapsed = []
+    for _ in range(repeat_count):
+        start_time = time.perf_counter()
+        result = function(*args, **kwargs)
+        elapsed.append(time.perf_counter() - start_time)
+    return min(elapsed), result
+
+def max_difference(engine, legacy, skip_warmup):
+    # Largest difference where both have a value; the engine leaves recursive indicators NaN during their warm-up
+    worst = 0.0
+    for name, values in engine.items():
+        reference = np.stack([data[name].to_numpy() for data in legacy])
+        both = ~np.isnan(values) & ~np.isnan(reference)
+        if name.split('_')[0] in skip_warmup:
+            both[:, :200] = False
+        if both.any():
+            worst = max(worst, float(np.max(np.abs(values[both] - reference[both]) / np.abs(reference[both]).clip(1e-9))))
+    return worst
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the indicator engine against per-ticker pandas.')
+    parser.add_argument('--tickers', type=int, default=ticker_count)
+    parser.add_argument('--days', type=int, default=day_count)
+    args = parser.parse_args()
+    config = indicators.indicator_config
+    tickers = [f'T{row:03d}' for row in range(args.tickers)]
+    dates, panel = synthetic_panel(args.tickers, args.days)
+    print(f"Panel: {args.tickers} tickers x {args.days} days")
+
+    legacy_time, legacy = best_time(legacy_indicators, dates, panel, config)
+    full_time, (_, engine, _) = best_time(indicators.compute_indicators, tickers, dates, panel)
+    print(f"{'pandas per ticker':<26} {legacy_time * 1000:9.1f} ms")
+    print(f"{'engine, full':<26} {full_time * 1000:9.1f} ms  ({legacy_time / full_time:.0f}x, {len(engine)} series per ticker)")
+
+    # A new daily bar on top of the state saved by the previous day's run, which also recomputes that day's last bar
+    history = {column: values[:, :-1] for column, values in panel.items()}
+    _, _, state = indicators.compute_indicators(tickers, dates[:-1], history)
+    update_time, (_, update, _) = best_time(indicators.compute_indicators, tickers, dates, panel, state=state)
+    print(f"{'engine, one new day':<26} {update_time * 1000:9.1f} ms  ({full_time / update_time:.0f}x faster than full)")
+
+    # Loading the panel from the columnar price store
+    with tempfile.TemporaryDirectory() as directory:
+        store = PriceStore(directory)
+        for row, ticker_symbol in enumerate(tickers):
+            store.append(ticker_symbol, pd.DataFrame({'Date': dates, 'Open': panel['Close'][row], 'Adj Close': panel['Close'][row],
+                                                      **{column: panel[column][row] for column in indicators.panel_columns}}))
+        load_time, _ = best_time(indicators.load_panel, tickers, store=store)
+        print(f"{'load panel from store':<26} {load_time * 1000:9.1f} ms")
+
+    # pandas ewm does not skip the warm-up bars, so the recursive indicators are compared once they have settled
+    print(f"Max relative difference to pandas: {max_difference(engine, legacy, {'ema', 'rsi'}):.2e}")
+    incremental = max(float(np.nanmax(np.abs(update[name] - engine[name][:, -update[name].shape[1]:]))) for name in engine)
+    print(f"Max difference of the incremental update to the full run: {incremental:.2e}")
+
+if __name__ == "__main__":
+    main()
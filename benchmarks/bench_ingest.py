@@ -0,0 +1,312 @@
+import argparse
+import csv
+import json
+import multiprocessing as mp
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+benchmarks_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(benchmarks_dir, '..'))
+from metrics import peak_rss_bytes
+
+# Benchmark settings; the local stand-ins are picked up from the environment
+bench_config = {
+    'sizes': [10000, 100000, 1000000],  # Rows in each synthetic vehicles CSV; add 10000000 with --sizes (~20 GB)
+    'seed': 42,
+    'data_dir': os.path.join(benchmarks_dir, 'data'),  # Generated CSVs are kept here and reused across runs
+    'results_file': os.path.join(benchmarks_dir, 'ingest_results.jsonl'),
+    'postgres_dsn': os.environ.get('BENCH_POSTGRES_DSN'),  # e.g. from pg_tmp or a Docker postgres; unset skips Postgres
+    'mongo_uri': os.environ.get('BENCH_MONGO_URI')         # A local mongod; unset falls back to mongomock
+}
+
+# Header of the real vehicles export, in file order
+vehicle_header = [
+    'id', 'url', 'region', 'region_url', 'price', 'year', 'manufacturer', 'model', 'condition', 'cylinders',
+    'fuel', 'odometer', 'title_status', 'transmission', 'VIN', 'drive', 'size', 'type', 'paint_color',
+    'image_url', 'description', 'county', 'state', 'lat', 'long', 'posting_date'
+]
+
+# Value pools for the synthetic listings
+regions = {
+    'auburn': ('al', 32.6, -85.5), 'bellingham': ('wa', 48.8, -122.5), 'el paso': ('tx', 31.8, -106.4),
+    'hudson valley': ('ny', 41.7, -74.0), 'prescott': ('az', 34.5, -112.5), 'fayetteville': ('ar', 36.1, -94.2),
+    'sacramento': ('ca', 38.6, -121.5), 'denver': ('co', 39.7, -105.0), 'orlando': ('fl', 28.5, -81.4),
+    'chicago': ('il', 41.9, -87.6), 'boston': ('ma', 42.4, -71.1), 'portland': ('or', 45.5, -122.7)
+}
+models = {
+    'ford': ['f-150', 'ranger', 'escape', 'mustang gt', 'explorer xlt'], 'chevrolet': ['silverado 1500', 'malibu', 'tahoe lt'],
+    'toyota': ['camry', 'corolla le', 'tacoma sr5', 'rav4'], 'honda': ['civic', 'accord ex-l', 'cr-v'],
+    'gmc': ['sierra 1500 crew cab slt', 'acadia'], 'hyundai': ['elantra se', 'sonata'], 'nissan': ['altima 2.5 s', 'rogue'],
+    'jeep': ['wrangler unlimited', 'grand cherokee'], 'ram': ['1500', '2500'], 'bmw': ['3 series 328i', 'x5']
+}
+conditions = ['good', 'excellent', 'like new', 'fair', 'new', 'salvage']
+cylinder_values = ['4 cylinders', '6 cylinders', '8 cylinders', '5 cylinders', 'other']
+fuels = ['gas', 'gas', 'gas', 'diesel', 'hybrid', 'electric', 'other']
+title_statuses = ['clean', 'clean', 'clean', 'rebuilt', 'salvage', 'lien']
+transmissions = ['automatic', 'automatic', 'manual', 'other']
+drives = ['4wd', 'fwd', 'rwd']
+sizes = ['full-size', 'mid-size', 'compact', 'sub-compact']
+types = ['pickup', 'sedan', 'SUV', 'truck', 'coupe', 'hatchback', 'wagon', 'van', 'other']
+paint_colors = ['white', 'black', 'silver', 'grey', 'blue', 'red', 'green', 'custom']
+description_words = (
+    'Carvana is the safer way to buy a car During these uncertain times, "contactless" delivery and pickup '
+    'financing available clean title one owner no accidents call or text today, we finance everyone! '
+    'low miles new tires runs great warranty included trade-ins welcome 100% online Price: $ ext. color '
+    'interior features: leather seats, backup camera, bluetooth, navigation, heated seats, sunroof'
+).split(' ')
+
+# Share of listings that only carry id, url, region, price and state (54% in the sample export),
+# and the extra chance of each detail column being empty on a full listing
+bare_listing_rate = 0.54
+detail_null_rates = {'cylinders': 0.3, 'VIN': 0.2, 'drive': 0.5, 'size': 0.9, 'type': 0.05, 'paint_color': 0.1}
+
+def build_description_corpus(rng, size=1 << 20):
+    # One shared block of listing text; descriptions are random slices so long text costs little to generate
+    words = []
+    length = 0
+    while length < size:
+        word = rng.choice(description_words)
+        if rng.random() < 0.02:
+            word += '\n'
+        words.append(word)
+        length += len(word) + 1
+    return ' '.join(words)
+
+def synthetic_row(rng, row_id, corpus):
+    region, (state, lat, long) = rng.choice(list(regions.items()))
+    manufacturer = rng.choice(list(models))
+    model = rng.choice(models[manufacturer])
+    year = rng.randint(1995, 2021)
+    slug = f"{region.split(' ')[0]}-{year}-{manufacturer}-{model.replace(' ', '-')}"
+    row = dict.fromkeys(vehicle_header, '')
+    row.update({
+        'id': row_id,
+        'url': f'https://{region.replace(" ", "")}.craigslist.org/ctd/d/{slug}/{row_id}.html',
+        'region': region,
+        'region_url': f'https://{region.replace(" ", "")}.craigslist.org',
+        'price': rng.choice([0, rng.randint(500, 80000), rng.randint(1000, 40000)]),
+        'state': state
+    })
+    if rng.random() < bare_listing_rate:
+        return row
+
+    # Descriptions run from a line to ~5 KB, most of them near the upper end like the real export
+    description_length = rng.randint(60, 800) if rng.random() < 0.2 else rng.randint(4000, 5000)
+    start = rng.randrange(len(corpus) - description_length)
+    posted = datetime(2021, 4, 1) + timedelta(seconds=rng.randrange(40 * 86400))
+    row.update({
+        'year': year,
+        'manufacturer': manufacturer,
+        'model': model,
+        'condition': rng.choice(conditions),
+        'cylinders': rng.choice(cylinder_values),
+        'fuel': rng.choice(fuels),
+        'odometer': rng.randint(0, 250000),
+        'title_status': rng.choice(title_statuses),
+        'transmission': rng.choice(transmissions),
+        'VIN': ''.join(rng.choice('0123456789ABCDEFGHJKLMNPRSTUVWXYZ') for _ in range(17)),
+        'drive': rng.choice(drives),
+        'size': rng.choice(sizes),
+        'type': rng.choice(types),
+        'paint_color': rng.choice(paint_colors),
+        'image_url': f'https://images.craigslist.org/00{row_id % 100000:05d}_600x450.jpg',
+        'description': corpus[start:start + description_length].strip(),
+        'lat': round(lat + rng.uniform(-0.5, 0.5), 4),
+        'long': round(long + rng.uniform(-0.5, 0.5), 4),
+        'posting_date': posted.strftime('%Y-%m-%dT%H:%M:%S-0500')
+    })
+    for column, null_rate in detail_null_rates.items():
+        if rng.random() < null_rate:
+            row[column] = ''
+    return row
+
+def generate_vehicles_csv(rows, seed=42, data_dir=bench_config['data_dir']):
+    """Write (or reuse) a synthetic vehicles CSV with the real 26-column header and return its path."""
+    os.makedirs(data_dir, exist_ok=True)
+    csv_file = os.path.join(data_dir, f'vehicles_{rows}_{seed}.csv')
+    if os.path.exists(csv_file):
+        return csv_file
+
+    rng = random.Random(seed)
+    corpus = build_description_corpus(rng)
+    temp_file = f'{csv_file}.tmp'
+    with open(temp_file, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=vehicle_header)
+        writer.writeheader()
+        for index in range(rows):
+            writer.writerow(synthetic_row(rng, 7200000000 + index, corpus))
+    os.replace(temp_file, csv_file)
+    return csv_file
+
+def directory_size(path):
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+def run_sqlite(csv_file, work_dir):
+    import sqlite3
+    import sqllite
+    database_file = os.path.join(work_dir, 'vehicles.db')
+    conn = sqlite3.connect(database_file)
+    conn.execute(sqllite.create_table_query)
+    sqllite.configure_for_load(conn, sqllite.load_config['cache_size_kib'])
+    row_count = sqllite.load(conn, csv_file, sqllite.load_config['batch_size'])
+    sqllite.finish_load(conn)
+    conn.close()
+    return row_count, sqllite.database_size(database_file)
+
+def connect_postgres(module):
+    import psycopg2
+    conn = psycopg2.connect(bench_config['postgres_dsn'])
+    cur = conn.cursor()
+    cur.execute("DROP TABLE IF EXISTS vehicles;")
+    cur.execute(module.create_table_query)
+    conn.commit()
+    return conn
+
+def postgres_table_size(conn):
+    cur = conn.cursor()
+    cur.execute("SELECT pg_total_relation_size('vehicles');")
+    return cur.fetchone()[0]
+
+def run_postgres(csv_file, work_dir, mode):
+    import postgres
+    conn = connect_postgres(postgres)
+    if mode == 'bulk':
+        row_count, _ = postgres.bulk_load(conn, csv_file, postgres.load_config['batch_size'],
+                                          postgres.load_config['commit_interval'])
+    else:
+        row_count = postgres.row_load(conn, csv_file)
+    output_bytes = postgres_table_size(conn)
+    conn.close()
+    return row_count, output_bytes
+
+def run_postgrestst(csv_file, work_dir):
+    import postgrestst
+    conn = connect_postgres(postgrestst)
+    row_count = postgrestst.load(conn, csv_file, postgrestst.checkpoints['batch_size'])
+    output_bytes = postgres_table_size(conn)
+    conn.close()
+    return row_count, output_bytes
+
+def run_mongodb(csv_file, work_dir, mode):
+    import mongodbvehicles
+    if bench_config['mongo_uri']:
+        from pymongo import MongoClient
+        client = MongoClient(bench_config['mongo_uri'])
+    else:
+        import mongomock
+        client = mongomock.MongoClient()
+    collection = client['bench_vehicles']['vehicles']
+    collection.drop()
+    row_count = mongodbvehicles.load(collection, csv_file, mongodbvehicles.load_config['batch_size'],
+                                     concurrency=mongodbvehicles.load_config['concurrency'], mode=mode)
+    # mongomock has no collStats, so the in-memory stand-in reports no output size
+    output_bytes = client['bench_vehicles'].command('collStats', 'vehicles')['storageSize'] if bench_config['mongo_uri'] else None
+    client.close()
+    return row_count, output_bytes
+
+def run_csvtojson(csv_file, work_dir, parallel=False):
+    import csvtojson
+    os.chdir(work_dir)
+    if parallel:
+        row_count = sum(entry['rows'] for entry in csvtojson.process_csv_parallel(csv_file))
+    else:
+        row_count = csvtojson.process_csv(csv_file)
+    return row_count, directory_size(work_dir)
+
+# Benchmark cases: (function, extra arguments, largest input it is run on or None for every size)
+bench_cases = {
+    'sqlite': (run_sqlite, (), None),
+    'postgres_bulk': (run_postgres, ('bulk',), None),
+    'postgres_row': (run_postgres, ('row',), 100000),  # One commit per row; larger inputs take hours
+    'postgrestst': (run_postgrestst, (), None),
+    'mongodb_upsert': (run_mongodb, ('upsert',), None),
+    'mongodb_insert': (run_mongodb, ('insert',), None),
+    'csvtojson': (run_csvtojson, (), None),
+    'csvtojson_parallel': (run_csvtojson, (True,), None)
+}
+
+def is_available(case):
+    # Postgres needs a DSN; MongoDB needs a local mongod or mongomock
+    if case.startswith('postgres'):
+        return bool(bench_config['postgres_dsn'])
+    if case.startswith('mongodb') and not bench_config['mongo_uri']:
+        try:
+            import mongomock  # noqa: F401
+        except ImportError:
+            return False
+    return True
+
+def run_case(case, csv_file, connection):
+    # Runs in a fresh process so the peak RSS belongs to this case alone
+    function, arguments, _ = bench_cases[case]
+    work_dir = tempfile.mkdtemp(prefix=f'bench_{case}_')
+    try:
+        start_time = time.perf_counter()
+        row_count, output_bytes = function(csv_file, work_dir, *arguments)
+        seconds = time.perf_counter() - start_time
+    finally:
+        os.chdir(benchmarks_dir)
+        shutil.rmtree(work_dir, ignore_errors=True)
+    connection.send({'rows': row_count, 'seconds': round(seconds, 3), 'output_bytes': output_bytes,
+                     'peak_rss_bytes': peak_rss_bytes()})
+
+def run_in_process(context, case, csv_file):
+    # A plain (non-daemon) process, so cases such as csvtojson_parallel can start their own pool
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=run_case, args=(case, csv_file, sender))
+    process.start()
+    sender.close()
+    try:
+        return receiver.recv()
+    except EOFError:
+        raise RuntimeError(f"Benchmark case {case} failed") from None
+    finally:
+        process.join()
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=benchmarks_dir, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the vehicles loaders and converters on synthetic data.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=bench_config['sizes'])
+    parser.add_argument('--cases', nargs='+', choices=list(bench_cases), default=list(bench_cases))
+    parser.add_argument('--results-file', default=bench_config['results_file'])
+    args = parser.parse_args()
+
+    run_info = {'run_at': datetime.now().isoformat(timespec='seconds'), 'git_revision': git_revision(),
+                'host': platform.node(), 'python': platform.python_version(), 'cpu_count': os.cpu_count()}
+    context = mp.get_context('spawn')
+    print(f"{'case':<20} {'rows':>10} {'seconds':>9} {'rows/sec':>10} {'peak RSS':>10} {'output':>10}")
+    for size in args.sizes:
+        csv_file = generate_vehicles_csv(size, bench_config['seed'])
+        input_bytes = os.path.getsize(csv_file)
+        for case in args.cases:
+            max_rows = bench_cases[case][2]
+            if not is_available(case) or (max_rows and size > max_rows):
+                print(f"{case:<20} {size:>10} skipped")
+                continue
+
+            result = run_in_process(context, case, csv_file)
+            rows_per_sec = result['rows'] / result['seconds'] if result['seconds'] else None
+            record = {**run_info, 'case': case, 'input_rows': size, 'input_bytes': input_bytes, **result,
+                      'rows_per_sec': round(rows_per_sec, 1) if rows_per_sec else None}
+            with open(args.results_file, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record) + '\n')
+
+            output = f"{result['output_bytes'] / 1e6:8.1f}MB" if result['output_bytes'] is not None else f"{'-':>10}"
+            print(f"{case:<20} {size:>10} {result['seconds']:>8.2f}s {rows_per_sec or 0:>10.0f} "
+                  f"{result['peak_rss_bytes'] / 1e6:>8.1f}MB {output}")
+
+if __name__ == "__main__":
+    main()
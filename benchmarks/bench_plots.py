@@ -0,0 +1,62 @@
+import argparse
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import stocks
+
+# Benchmark settings: price histories of growing length and the downsampling settings to compare
+series_lengths = {
+    '3y daily': ('B', 756),
+    '30y daily': ('B', 7560),
+    '1y 5-minute': ('5min', 252 * 78),
+    '1y 1-minute': ('1min', 252 * 390)
+}
+settings = [(None, 'lttb'), (2000, 'lttb'), (2000, 'minmax')]
+seed = 42
+repeat_count = 3  # Best of this many runs is reported
+
+def synthetic_prices(frequency, length):
+    rng = np.random.default_rng(seed)
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.01, length)))
+    return pd.DataFrame({
+        'Date': pd.date_range('2020-01-01', periods=length, freq=frequency),
+        'High': close * 1.01,
+        'Low': close * 0.99,
+        'Close': close,
+        'Volume': rng.integers(1000, 100000, length).astype(float)
+    })
+
+def build_and_serialize(ticker_data):
+    # Figure construction plus the HTML the browser receives (Plotly's JS bundle excluded, it is the same for every chart)
+    return stocks.transactional_figure(ticker_data, 'BENCH').to_html(include_plotlyjs=False, full_html=True)
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure price chart build time and HTML payload with and without downsampling.')
+    parser.add_argument('--html-dir', help='also write every chart here to compare render time in a browser')
+    args = parser.parse_args()
+    if args.html_dir:
+        os.makedirs(args.html_dir, exist_ok=True)
+
+    print(f"{'series':<14} {'points':>7} {'setting':<13} {'build+html':>11} {'payload':>10}")
+    for name, (frequency, length) in series_lengths.items():
+        ticker_data = synthetic_prices(frequency, length)
+        for max_points, method in settings:
+            stocks.stocks_config['plot_max_points'] = max_points
+            stocks.stocks_config['downsample_method'] = method
+            elapsed = []
+            for _ in range(repeat_count):
+                start_time = time.perf_counter()
+                html = build_and_serialize(ticker_data)
+                elapsed.append(time.perf_counter() - start_time)
+            setting = f'{method} {max_points}' if max_points else 'every point'
+            print(f"{name:<14} {length:>7} {setting:<13} {min(elapsed) * 1000:8.0f} ms {len(html.encode('utf-8')) / 1e6:7.2f} MB")
+            if args.html_dir:
+                file_name = f"{name.replace(' ', '_')}_{setting.replace(' ', '_')}.html"
+                stocks.transactional_figure(ticker_data, 'BENCH').write_html(os.path.join(args.html_dir, file_name), include_plotlyjs='cdn')
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+import json
+import os
+from datetime import datetime
+
+def load_checkpoint(ledger_file, csv_file):
+    """Return the saved checkpoint for csv_file, or None when the load should start from the beginning."""
+    if not ledger_file or not os.path.exists(ledger_file):
+        return None
+
+    with open(ledger_file, 'r', encoding='utf-8') as f:
+        checkpoint = json.load(f)
+
+    # A checkpoint only applies to the exact file it was written for
+    stat = os.stat(csv_file)
+    if (checkpoint.get('csv_file') != os.path.abspath(csv_file)
+            or checkpoint.get('csv_size') != stat.st_size
+            or checkpoint.get('csv_mtime') != stat.st_mtime):
+        print(f"Ignoring checkpoint '{ledger_file}': it was written for a different version of '{csv_file}'.")
+        return None
+
+    print(f"Resuming '{csv_file}' at byte {checkpoint['offset']} "
+          f"after {checkpoint['rows']} rows (last committed id {checkpoint['last_id']}).")
+    return checkpoint
+
+def save_checkpoint(ledger_file, csv_file, offset, last_id, rows):
+    """Durably record that everything up to offset in csv_file has been committed."""
+    stat = os.stat(csv_file)
+    checkpoint = {
+        'csv_file': os.path.abspath(csv_file),
+        'csv_size': stat.st_size,
+        'csv_mtime': stat.st_mtime,
+        'offset': offset,
+        'last_id': last_id,
+        'rows': rows,
+        'updated_at': datetime.now().isoformat()
+    }
+
+    # Write to a temporary file and rename it so a crash never leaves a half-written ledger
+    temp_file = f'{ledger_file}.tmp'
+    with open(temp_file, 'w', encoding='utf-8') as f:
+        json.dump(checkpoint, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_file, ledger_file)
+
+def clear_checkpoint(ledger_file):
+    # Called once a load finishes so the next run starts from the beginning
+    if ledger_file and os.path.exists(ledger_file):
+        os.remove(ledger_file)
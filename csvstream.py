@@ -0,0 +1,69 @@
+import csv
+import os
+
+def iter_csv_rows(csv_file, start_offset=0, end_offset=None, encoding='utf-8'):
+    """Yield (row, offset) pairs from a CSV file, where offset is the byte position just past the row.
+
+    Rows are dicts keyed by the header, as with csv.DictReader. Reading starts at
+    start_offset, which must be a record boundary (for example an offset yielded
+    by a previous run), and stops once end_offset is reached.
+    """
+    with open(csv_file, 'rb') as f:
+        # Feed the csv module one decoded line at a time so f.tell() always sits on the end of the last record
+        def lines():
+            for line in iter(f.readline, b''):
+                yield line.decode(encoding)
+
+        reader = csv.DictReader(lines())
+        if reader.fieldnames is None:
+            return
+        if start_offset > f.tell():
+            f.seek(start_offset)
+
+        while end_offset is None or f.tell() < end_offset:
+            row = next(reader, None)
+            if row is None:
+                break
+            yield row, f.tell()
+
+def split_csv_shards(csv_file, shard_count, block_size=1 << 20):
+    """Split csv_file into up to shard_count (start, end) byte ranges that begin and end on record boundaries.
+
+    A newline ends a record only when an even number of quote characters precede it,
+    so boundaries are found by counting quotes instead of parsing the file. The header
+    is not part of any shard.
+    """
+    file_size = os.path.getsize(csv_file)
+    targets = [file_size * i // shard_count for i in range(1, shard_count)]
+    boundaries = []
+    next_target = 0  # The first boundary found is the end of the header
+    position = 0
+    quote_count = 0
+
+    with open(csv_file, 'rb') as f:
+        while next_target is not None:
+            block = f.read(block_size)
+            if not block:
+                break
+            search_from = max(next_target - position, 0)
+            while next_target is not None and position + len(block) > next_target:
+                newline = block.find(b'\n', search_from)
+                if newline == -1:
+                    break
+                search_from = newline + 1
+                if (quote_count + block.count(b'"', 0, newline)) % 2 == 0:
+                    boundary = position + newline + 1
+                    boundaries.append(boundary)
+                    # Targets that fall inside a very long record are merged into one shard
+                    while targets and targets[0] < boundary:
+                        targets.pop(0)
+                    next_target = targets.pop(0) if targets else None
+                    if next_target is not None:
+                        search_from = max(next_target - position, search_from)
+            quote_count += block.count(b'"')
+            position += len(block)
+
+    if not boundaries:
+        return []
+    boundaries.append(file_size)
+    return [(start, end) for start, end in zip(boundaries, boundaries[1:]) if start < end]
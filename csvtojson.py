@@ -1,34 +1,268 @@
-import pandas as pd
+import gzip
+import hashlib
+import io
 import json
+import math
+import multiprocessing as mp
+import os
+import re
+from collections import deque
+import pandas as pd
+from csvstream import split_csv_shards
+from metrics import span
 
-def clean_json_string(json_str):
-    # Load the JSON string into a Python dictionary
-    json_dict = json.loads(json_str)
-    # Dump it back to a JSON string with proper formatting
-    clean_json_str = json.dumps(json_dict, ensure_ascii=False)
-    return clean_json_str
+# Optional faster encoder and zstd compression
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
-def process_csv(csv_file_path, chunk_size=50000):
-    chunk_number = 0
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# File extension for each supported output compression
+compression_extensions = {None: '', 'gzip': '.gz', 'zstd': '.zst'}
+
+def get_encoder(encoder):
+    # 'json' reproduces the existing output byte for byte; 'orjson' writes compact NDJSON with the same values
+    if encoder == 'orjson':
+        if orjson is None:
+            raise ImportError("orjson is not installed; use encoder='json'.")
+        return lambda record: orjson.dumps(record).decode('utf-8')
+    return json.JSONEncoder(ensure_ascii=False).encode
+
+def open_binary_output(file_path, compression=None):
+    if compression is None:
+        return open(file_path, 'wb')
+    if compression == 'gzip':
+        return gzip.open(file_path, 'wb')
+    if compression == 'zstd':
+        if zstandard is None:
+            raise ImportError("zstandard is not installed; use compression='gzip' or None.")
+        return zstandard.ZstdCompressor().stream_writer(open(file_path, 'wb'))
+    raise ValueError(f"Unknown compression: {compression}")
+
+def open_output(file_path, compression=None):
+    if compression is None:
+        return open(file_path, 'w', encoding='utf-8')
+    return io.TextIOWrapper(open_binary_output(file_path, compression), encoding='utf-8')
+
+def iter_chunks(csv_file_path, chunk_size):
+    # pandas parses the file and infers column types per chunk, exactly as the original converter did
     for chunk in pd.read_csv(csv_file_path, chunksize=chunk_size, encoding='utf-8'):
-        # Convert chunk to JSON format
-        json_data = chunk.to_json(orient='records', lines=True)
-        # Split the JSON data into individual JSON objects
-        json_objects = json_data.splitlines()
-        
-        # Clean and write each chunk to a separate file
-        with open(f'output_{chunk_number}.json', 'w', encoding='utf-8') as json_file:
-            for json_obj in json_objects:
-                clean_json_obj = clean_json_string(json_obj)
-                json_file.write(clean_json_obj + '\n')
-        
+        yield chunk
+
+def json_float(value):
+    """value as the old to_json -> json.loads round trip returned it; None for NaN and infinity.
+
+    to_json writes floats with double_precision=10: ten decimals, or ten significant
+    digits in exponent form below 1e-15 and from 1e16 up.
+    """
+    if value != value or value in (math.inf, -math.inf):
+        return None
+    if value == 0:
+        return 0.0  # -0.0 is written as 0.0
+    magnitude = abs(value)
+    if magnitude >= 1e16 or 0 < magnitude < 1e-15:
+        return float(f'{value:.9e}')
+    return round(value, 10)
+
+def column_values(column):
+    # Python values of one column: ints and bools as they are, floats as to_json wrote them, NaN and NA as None
+    values = column.tolist()
+    if column.dtype.kind == 'f':
+        return [json_float(value) for value in values]
+    if column.dtype.kind == 'O':
+        return [json_float(float(value)) if isinstance(value, float) else value for value in values]
+    if isinstance(column.dtype, pd.api.extensions.ExtensionDtype):
+        return [None if value is pd.NA else value for value in values]
+    return values
+
+def convert_chunk(chunk, encode):
+    """Convert one parsed chunk into NDJSON lines.
+
+    Each record is built straight from the chunk's columns and encoded once, with the
+    values the old to_json / json.loads / json.dumps path produced, so the output is
+    unchanged.
+    """
+    columns = list(chunk.columns)
+    return [encode(dict(zip(columns, row))) for row in zip(*(column_values(chunk[column]) for column in chunk.columns))]
+
+class ByteRange:
+    """Read-only file object over bytes start to end of a file, for pandas to parse one shard."""
+
+    def __init__(self, file_path, start, end):
+        self.file = open(file_path, 'rb')
+        self.file.seek(start)
+        self.remaining = end - start
+
+    def read(self, size=-1):
+        size = self.remaining if size is None or size < 0 else min(size, self.remaining)
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def __iter__(self):
+        return iter(self.readline, b'')
+
+    def readline(self):
+        line = self.file.readline(self.remaining)
+        self.remaining -= len(line)
+        return line
+
+    def close(self):
+        self.file.close()
+
+def shard_dtypes(sample):
+    """Column types for every shard, inferred once from the first rows so the shards agree.
+
+    Integer and bool columns use pandas' nullable types, so a gap in a later shard
+    does not turn 5 into 5.0; a column empty in the sample is read as text.
+    """
+    dtypes = {}
+    for column in sample.columns:
+        values = sample[column].dropna()
+        if values.empty or sample[column].dtype.kind not in 'biufO':
+            dtypes[column] = object
+        elif sample[column].dtype.kind in 'iu':
+            dtypes[column] = 'Int64'
+        elif sample[column].dtype.kind == 'b' or values.map(type).eq(bool).all():
+            dtypes[column] = 'boolean'
+        elif sample[column].dtype.kind == 'f':
+            dtypes[column] = 'float64'
+        else:
+            dtypes[column] = object
+    return dtypes
+
+def convert_shard(csv_file_path, start, end, dtypes, chunk_size, encoder):
+    # Worker side of process_csv_parallel: parse one byte range and return its encoded lines as UTF-8 bytes
+    encode = get_encoder(encoder)
+    lines = []
+    shard = ByteRange(csv_file_path, start, end)
+    try:
+        for chunk in pd.read_csv(shard, header=None, names=list(dtypes), dtype=dtypes, chunksize=chunk_size,
+                                 encoding='utf-8'):
+            lines.extend((line + '\n').encode('utf-8') for line in convert_chunk(chunk, encode))
+    except pd.errors.ParserError:
+        raise
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"Bytes {start}-{end} of {csv_file_path} do not fit the column types inferred from the "
+                         f"first rows ({e}); pass dtypes to process_csv_parallel.") from e
+    finally:
+        shard.close()
+    return lines
+
+def iter_converted_shards(csv_file_path, shards, dtypes, chunk_size, encoder, processes):
+    # Each worker reads and parses its own byte range; results come back in input order, two shards per process in flight
+    with mp.Pool(processes) as pool:
+        pending = deque()
+        for start, end in shards:
+            pending.append(pool.apply_async(convert_shard, (csv_file_path, start, end, dtypes, chunk_size, encoder)))
+            if len(pending) >= processes * 2:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+
+def remove_outputs(compression=None):
+    # Files from an earlier run with more pieces would otherwise sit next to the new ones
+    pattern = re.compile(rf'output_\d+\.json{re.escape(compression_extensions[compression])}')
+    for file_name in os.listdir('.'):
+        if pattern.fullmatch(file_name):
+            os.remove(file_name)
+
+def file_checksum(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def process_csv_parallel(csv_file_path, chunk_size=50000, processes=None, target_file_bytes=64 * 1024 * 1024,
+                         compression=None, encoder='json', manifest_file='output_manifest.json', shard_bytes=16 * 1024 * 1024,
+                         dtypes=None, sample_rows=10000):
+    """Convert the CSV with a process pool and roll output_N.json files at target_file_bytes.
+
+    The file is cut into quote-safe byte ranges of about shard_bytes, and each worker
+    parses and encodes its own ranges, so parsing runs on every core. Every shard uses
+    one dtype map (inferred from the first sample_rows rows unless dtypes is given),
+    so values can differ from process_csv only where pandas' per-chunk inference
+    differs, such as integers in a chunk with gaps. Records keep their input order.
+    The size limit applies to the uncompressed NDJSON; a file holds at least one
+    record. A manifest lists each file with its row range, size on disk and SHA-256
+    so the pieces can be imported in parallel.
+
+    Only faster than process_csv with several cores: the workers send every encoded
+    line back to this process, which writes them.
+    """
+    processes = processes or os.cpu_count() or 1
+    extension = compression_extensions[compression]
+    remove_outputs(compression)
+    sample = pd.read_csv(csv_file_path, nrows=sample_rows, encoding='utf-8')
+    dtypes = {column: (dtypes or {}).get(column, dtype) for column, dtype in shard_dtypes(sample).items()}
+    shard_count = max(processes, os.path.getsize(csv_file_path) // shard_bytes + 1)
+    shards = split_csv_shards(csv_file_path, shard_count)
+    manifest = []
+    output_file = None
+    file_path = None
+    file_bytes = 0
+    file_first_row = 0
+    row_count = 0
+
+    def close_output():
+        output_file.close()
+        manifest.append({
+            'file': os.path.basename(file_path),
+            'first_row': file_first_row,
+            'last_row': row_count - 1,
+            'rows': row_count - file_first_row,
+            'bytes': os.path.getsize(file_path),
+            'sha256': file_checksum(file_path)
+        })
+
+    for lines in iter_converted_shards(csv_file_path, shards, dtypes, chunk_size, encoder, processes):
+        for line in lines:
+            if output_file is None or (file_bytes and file_bytes + len(line) > target_file_bytes):
+                if output_file is not None:
+                    close_output()
+                file_path = f'output_{len(manifest)}.json{extension}'
+                output_file = open_binary_output(file_path, compression)
+                file_bytes = 0
+                file_first_row = row_count
+            output_file.write(line)
+            file_bytes += len(line)
+            row_count += 1
+    if output_file is not None:
+        close_output()
+
+    with open(manifest_file, 'w', encoding='utf-8') as f:
+        json.dump({'source': os.path.basename(csv_file_path), 'rows': row_count, 'files': manifest}, f, indent=2)
+    return manifest
+
+def process_csv(csv_file_path, chunk_size=50000, compression=None, encoder='json'):
+    encode = get_encoder(encoder)
+    extension = compression_extensions[compression]
+    remove_outputs(compression)
+    chunk_number = 0
+    row_count = 0
+    for chunk in iter_chunks(csv_file_path, chunk_size):
+        # Encode each record once and write the chunk to its own file
+        with open_output(f'output_{chunk_number}.json{extension}', compression) as json_file:
+            for line in convert_chunk(chunk, encode):
+                json_file.write(line + '\n')
+
         chunk_number += 1
+        row_count += len(chunk)
+    return row_count
 
 def main():
     # Specify the path to your CSV file
     csv_file_path = 'vehiclestest.csv'
     # Process the CSV file and split into multiple JSON files
-    process_csv(csv_file_path)
+    # (process_csv_parallel rolls files by size and parses on several cores; measure it first, on one core it is slower)
+    with span('csvtojson', 'convert') as convert:
+        convert.add(rows=process_csv(csv_file_path), bytes=os.path.getsize(csv_file_path))
 
 if __name__ == "__main__":
     main()
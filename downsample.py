@@ -0,0 +1,68 @@
+import numpy as np
+
+# Methods accepted by downsample_indices
+downsample_methods = ('lttb', 'minmax')
+
+def lttb_indices(x, y, max_points):
+    """Indices of max_points points chosen by Largest-Triangle-Three-Buckets.
+
+    The first and last points are kept. The points in between are split into
+    max_points - 2 buckets, and each bucket keeps the point forming the largest
+    triangle with the point kept before it and the average of the next bucket,
+    which preserves peaks and the overall shape of the line.
+    """
+    y = np.asarray(y, dtype=float)
+    length = len(y)
+    if max_points is None or length <= max_points or max_points < 3:
+        return np.arange(length)
+    x = np.asarray(x, dtype=float)
+    x = x - x[0]  # Dates as nanoseconds would otherwise dominate the triangle areas' precision
+
+    # max_points - 2 buckets between the first and last point; the last point closes the final bucket
+    edges = np.linspace(1, length - 1, max_points - 1).astype(np.int64)
+    starts = np.append(edges[:-1], length - 1)
+    present = ~np.isnan(y)
+    # The next bucket's average does not depend on the points kept, so all of them are computed up front
+    average_x = np.add.reduceat(x, starts) / np.diff(np.append(starts, length))
+    with np.errstate(invalid='ignore'):
+        average_y = np.add.reduceat(np.where(present, y, 0.0), starts) / np.add.reduceat(present, starts)
+
+    selected = np.empty(max_points, dtype=np.int64)
+    selected[0], selected[-1] = 0, length - 1
+    previous = 0
+    for bucket in range(max_points - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        next_x, next_y = average_x[bucket + 1], average_y[bucket + 1]
+        if np.isnan(next_y):
+            next_y = y[previous]
+        areas = np.abs((x[previous] - next_x) * (y[start:end] - y[previous])
+                       - (x[previous] - x[start:end]) * (next_y - y[previous]))
+        previous = start + int(np.argmax(np.nan_to_num(areas, nan=-1.0)))
+        selected[bucket + 1] = previous
+    return selected
+
+def minmax_indices(y, max_points):
+    """Indices of the lowest and highest point of each of max_points // 2 equal buckets, in order.
+
+    Every spike survives, so this suits noisy intraday prices; the line between
+    extremes is less faithful than with LTTB.
+    """
+    y = np.asarray(y, dtype=float)
+    length = len(y)
+    if max_points is None or length <= max_points or max_points < 2:
+        return np.arange(length)
+    edges = np.linspace(0, length, max_points // 2 + 1).astype(np.int64)
+    selected = []
+    for start, end in zip(edges[:-1], edges[1:]):
+        values = y[start:end]
+        selected.append(start + int(np.argmin(np.where(np.isnan(values), np.inf, values))))
+        selected.append(start + int(np.argmax(np.where(np.isnan(values), -np.inf, values))))
+    return np.unique(selected)
+
+def downsample_indices(x, y, max_points, method='lttb'):
+    # Positions to plot out of len(y); every position when max_points is None or the series is short enough
+    if method == 'lttb':
+        return lttb_indices(x, y, max_points)
+    if method == 'minmax':
+        return minmax_indices(y, max_points)
+    raise ValueError(f"Unknown downsampling method: {method}; use one of {downsample_methods}.")
@@ -0,0 +1,279 @@
+import argparse
+import os
+import pickle
+import numpy as np
+import pandas as pd
+from metrics import span
+from pricestore import PriceStore
+
+# Indicators to compute; windows are in bars and a missing or empty entry switches the indicator off
+indicator_config = {
+    'sma': [50, 100, 200],        # Simple moving averages of Close
+    'ema': [12, 26],              # Exponential moving averages of Close (span, as in pandas ewm(adjust=False, ignore_na=True))
+    'rsi': 14,                    # Wilder's relative strength index
+    'bollinger': (20, 2.0),       # Window and width in standard deviations of the bands around the window mean
+    'vwap': 20,                   # Rolling volume-weighted typical price (High + Low + Close) / 3
+    'returns': True,              # Simple daily returns of Close
+    'volatility': 20,             # Rolling standard deviation of log returns, annualized
+    'periods_per_year': 252,
+    'state_file': 'indicator_state.pkl'  # Rolling state kept between runs for incremental updates
+}
+
+# Price columns the indicators read
+panel_columns = ['High', 'Low', 'Close', 'Volume']
+
+def load_panel(tickers, start=None, end=None, interval='1d', store=None):
+    """Stack the stored history of tickers into tickers×dates float64 arrays on the union of their dates.
+
+    Returns (dates, panel) where panel maps each of panel_columns to an array with one
+    row per ticker; a ticker without a bar on a date has NaN there.
+    """
+    store = store or PriceStore()
+    frames = [store.read(ticker_symbol, start=start, end=end, interval=interval, columns=panel_columns)
+              for ticker_symbol in tickers]
+    dates = np.unique(np.concatenate([frame['Date'].to_numpy() for frame in frames])) if frames \
+        else np.empty(0, dtype='datetime64[ns]')
+    panel = {column: np.full((len(tickers), len(dates)), np.nan) for column in panel_columns}
+    for row, frame in enumerate(frames):
+        positions = np.searchsorted(dates, frame['Date'].to_numpy())
+        for column in panel_columns:
+            panel[column][row, positions] = frame[column].to_numpy()
+    return dates, panel
+
+def rolling_sums(values, window):
+    # Window sums along the date axis from cumulative sums; windows that are not full or contain NaN are NaN
+    present = ~np.isnan(values)
+    sums = np.zeros((values.shape[0], values.shape[1] + 1))
+    counts = np.zeros((values.shape[0], values.shape[1] + 1), dtype=np.int64)
+    np.cumsum(np.where(present, values, 0.0), axis=1, out=sums[:, 1:])
+    np.cumsum(present, axis=1, out=counts[:, 1:])
+    result = np.full(values.shape, np.nan)
+    if values.shape[1] >= window:
+        full = counts[:, window:] - counts[:, :-window] == window
+        result[:, window - 1:] = np.where(full, sums[:, window:] - sums[:, :-window], np.nan)
+    return result
+
+def rolling_mean_std(values, window, ddof=1):
+    """Rolling mean and standard deviation of every row.
+
+    The row mean is subtracted first so the cumulative sums of squares stay small
+    and the difference of two of them keeps its precision.
+    """
+    present = ~np.isnan(values)
+    offset = np.where(present, values, 0.0).sum(axis=1, keepdims=True) / np.maximum(present.sum(axis=1, keepdims=True), 1)
+    centered = values - offset
+    sum_x = rolling_sums(centered, window)
+    sum_xx = rolling_sums(centered * centered, window)
+    mean = sum_x / window
+    variance = np.maximum(sum_xx - sum_x * mean, 0.0) / (window - ddof)
+    return mean + offset, np.sqrt(variance)
+
+def smooth(values, alphas, previous):
+    """Exponential smoothing of k stacked tickers×dates arrays, one date at a time for all of them.
+
+    values has shape (k, tickers, dates), alphas one factor per array and previous the
+    last smoothed values (NaN where nothing has been seen). A NaN input keeps the
+    previous value. Returns the smoothed arrays and the values after the last date.
+    """
+    alphas = np.asarray(alphas, dtype=float)[:, None]
+    result = np.empty(values.shape)
+    previous = previous.copy()
+    for position in range(values.shape[2]):
+        current = values[:, :, position]
+        previous = np.where(np.isnan(previous), current,
+                            np.where(np.isnan(current), previous, previous + alphas * (current - previous)))
+        result[:, :, position] = previous
+    return result, previous
+
+def window_sizes(config):
+    # Bars of history the rolling indicators need before the first new date
+    windows = list(config.get('sma') or [])
+    if config.get('bollinger'):
+        windows.append(config['bollinger'][0])
+    if config.get('vwap'):
+        windows.append(config['vwap'])
+    if config.get('volatility'):
+        windows.append(config['volatility'] + 1)
+    if config.get('returns') or config.get('rsi'):
+        windows.append(2)
+    return max(windows, default=1) - 1
+
+def compute_indicators(tickers, dates, panel, config=None, state=None):
+    """Compute every configured indicator over the stacked panel in one pass.
+
+    Without state the whole panel is computed. With the state returned by an earlier
+    call only the dates after its last date are computed: rolling indicators reuse the
+    stored tail of prices and the exponential ones continue from their stored values,
+    so the result matches a full recomputation. Returns (dates, indicators, state),
+    where indicators maps names such as 'sma_50' or 'rsi_14' to tickers×dates arrays.
+    """
+    config = config or indicator_config
+    tail_size = window_sizes(config)
+    ema_spans = list(config.get('ema') or [])
+    rsi_window = config.get('rsi')
+    smoothing_count = len(ema_spans) + (2 if rsi_window else 0)
+
+    if state is not None:
+        if state['tickers'] != list(tickers) or state['config'] != config:
+            raise ValueError("The indicator state was computed for other tickers or settings; run a full computation.")
+        new = dates > state['last_date'] if state['last_date'] is not None else np.ones(len(dates), dtype=bool)
+        dates = dates[new]
+        panel = {column: np.concatenate([state['tail'][column], panel[column][:, new]], axis=1) for column in panel_columns}
+        smoothed, counts, history = state['smoothed'], state['counts'], state['tail']['Close'].shape[1]
+    else:
+        smoothed = np.full((smoothing_count, len(tickers)), np.nan)
+        counts = np.zeros(len(tickers), dtype=np.int64)
+        history = 0
+
+    close = panel['Close']
+    indicators = {}
+    with span('indicators', 'compute') as current:
+        for window in config.get('sma') or []:
+            indicators[f'sma_{window}'] = rolling_sums(close, window)[:, history:] / window
+        if config.get('bollinger'):
+            window, width = config['bollinger']
+            # Bollinger bands use the population standard deviation of the window
+            middle, deviation = rolling_mean_std(close, window, ddof=0)
+            indicators['bollinger_middle'] = middle[:, history:]
+            indicators['bollinger_upper'] = (middle + width * deviation)[:, history:]
+            indicators['bollinger_lower'] = (middle - width * deviation)[:, history:]
+        if config.get('vwap'):
+            window = config['vwap']
+            typical = (panel['High'] + panel['Low'] + close) / 3
+            with np.errstate(invalid='ignore', divide='ignore'):
+                vwap = rolling_sums(typical * panel['Volume'], window) / rolling_sums(panel['Volume'], window)
+            indicators[f'vwap_{window}'] = vwap[:, history:]
+
+        # Differences against the previous bar; the first bar of a full computation has none
+        previous_close = np.concatenate([np.full((len(tickers), 1), np.nan), close[:, :-1]], axis=1)
+        change = close - previous_close
+        with np.errstate(invalid='ignore', divide='ignore'):
+            if config.get('returns'):
+                indicators['returns'] = (close / previous_close - 1)[:, history:]
+            if config.get('volatility'):
+                window = config['volatility']
+                _, deviation = rolling_mean_std(np.log(close / previous_close), window)
+                indicators[f'volatility_{window}'] = deviation[:, history:] * np.sqrt(config['periods_per_year'])
+
+        # EMAs and Wilder's averages of gains and losses are smoothed together, one date at a time
+        new_close = close[:, history:]
+        new_change = change[:, history:]
+        series = [new_close] * len(ema_spans)
+        alphas = [2.0 / (ema_span + 1) for ema_span in ema_spans]
+        if rsi_window:
+            series += [np.where(new_change > 0, new_change, np.where(np.isnan(new_change), np.nan, 0.0)),
+                       np.where(new_change < 0, -new_change, np.where(np.isnan(new_change), np.nan, 0.0))]
+            alphas += [1.0 / rsi_window] * 2
+        if series:
+            averages, _ = smooth(np.stack(series), alphas, smoothed)
+        # Bars seen so far per ticker; recursive indicators are NaN until their window has been seen
+        seen = counts[:, None] + np.cumsum(~np.isnan(new_close), axis=1)
+        for position, ema_span in enumerate(ema_spans):
+            indicators[f'ema_{ema_span}'] = np.where(seen >= ema_span, averages[position], np.nan)
+        if rsi_window:
+            gain, loss = averages[-2], averages[-1]
+            with np.errstate(invalid='ignore', divide='ignore'):
+                rsi = 100 * gain / (gain + loss)
+            indicators[f'rsi_{rsi_window}'] = np.where(seen > rsi_window, rsi, np.nan)
+        current.add(rows=close.size - len(tickers) * history)
+
+    # The state stops one date short, so the next run computes the last bar again: the price store
+    # rewrites it while its day is still trading
+    if len(dates) >= 2:
+        last_date = dates[-2]
+        smoothed = averages[:, :, -2] if series else smoothed
+        counts = seen[:, -2]
+    elif state is not None:
+        last_date = state['last_date']
+    else:
+        last_date = None
+    width = close.shape[1] - 1 if len(dates) else close.shape[1]
+    state = {
+        'tickers': list(tickers),
+        'config': config,
+        'last_date': last_date,
+        'tail': {column: panel[column][:, max(width - tail_size, 0):width] for column in panel_columns},
+        'smoothed': smoothed,
+        'counts': counts
+    }
+    return dates, indicators, state
+
+def frame_indicators(ticker_data, config=None):
+    """Indicators of one ticker's price frame as a new DataFrame with the same index; ticker_data is not modified."""
+    panel = {column: ticker_data[column].to_numpy(dtype=float)[None, :] for column in panel_columns}
+    _, indicators, _ = compute_indicators([None], ticker_data['Date'].to_numpy(), panel, config)
+    return pd.DataFrame({name: values[0] for name, values in indicators.items()}, index=ticker_data.index)
+
+def load_state(state_file):
+    if not state_file or not os.path.exists(state_file):
+        return None
+    with open(state_file, 'rb') as f:
+        return pickle.load(f)
+
+def save_state(state_file, state):
+    # Write to a temporary file and rename it so a crash never leaves a half-written state file
+    temp_file = f'{state_file}.tmp'
+    with open(temp_file, 'wb') as f:
+        pickle.dump(state, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_file, state_file)
+
+def stored_rows(store, tickers, last_date, interval='1d'):
+    # Rows each ticker has in the store up to last_date; more than the state saw means bars arrived late
+    if last_date is None:
+        return [0] * len(tickers)
+    last_time = PriceStore.seconds([last_date])[0]
+    return [int(np.searchsorted(store.timestamps(ticker_symbol, interval), last_time, side='right'))
+            for ticker_symbol in tickers]
+
+def update_indicators(tickers=None, store=None, config=None, state_file=None):
+    """Compute indicators for the bars added to the store since the last run, or for all of them on the first run.
+
+    The state records how many rows of every ticker it has seen. When a ticker has
+    gained rows at or before the state's last date since (its fetch failed in an
+    earlier batch, or history was backfilled), everything is recomputed.
+    """
+    store = store or PriceStore()
+    config = config or indicator_config
+    tickers = list(tickers) if tickers is not None else store.tickers()
+    state_file = state_file if state_file is not None else config['state_file']
+    state = load_state(state_file)
+    if state is not None and (state['tickers'] != tickers or state['config'] != config):
+        print(f"Ignoring '{state_file}': it was saved for other tickers or settings; running a full computation.")
+        state = None
+    if state is not None:
+        late = [ticker_symbol for ticker_symbol, rows, seen
+                in zip(tickers, stored_rows(store, tickers, state['last_date']), state.get('stored_rows') or []) if rows != seen]
+        if late or 'stored_rows' not in state:
+            print(f"Ignoring '{state_file}': {', '.join(late[:5]) or 'it'}{' ...' if len(late) > 5 else ''} gained bars "
+                  f"it had already passed; running a full computation.")
+            state = None
+
+    start = pd.Timestamp(state['last_date']) + pd.Timedelta(seconds=1) if state is not None and state['last_date'] is not None else None
+    dates, panel = load_panel(tickers, start=start, store=store)
+    dates, indicators, state = compute_indicators(tickers, dates, panel, config, state)
+    state['stored_rows'] = stored_rows(store, tickers, state['last_date'])
+    if state_file:
+        save_state(state_file, state)
+    return dates, indicators
+
+def main():
+    parser = argparse.ArgumentParser(description='Compute indicators for the tickers in the price store.')
+    parser.add_argument('tickers', nargs='*', help='defaults to every ticker in the store')
+    parser.add_argument('--full', action='store_true', help='ignore the saved state and recompute all dates')
+    args = parser.parse_args()
+    if args.full and os.path.exists(indicator_config['state_file']):
+        os.remove(indicator_config['state_file'])
+
+    tickers = args.tickers or None
+    dates, indicators = update_indicators(tickers)
+    if not len(dates):
+        print("No new bars since the last run.")
+        return
+    print(f"Computed {len(indicators)} indicators for {len(dates)} dates up to {pd.Timestamp(dates[-1]).date()}.")
+    for name, values in indicators.items():
+        print(f"{name:<18} {np.isfinite(values[:, -1]).sum()} tickers with a value on the last date")
+
+if __name__ == "__main__":
+    main()
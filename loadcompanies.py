@@ -1,20 +1,55 @@
-import pandas as pd
 from pymongo import MongoClient
-import json
+from csvstream import iter_csv_rows
+from mongoload import ensure_unique_index, get_write_batch, iter_batches, load_batches
 
-# Read CSV into pandas DataFrame
-df = pd.read_csv("companies500.csv")
+# Input CSV file and MongoDB target
+file_path = "companies500.csv"
+database_name = 'stock'
+collection_name = 'companies'
 
-# Convert DataFrame to JSON
-json_data = json.loads(df.to_json(orient='records'))
+# Configuration for the load
+load_config = {
+    'mode': 'upsert',    # 'upsert' replaces documents by Symbol so reruns are idempotent, 'insert' appends
+    'batch_size': 1000,  # Documents sent per unordered insert_many
+    'concurrency': 1     # Batches submitted concurrently
+}
 
-# Connect to MongoDB
-client = MongoClient('localhost', 27017)  
-db = client['stock']  
-collection = db['companies'] 
+# Ticker symbol identifies a company, backed by a unique index in upsert mode
+unique_key = 'Symbol'
 
-# Insert JSON data into MongoDB
-collection.insert_many(json_data)
+# Columns stored as numbers; everything else is kept as text
+numeric_columns = {'CIK'}
 
-# Close MongoDB connection
-client.close()
+def clean_row(row):
+    # Match the types pandas infers for companies500.csv: empty fields become None and CIK is an integer
+    document = {}
+    for key, value in row.items():
+        if not key:
+            continue
+        if not value:
+            document[key] = None
+        elif key in numeric_columns:
+            document[key] = int(value)
+        else:
+            document[key] = value
+    return document
+
+def main():
+    # Connect to MongoDB
+    client = MongoClient('localhost', 27017)
+    db = client[database_name]
+    collection = db[collection_name]
+
+    if load_config['mode'] == 'upsert':
+        ensure_unique_index(collection, unique_key)
+
+    # Stream the CSV rows into MongoDB in batches
+    documents = (clean_row(row) for row, _ in iter_csv_rows(file_path))
+    batches = ((batch, None) for batch in iter_batches(documents, load_config['batch_size']))
+    load_batches(collection, batches, load_config['concurrency'], get_write_batch(load_config['mode'], unique_key))
+
+    # Close MongoDB connection
+    client.close()
+
+if __name__ == "__main__":
+    main()
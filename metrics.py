@@ -0,0 +1,128 @@
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from functools import wraps
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+# Where span records go; the environment variables turn each output on for any script without editing it
+metrics_config = {
+    'jsonl_file': os.environ.get('PIPELINE_METRICS_FILE'),       # File the records are appended to; None disables it
+    'prometheus_dir': os.environ.get('PIPELINE_PROMETHEUS_DIR')  # node_exporter textfile directory; None disables it
+}
+
+# Latest record per (job, phase) in this process, used for the Prometheus textfile
+_latest = {}
+
+def peak_rss_bytes():
+    # ru_maxrss is reported in kilobytes on Linux and in bytes on macOS
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+class Span:
+    """Timing and volume of one phase of a job; filled in by span() and counted with add()."""
+
+    def __init__(self, job, phase):
+        self.job = job
+        self.phase = phase
+        self.started_at = datetime.now()
+        self.seconds = None
+        self.rows = 0
+        self.bytes = 0
+        self.status = 'ok'
+        self._start = time.perf_counter()
+
+    def add(self, rows=0, bytes=0):
+        self.rows += rows
+        self.bytes += bytes
+
+    @property
+    def duration(self):
+        # Elapsed time so far while the span is open, final time once it has closed
+        return self.seconds if self.seconds is not None else time.perf_counter() - self._start
+
+    def record(self):
+        seconds = self.duration
+        return {
+            'job': self.job,
+            'phase': self.phase,
+            'started_at': self.started_at.isoformat(),
+            'seconds': round(seconds, 6),
+            'rows': self.rows,
+            'bytes': self.bytes,
+            'rows_per_sec': round(self.rows / seconds, 2) if seconds else None,
+            'bytes_per_sec': round(self.bytes / seconds, 2) if seconds else None,
+            'peak_rss_bytes': peak_rss_bytes(),
+            'status': self.status,
+            'pid': os.getpid()
+        }
+
+@contextmanager
+def span(job, phase):
+    """Time a phase of a job and emit it as a JSON line (and Prometheus gauges) when it ends.
+
+    with span('sqlite_load', 'write') as s:
+        ...
+        s.add(rows=len(batch), bytes=batch_bytes)
+    """
+    current = Span(job, phase)
+    try:
+        yield current
+    except BaseException:
+        current.status = 'error'
+        raise
+    finally:
+        current.seconds = time.perf_counter() - current._start
+        emit(current.record())
+
+def timed(job, phase=None, count=None):
+    """Decorator form of span(); count(result) may return the number of rows the call produced."""
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(job, phase or function.__name__) as current:
+                result = function(*args, **kwargs)
+                if count is not None:
+                    current.add(rows=count(result))
+                return result
+        return wrapper
+    return decorator
+
+def emit(record):
+    if metrics_config['jsonl_file']:
+        with open(metrics_config['jsonl_file'], 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record) + '\n')
+    _latest[(record['job'], record['phase'])] = record
+    if metrics_config['prometheus_dir']:
+        write_prometheus(record['job'])
+
+def write_prometheus(job):
+    # One textfile per job, replaced atomically so the node_exporter never reads a partial file
+    lines = []
+    for name, field, description in (
+            ('pipeline_phase_seconds', 'seconds', 'Duration of the last run of the phase.'),
+            ('pipeline_phase_rows', 'rows', 'Rows handled by the last run of the phase.'),
+            ('pipeline_phase_bytes', 'bytes', 'Bytes handled by the last run of the phase.'),
+            ('pipeline_phase_peak_rss_bytes', 'peak_rss_bytes', 'Peak process RSS when the phase ended.'),
+            ('pipeline_phase_success', 'status', 'Whether the last run of the phase succeeded.')):
+        lines.append(f'# HELP {name} {description}')
+        lines.append(f'# TYPE {name} gauge')
+        for (record_job, phase), record in sorted(_latest.items()):
+            if record_job != job or record[field] is None:
+                continue
+            value = int(record[field] == 'ok') if field == 'status' else record[field]
+            lines.append(f'{name}{{job="{job}",phase="{phase}"}} {value}')
+
+    path = os.path.join(metrics_config['prometheus_dir'], f'{job}.prom')
+    temp_path = f'{path}.{os.getpid()}.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(lines) + '\n')
+    os.replace(temp_path, path)
@@ -1,17 +1,85 @@
-import pandas as pd
 from pymongo import MongoClient
+from checkpoint import load_checkpoint, save_checkpoint, clear_checkpoint
+from csvstream import iter_csv_rows
+from mongoload import ensure_unique_index, get_write_batch, load_batches
 
-# Load the CSV file into a DataFrame
+# Input CSV file
 file_path = 'vehicles.csv'
-vehicles_df = pd.read_csv(file_path)
 
-# Create a connection to MongoDB
-client = MongoClient('localhost', 27017)  # Adjust the connection details as necessary
-db = client['vehicle_database']
-collection = db['vehicles']
+# Configuration for the load
+load_config = {
+    'mode': 'upsert',     # 'upsert' replaces documents by id so reruns are idempotent, 'insert' appends
+    'batch_size': 10000,  # Documents sent per unordered insert_many
+    'concurrency': 1,     # Batches submitted concurrently; checkpoints still advance in file order
+    'ledger_file': 'vehicles_mongodb_checkpoint.json'  # Resume point after a failed run; None disables it
+}
 
-# Convert the DataFrame to a dictionary and insert into MongoDB
-vehicles_data = vehicles_df.to_dict(orient='records')
-collection.insert_many(vehicles_data)
+# Natural key of a listing, backed by a unique index in upsert mode
+unique_key = 'id'
 
-print("Data has been successfully inserted into the MongoDB database.")
+# Columns stored as numbers; everything else is kept as text
+numeric_columns = {'id', 'price', 'year', 'odometer', 'lat', 'long'}
+
+def convert_value(key, value):
+    # Empty fields become None and numeric columns are parsed as int or float
+    if not value:
+        return None
+    if key in numeric_columns:
+        try:
+            return int(value)
+        except ValueError:
+            try:
+                return float(value)
+            except ValueError:
+                return value
+    return value
+
+def clean_row(row):
+    return {key: convert_value(key, value) for key, value in row.items() if key}
+
+def iter_batches(csv_file, batch_size, start_offset=0):
+    # Stream the CSV in batches, each tagged with the byte offset and id of its last row
+    batch = []
+    for row, offset in iter_csv_rows(csv_file, start_offset):
+        batch.append(clean_row(row))
+        if len(batch) >= batch_size:
+            yield batch, (offset, batch[-1].get('id'))
+            batch = []
+    if batch:
+        yield batch, (offset, batch[-1].get('id'))
+
+def load(collection, csv_file, batch_size=10000, ledger_file=None, concurrency=1, mode='insert'):
+    if mode == 'upsert':
+        ensure_unique_index(collection, unique_key)
+
+    # Skip straight to the end of the last inserted batch of a previous run
+    checkpoint = load_checkpoint(ledger_file, csv_file)
+    start_offset = checkpoint['offset'] if checkpoint else 0
+    resumed_count = checkpoint['rows'] if checkpoint else 0
+
+    def on_batch(marker, doc_count):
+        if ledger_file:
+            offset, last_id = marker
+            save_checkpoint(ledger_file, csv_file, offset, last_id, resumed_count + doc_count)
+
+    doc_count = load_batches(collection, iter_batches(csv_file, batch_size, start_offset), concurrency,
+                             get_write_batch(mode, unique_key), on_batch)
+    clear_checkpoint(ledger_file)
+    return resumed_count + doc_count
+
+def main():
+    # Create a connection to MongoDB
+    client = MongoClient('localhost', 27017)  # Adjust the connection details as necessary
+    db = client['vehicle_database']
+    collection = db['vehicles']
+
+    # Stream the CSV into MongoDB in batches
+    load(collection, file_path, load_config['batch_size'], load_config['ledger_file'], load_config['concurrency'],
+         load_config['mode'])
+
+    client.close()
+
+    print("Data has been successfully inserted into the MongoDB database.")
+
+if __name__ == "__main__":
+    main()
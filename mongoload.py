@@ -0,0 +1,94 @@
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pymongo import ReplaceOne
+
+def insert_batch(collection, batch):
+    # Unordered inserts let the server apply the batch in parallel and continue past a bad document
+    collection.insert_many(batch, ordered=False)
+    return len(batch)
+
+def has_key(document, key):
+    return document.get(key) not in (None, '')
+
+def upsert_batch(collection, batch, key):
+    """Replace each document by its natural key and return how many were written.
+
+    Reloading the same rows leaves the collection unchanged. A document without a
+    key is skipped: its filter would be {key: None}, and every keyless row would
+    overwrite the same document.
+    """
+    operations = [ReplaceOne({key: document[key]}, document, upsert=True) for document in batch if has_key(document, key)]
+    if operations:
+        collection.bulk_write(operations, ordered=False)
+    return len(operations)
+
+def ensure_unique_index(collection, key):
+    # Backs the upsert filters and point lookups by key; a no-op when the index already exists
+    collection.create_index(key, unique=True)
+
+def get_write_batch(mode, key):
+    # 'insert' appends every document, 'upsert' replaces documents that share the same key
+    if mode == 'upsert':
+        return lambda collection, batch: upsert_batch(collection, batch, key)
+    if mode == 'insert':
+        return insert_batch
+    raise ValueError(f"Unknown MongoDB load mode: {mode}")
+
+def load_batches(collection, batches, concurrency=1, write_batch=insert_batch, on_batch=None):
+    """Write (batch, marker) pairs to collection with at most concurrency batches in flight.
+
+    on_batch(marker, doc_count) runs in submission order once a batch and every earlier
+    batch have been written, so it is safe to record checkpoints from it. write_batch
+    returns the number of documents it wrote; the rest of the batch counts as skipped.
+    """
+    start_time = time.perf_counter()
+    latencies = []
+    doc_count = 0
+    skipped_count = 0
+
+    def timed_write(batch):
+        batch_start = time.perf_counter()
+        written = write_batch(collection, batch)
+        return time.perf_counter() - batch_start, written
+
+    def finish(future, marker, batch_size):
+        nonlocal doc_count, skipped_count
+        latency, written = future.result()
+        latencies.append(latency)
+        doc_count += written
+        skipped_count += batch_size - written
+        print(f"Batch {len(latencies)}: {written} documents in {latency * 1000:.0f} ms"
+              + (f", {batch_size - written} skipped" if written < batch_size else ""))
+        if on_batch:
+            on_batch(marker, doc_count)
+
+    # Waiting on the oldest batch first keeps memory bounded and completion callbacks in order
+    in_flight = deque()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for batch, marker in batches:
+            in_flight.append((executor.submit(timed_write, batch), marker, len(batch)))
+            if len(in_flight) >= concurrency:
+                finish(*in_flight.popleft())
+        while in_flight:
+            finish(*in_flight.popleft())
+
+    elapsed = time.perf_counter() - start_time
+    if latencies:
+        print(f"Wrote {doc_count} documents in {len(latencies)} batches in {elapsed:.2f}s "
+              f"({doc_count / elapsed if elapsed else 0:.0f} docs/sec); batch latency "
+              f"mean {sum(latencies) / len(latencies) * 1000:.0f} ms, max {max(latencies) * 1000:.0f} ms.")
+    if skipped_count:
+        print(f"Skipped {skipped_count} documents without a key.")
+    return doc_count
+
+def iter_batches(rows, batch_size):
+    # Group an iterable of documents into lists of batch_size
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
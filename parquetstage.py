@@ -0,0 +1,108 @@
+import pyarrow as pa
+import pyarrow.csv as pv
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+# Input CSV files and their Parquet staging locations
+vehicles_csv_file = 'vehicles.csv'
+vehicles_parquet_path = 'vehicles_parquet'  # Directory partitioned by state
+companies_csv_file = 'companies500.csv'
+companies_parquet_file = 'companies500.parquet'
+
+# Typed schema of the vehicles CSV; year is read as float because the export writes values like '2013.0'
+vehicles_read_types = {
+    'id': pa.int64(),
+    'url': pa.string(),
+    'region': pa.string(),
+    'region_url': pa.string(),
+    'price': pa.float64(),
+    'year': pa.float64(),
+    'manufacturer': pa.string(),
+    'model': pa.string(),
+    'condition': pa.string(),
+    'cylinders': pa.string(),
+    'fuel': pa.string(),
+    'odometer': pa.float64(),
+    'title_status': pa.string(),
+    'transmission': pa.string(),
+    'vin': pa.string(),
+    'drive': pa.string(),
+    'size': pa.string(),
+    'type': pa.string(),
+    'paint_color': pa.string(),
+    'image_url': pa.string(),
+    'description': pa.string(),
+    'county': pa.string(),
+    'state': pa.string(),
+    'lat': pa.float64(),
+    'long': pa.float64(),
+    'posting_date': pa.string()
+}
+vehicles_schema = pa.schema([(name, pa.int32() if name == 'year' else data_type)
+                             for name, data_type in vehicles_read_types.items()])
+
+companies_schema = pa.schema([
+    ('Symbol', pa.string()),
+    ('Security', pa.string()),
+    ('GICS Sector', pa.string()),
+    ('GICS Sub-Industry', pa.string()),
+    ('Headquarters Location', pa.string()),
+    ('Date added', pa.string()),
+    ('CIK', pa.int64()),
+    ('Founded', pa.string())
+])
+
+def iter_typed_batches(csv_file, block_size):
+    # Stream the CSV in record batches with the declared types; header names are lower-cased ('VIN' -> 'vin')
+    reader = pv.open_csv(
+        csv_file,
+        read_options=pv.ReadOptions(block_size=block_size),
+        parse_options=pv.ParseOptions(newlines_in_values=True),
+        convert_options=pv.ConvertOptions(
+            column_types={**vehicles_read_types, 'VIN': pa.string()},
+            strings_can_be_null=True
+        )
+    )
+    for batch in reader:
+        batch = batch.rename_columns([name.lower() for name in batch.schema.names])
+        columns = [batch.column(name).cast(vehicles_schema.field(name).type) if name in batch.schema.names
+                   else pa.nulls(batch.num_rows, vehicles_schema.field(name).type)
+                   for name in vehicles_schema.names]
+        yield pa.RecordBatch.from_arrays(columns, schema=vehicles_schema)
+
+def stage_vehicles(csv_file=vehicles_csv_file, output_path=vehicles_parquet_path, block_size=64 * 1024 * 1024):
+    """Convert the vehicles CSV once into Parquet files partitioned by state, streaming block by block."""
+    batches = iter_typed_batches(csv_file, block_size)
+    ds.write_dataset(
+        pa.RecordBatchReader.from_batches(vehicles_schema, batches),
+        output_path,
+        format='parquet',
+        partitioning=ds.partitioning(pa.schema([('state', pa.string())]), flavor='hive'),
+        existing_data_behavior='delete_matching'
+    )
+
+def stage_companies(csv_file=companies_csv_file, output_file=companies_parquet_file):
+    table = pv.read_csv(csv_file, convert_options=pv.ConvertOptions(column_types=companies_schema))
+    pq.write_table(table.select(companies_schema.names), output_file)
+
+def vehicles_dataset(path=vehicles_parquet_path):
+    return ds.dataset(path, format='parquet', partitioning='hive')
+
+def read_vehicles(columns=None, filters=None, path=vehicles_parquet_path):
+    """Read the staged vehicles into a DataFrame, loading only the given columns and matching partitions/rows.
+
+    filters uses the pyarrow/pandas form, e.g. [('state', '=', 'ca'), ('price', '>', 0)].
+    """
+    return pq.read_table(path, columns=columns, filters=filters, partitioning='hive').to_pandas()
+
+def iter_vehicle_batches(columns=None, filter_expression=None, batch_size=65536, path=vehicles_parquet_path):
+    # Record batches for loaders that stream the staged data instead of re-parsing the CSV
+    return vehicles_dataset(path).to_batches(columns=columns, filter=filter_expression, batch_size=batch_size)
+
+def main():
+    stage_vehicles()
+    stage_companies()
+    print(f"Staged '{vehicles_csv_file}' into '{vehicles_parquet_path}' and '{companies_csv_file}' into '{companies_parquet_file}'.")
+
+if __name__ == "__main__":
+    main()
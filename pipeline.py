@@ -0,0 +1,254 @@
+import multiprocessing as mp
+import os
+import queue
+import time
+from csvstream import iter_csv_rows, split_csv_shards
+
+# Configuration for the parallel pipeline
+pipeline_config = {
+    'target': 'postgres',           # 'postgres', 'postgrestst', 'sqlite', 'mongodb' or 'companies'
+    'csv_file': 'vehicles.csv',
+    'parsers': os.cpu_count() or 1,  # Processes parsing and cleaning shards
+    'writers': 4,                    # Processes writing to the target, each with its own connection
+    'shards_per_parser': 4,          # More shards than parsers keeps every parser busy until the end
+    'batch_size': 10000,             # Rows per batch handed from parsers to writers
+    'queue_size': 16                 # Batches in flight; bounds memory regardless of file size
+}
+
+def get_clean_row(target):
+    # Each target keeps the row cleaning of its own loader script
+    if target == 'postgres':
+        from postgres import clean_row
+    elif target == 'postgrestst':
+        from postgrestst import clean_row
+    elif target == 'sqlite':
+        from sqllite import clean_row
+    elif target == 'mongodb':
+        from mongodbvehicles import clean_row
+    elif target == 'companies':
+        from loadcompanies import clean_row
+    else:
+        raise ValueError(f"Unknown pipeline target: {target}")
+    return clean_row
+
+def get_mongo_module(target):
+    import loadcompanies
+    import mongodbvehicles
+    return mongodbvehicles if target == 'mongodb' else loadcompanies
+
+def get_mongo_collection(client, target):
+    if target == 'mongodb':
+        return client['vehicle_database']['vehicles']
+    module = get_mongo_module(target)
+    return client[module.database_name][module.collection_name]
+
+def prepare_target(target):
+    # Create the destination table once, before any writer starts
+    if target in ('postgres', 'postgrestst'):
+        import psycopg2
+        module = __import__(target)
+        conn = psycopg2.connect(**module.db_config)
+        cur = conn.cursor()
+        cur.execute(module.create_table_query)
+        conn.commit()
+        conn.close()
+    elif target == 'sqlite':
+        import sqlite3
+        import sqllite
+        conn = sqlite3.connect(sqllite.database_path)
+        conn.execute(sqllite.create_table_query)
+        conn.commit()
+        conn.close()
+    elif target in ('mongodb', 'companies'):
+        from pymongo import MongoClient
+        from mongoload import ensure_unique_index
+        module = get_mongo_module(target)
+        if module.load_config['mode'] == 'upsert':
+            client = MongoClient('localhost', 27017)
+            ensure_unique_index(get_mongo_collection(client, target), module.unique_key)
+            client.close()
+
+def finish_target(target):
+    # Work that has to wait until every writer is done
+    if target == 'sqlite':
+        import sqlite3
+        import sqllite
+        conn = sqlite3.connect(sqllite.database_path)
+        sqllite.finish_load(conn)
+        conn.close()
+
+def open_writer(target):
+    """Open a connection for one writer process and return (write, close) functions for it.
+
+    write(batch) may return how many rows it wrote when that can be fewer than the batch
+    (MongoDB upserts skip documents without a key); None means the whole batch.
+    """
+    if target == 'postgres':
+        import psycopg2
+        import postgres
+        conn = psycopg2.connect(**postgres.db_config)
+        cur = conn.cursor()
+        cur.execute(postgres.create_staging_query)
+        conn.commit()
+
+        def write(batch):
+            postgres.copy_batch(cur, batch)
+            postgres.merge_staging(cur)
+            conn.commit()
+        return write, conn.close
+
+    if target == 'postgrestst':
+        import psycopg2
+        import postgrestst
+        conn = psycopg2.connect(**postgrestst.db_config)
+        cur = conn.cursor()
+
+        def write(batch):
+            postgrestst.insert_isolated(cur, batch)
+            conn.commit()
+        return write, conn.close
+
+    if target == 'sqlite':
+        import sqlite3
+        import sqllite
+        # SQLite allows one writer at a time; the others wait on the lock instead of failing
+        conn = sqlite3.connect(sqllite.database_path, timeout=300)
+        sqllite.configure_for_load(conn, sqllite.load_config['cache_size_kib'])
+
+        def write(batch):
+            conn.executemany(sqllite.insert_query, batch)
+            conn.commit()
+        return write, conn.close
+
+    if target in ('mongodb', 'companies'):
+        from pymongo import MongoClient
+        from mongoload import get_write_batch
+        module = get_mongo_module(target)
+        client = MongoClient('localhost', 27017)
+        collection = get_mongo_collection(client, target)
+        write_batch = get_write_batch(module.load_config['mode'], module.unique_key)
+
+        def write(batch):
+            return write_batch(collection, batch)
+        return write, client.close
+
+    raise ValueError(f"Unknown pipeline target: {target}")
+
+# State inherited by each parser process from the pool initializer
+_parser_state = {}
+
+def _init_parser(batch_queue, csv_file, target, batch_size):
+    _parser_state.update(queue=batch_queue, csv_file=csv_file, clean_row=get_clean_row(target), batch_size=batch_size)
+
+def parse_shard(shard):
+    # Parse and clean one byte range; put() blocks while the queue is full, which throttles the parsers
+    start, end = shard
+    clean_row = _parser_state['clean_row']
+    batch_size = _parser_state['batch_size']
+    row_count = 0
+    batch = []
+    for row, _ in iter_csv_rows(_parser_state['csv_file'], start, end):
+        batch.append(clean_row(row))
+        if len(batch) >= batch_size:
+            _parser_state['queue'].put(batch)
+            row_count += len(batch)
+            batch = []
+    if batch:
+        _parser_state['queue'].put(batch)
+        row_count += len(batch)
+    return row_count
+
+def write_batches(target, batch_queue, result_queue):
+    # Drain the queue until the None sentinel, then report how much this writer wrote
+    write, close = open_writer(target)
+    row_count = 0
+    write_time = 0.0
+    while True:
+        batch = batch_queue.get()
+        if batch is None:
+            break
+        start_time = time.perf_counter()
+        written = write(batch)
+        write_time += time.perf_counter() - start_time
+        row_count += len(batch) if written is None else written
+    close()
+    result_queue.put((os.getpid(), row_count, write_time))
+
+def check_writers(writer_processes):
+    if any(process.exitcode not in (None, 0) for process in writer_processes):
+        raise RuntimeError("A pipeline writer failed; stopping the load.")
+
+def collect_writer_results(writer_processes, result_queue):
+    # Wait for one report per writer, noticing a writer that dies in its final flush or close instead of hanging
+    writer_results = []
+    while len(writer_results) < len(writer_processes):
+        try:
+            writer_results.append(result_queue.get(timeout=1))
+        except queue.Empty:
+            check_writers(writer_processes)
+            if all(process.exitcode is not None for process in writer_processes):
+                # Every writer has exited, so a report still missing after one more wait is never coming
+                try:
+                    writer_results.append(result_queue.get(timeout=1))
+                except queue.Empty:
+                    raise RuntimeError("A pipeline writer exited without reporting; stopping the load.")
+    return writer_results
+
+def run_pipeline(csv_file, target, parsers, writers, shards_per_parser=4, batch_size=10000, queue_size=16):
+    start_time = time.perf_counter()
+    prepare_target(target)
+    shards = split_csv_shards(csv_file, parsers * shards_per_parser)
+    print(f"Pipeline: {len(shards)} shards, {parsers} parsers, {writers} writers, "
+          f"batch size {batch_size}, queue size {queue_size}.")
+
+    batch_queue = mp.Queue(maxsize=queue_size)
+    result_queue = mp.Queue()
+    writer_processes = [mp.Process(target=write_batches, args=(target, batch_queue, result_queue))
+                        for _ in range(writers)]
+    try:
+        for process in writer_processes:
+            process.start()
+
+        with mp.Pool(parsers, initializer=_init_parser, initargs=(batch_queue, csv_file, target, batch_size)) as pool:
+            result = pool.map_async(parse_shard, shards, chunksize=1)
+            # A dead writer would leave the parsers blocked on a full queue, so stop instead of waiting forever
+            while not result.ready():
+                result.wait(1)
+                check_writers(writer_processes)
+            row_count = sum(result.get())
+            # Let the parsers exit on their own: their queue feeder threads may still be flushing the last batches,
+            # which terminate() (what leaving the with block does) would lose along with the queue's write lock
+            pool.close()
+            pool.join()
+
+        for _ in writer_processes:
+            batch_queue.put(None)
+        writer_results = collect_writer_results(writer_processes, result_queue)
+        for process in writer_processes:
+            process.join()
+    finally:
+        # After a parser or writer error the remaining writers would wait on the queue forever
+        for process in writer_processes:
+            if process.is_alive():
+                process.terminate()
+            if process.pid is not None:
+                process.join()
+    finish_target(target)
+
+    elapsed = time.perf_counter() - start_time
+    for pid, written, write_time in writer_results:
+        print(f"Writer {pid}: {written} rows in {write_time:.2f}s of writes "
+              f"({written / write_time if write_time else 0:.0f} rows/sec).")
+    loaded_count = sum(written for _, written, _ in writer_results)
+    if loaded_count < row_count:
+        print(f"Skipped {row_count - loaded_count} of {row_count} parsed rows without a key.")
+    print(f"Loaded {loaded_count} rows into {target} in {elapsed:.2f}s ({loaded_count / elapsed if elapsed else 0:.0f} rows/sec).")
+    return loaded_count
+
+def main():
+    run_pipeline(pipeline_config['csv_file'], pipeline_config['target'], pipeline_config['parsers'],
+                 pipeline_config['writers'], pipeline_config['shards_per_parser'],
+                 pipeline_config['batch_size'], pipeline_config['queue_size'])
+
+if __name__ == "__main__":
+    main()
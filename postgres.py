@@ -1,5 +1,11 @@
 import csv
+import io
+import os
+import time
 import psycopg2
+from metrics import span
+from checkpoint import load_checkpoint, save_checkpoint, clear_checkpoint
+from csvstream import iter_csv_rows
 
 # Define input file and database connection details
 input_csv_file = 'vehiclestest.csv'
@@ -11,11 +17,27 @@ db_config = {
     'port': '5432'        # or your specific database port
 }
 
-# Connect to the PostgreSQL database
-conn = psycopg2.connect(**db_config)
-cur = conn.cursor()
+# Configuration for the load
+load_config = {
+    'mode': 'bulk',          # 'bulk' streams rows through COPY into a staging table, 'row' inserts row by row
+    'batch_size': 10000,     # Rows sent per COPY FROM STDIN
+    'commit_interval': 10,   # Number of batches merged into vehicles per commit
+    'ledger_file': 'vehicles_postgres_checkpoint.json'  # Resume point after a failed run; None disables it
+}
+
+# Columns from the CSV that are not loaded
+excluded_columns = ['region_url', 'image_url', 'description', 'posting_date']
+
+# Columns of the vehicles table, in table order
+vehicle_columns = [
+    'id', 'url', 'region', 'price', 'year', 'manufacturer', 'model', 'condition',
+    'cylinders', 'fuel', 'odometer', 'title_status', 'transmission', 'vin', 'drive',
+    'size', 'type', 'paint_color', 'county', 'state', 'lat', 'long'
+]
 
 # Define the table creation query (if not already created)
+# updated_at defaults to clock_timestamp(), the moment each row is written, rather than now(), the start of the
+# loading transaction, which can be long before the commit that makes the row visible to incremental exports
 create_table_query = """
 CREATE TABLE IF NOT EXISTS vehicles (
     id BIGINT PRIMARY KEY,
@@ -39,36 +61,153 @@ CREATE TABLE IF NOT EXISTS vehicles (
     county TEXT,
     state TEXT,
     lat FLOAT,
-    long FLOAT
+    long FLOAT,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT clock_timestamp()
 );
+ALTER TABLE vehicles ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ NOT NULL DEFAULT now();
+ALTER TABLE vehicles ALTER COLUMN updated_at SET DEFAULT clock_timestamp();
+CREATE INDEX IF NOT EXISTS idx_vehicles_updated_at ON vehicles (updated_at);
+"""
+
+# Session-local staging table with the same columns as vehicles but no primary key
+create_staging_query = """
+CREATE TEMP TABLE IF NOT EXISTS vehicles_staging (LIKE vehicles INCLUDING DEFAULTS);
+"""
+
+copy_query = f"""
+COPY vehicles_staging ({', '.join(vehicle_columns)}) FROM STDIN WITH (FORMAT csv);
 """
-cur.execute(create_table_query)
-conn.commit()
-
-# Read the CSV data and insert into PostgreSQL table
-with open(input_csv_file, 'r') as csvfile:
-    reader = csv.DictReader(csvfile)
-    for row in reader:
-        # Remove unwanted columns and replace empty fields with 'None'
-        cleaned_row = {key: (value if value else None) for key, value in row.items() if key not in ['region_url', 'image_url', 'description', 'posting_date']}
-        
+
+# Set-based merge of the staged rows, skipping ids that are already loaded; rows are stamped as the merge writes them
+merge_query = f"""
+INSERT INTO vehicles ({', '.join(vehicle_columns)}, updated_at)
+SELECT {', '.join(vehicle_columns)}, clock_timestamp() FROM vehicles_staging
+ON CONFLICT (id) DO NOTHING;
+"""
+
+insert_query = """
+INSERT INTO vehicles (
+    id, url, region, price, year, manufacturer, model, condition,
+    cylinders, fuel, odometer, title_status, transmission, vin,
+    drive, size, type, paint_color, county, state, lat, long
+) VALUES (%(id)s, %(url)s, %(region)s, %(price)s, %(year)s, %(manufacturer)s,
+          %(model)s, %(condition)s, %(cylinders)s, %(fuel)s, %(odometer)s,
+          %(title_status)s, %(transmission)s, %(vin)s, %(drive)s, %(size)s,
+          %(type)s, %(paint_color)s, %(county)s, %(state)s, %(lat)s, %(long)s)
+ON CONFLICT (id) DO NOTHING;
+"""
+
+def clean_row(row):
+    # Remove unwanted columns and replace empty fields with 'None'
+    # Keys are lower-cased so CSV headers such as 'VIN' match the table columns
+    return {key.lower(): (value if value else None) for key, value in row.items() if key and key not in excluded_columns}
+
+def copy_batch(cur, rows):
+    # Write the batch into an in-memory CSV buffer; None becomes an unquoted empty field, which COPY reads as NULL
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow([row.get(column) for column in vehicle_columns])
+    buffer.seek(0)
+    cur.copy_expert(copy_query, buffer)
+
+def merge_staging(cur):
+    # Move the staged rows into vehicles in one statement and empty the staging table
+    cur.execute(merge_query)
+    merged_count = cur.rowcount
+    cur.execute("TRUNCATE vehicles_staging;")
+    return merged_count
+
+def bulk_load(conn, csv_file, batch_size=10000, commit_interval=10, ledger_file=None):
+    cur = conn.cursor()
+    cur.execute(create_staging_query)
+    conn.commit()
+
+    # Skip straight to the end of the last committed batch of a previous run
+    checkpoint = load_checkpoint(ledger_file, csv_file)
+    start_offset = checkpoint['offset'] if checkpoint else 0
+    resumed_count = checkpoint['rows'] if checkpoint else 0
+
+    print(f"Bulk load: batch size {batch_size} rows, commit every {commit_interval} batches.")
+    start_time = time.perf_counter()
+    row_count = 0
+    merged_count = 0
+    batch_count = 0
+    batch = []
+    last_offset = start_offset
+    last_id = None
+
+    def flush(commit):
+        nonlocal row_count, merged_count, batch_count, batch
+        if batch:
+            copy_batch(cur, batch)
+            row_count += len(batch)
+            batch_count += 1
+            batch = []
+        if commit:
+            merged_count += merge_staging(cur)
+            conn.commit()
+            if ledger_file:
+                save_checkpoint(ledger_file, csv_file, last_offset, last_id, resumed_count + row_count)
+            elapsed = time.perf_counter() - start_time
+            print(f"Committed {row_count} rows ({merged_count} new) in {elapsed:.2f}s: "
+                  f"{row_count / elapsed if elapsed else 0:.0f} rows/sec")
+
+    for row, last_offset in iter_csv_rows(csv_file, start_offset):
+        cleaned_row = clean_row(row)
+        last_id = cleaned_row.get('id')
+        batch.append(cleaned_row)
+        if len(batch) >= batch_size:
+            flush(commit=(batch_count + 1) % commit_interval == 0)
+
+    # Copy and merge whatever is left after the last full commit interval
+    flush(commit=True)
+    clear_checkpoint(ledger_file)
+    cur.close()
+    return row_count, merged_count
+
+def row_load(conn, csv_file, checkpoint_interval=10000, ledger_file=None):
+    cur = conn.cursor()
+    checkpoint = load_checkpoint(ledger_file, csv_file)
+    start_offset = checkpoint['offset'] if checkpoint else 0
+    resumed_count = checkpoint['rows'] if checkpoint else 0
+
+    row_count = 0
+    for row, offset in iter_csv_rows(csv_file, start_offset):
         # Insert the cleaned row into the PostgreSQL table
-        insert_query = """
-        INSERT INTO vehicles (
-            id, url, region, price, year, manufacturer, model, condition,
-            cylinders, fuel, odometer, title_status, transmission, vin,
-            drive, size, type, paint_color, county, state, lat, long
-        ) VALUES (%(id)s, %(url)s, %(region)s, %(price)s, %(year)s, %(manufacturer)s,
-                  %(model)s, %(condition)s, %(cylinders)s, %(fuel)s, %(odometer)s,
-                  %(title_status)s, %(transmission)s, %(vin)s, %(drive)s, %(size)s,
-                  %(type)s, %(paint_color)s, %(county)s, %(state)s, %(lat)s, %(long)s)
-        ON CONFLICT (id) DO NOTHING;
-        """
+        cleaned_row = clean_row(row)
         cur.execute(insert_query, cleaned_row)
         conn.commit()
+        row_count += 1
+        if ledger_file and row_count % checkpoint_interval == 0:
+            save_checkpoint(ledger_file, csv_file, offset, cleaned_row['id'], resumed_count + row_count)
+
+    clear_checkpoint(ledger_file)
+    cur.close()
+    return row_count
+
+def main():
+    # Connect to the PostgreSQL database
+    with span('postgres_load', 'connect'):
+        conn = psycopg2.connect(**db_config)
+        cur = conn.cursor()
+        cur.execute(create_table_query)
+        conn.commit()
+
+    # Read the CSV data and insert into PostgreSQL table
+    with span('postgres_load', f"load_{load_config['mode']}") as load:
+        if load_config['mode'] == 'bulk':
+            row_count, _ = bulk_load(conn, input_csv_file, load_config['batch_size'], load_config['commit_interval'],
+                                     load_config['ledger_file'])
+        else:
+            row_count = row_load(conn, input_csv_file, load_config['batch_size'], load_config['ledger_file'])
+        load.add(rows=row_count, bytes=os.path.getsize(input_csv_file))
+
+    # Close the database connection
+    cur.close()
+    conn.close()
 
-# Close the database connection
-cur.close()
-conn.close()
+    print("Data has been inserted into the PostgreSQL table.")
 
-print("Data has been inserted into the PostgreSQL table.")
+if __name__ == "__main__":
+    main()
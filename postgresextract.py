@@ -1,6 +1,11 @@
 import csv
+import json
+import multiprocessing as mp
+import os
+import shutil
 import psycopg2
-from datetime import datetime
+from datetime import datetime, timedelta
+from metrics import span
 
 # Database connection details
 db_config = {
@@ -14,67 +19,387 @@ db_config = {
 # Output CSV file
 output_csv_file = 'extracted_vehicles.csv'
 
-# Record the start time of the job
-job_start_time = datetime.now()
-print(f"Job started at: {job_start_time}")
-
-# Connect to the PostgreSQL database
-conn_start_time = datetime.now()
-conn = psycopg2.connect(**db_config)
-cur = conn.cursor()
-conn_end_time = datetime.now()
-print(f"Connection established at: {conn_start_time}")
-print(f"Connection established in: {conn_end_time - conn_start_time}")
+# Configuration for the export
+export_config = {
+    'mode': 'copy',          # 'copy' streams COPY ... TO STDOUT straight into the file, 'cursor' uses a server-side cursor
+    'itersize': 10000,       # Rows fetched per round trip in 'cursor' mode and for Parquet shards
+    'workers': 1,            # More than 1 splits the table into slices exported over concurrent connections
+    'partition': 'id_range',  # How slices are cut: 'id_range' (balanced id quantiles), 'hash' (id modulo) or 'state'
+    'shard_format': 'csv',   # 'csv' or 'parquet' shard files when workers > 1
+    'merge_shards': True,    # Combine the shards into one output file afterwards
+    'incremental': False,    # Export only rows past the stored high-water mark into a dated delta file
+    'watermark_column': 'updated_at',  # 'updated_at' (stamped by the loaders) or 'id', only for ids assigned in increasing order
+    'watermark_lag_seconds': 60,  # Deltas skip rows written this recently; must exceed the longest load transaction
+    'watermark_file': 'extract_watermark.json',  # Delta file names in it are relative to its directory
+    'compact_deltas': False  # Fold the delta files into output_csv_file after the export
+}
 
 # Query to select all data from the vehicles table
-select_query = "SELECT * FROM vehicles;"
-
-# Execute the query
-query_start_time = datetime.now()
-cur.execute(select_query)
-rows = cur.fetchall()
-query_end_time = datetime.now()
-print(f"Query executed at: {query_start_time}")
-print(f"Query executed in: {query_end_time - query_start_time}")
-
-# Get column names from the cursor description
-column_names = [desc[0] for desc in cur.description]
-
-# Write data to CSV file
-write_start_time = datetime.now()
-with open(output_csv_file, 'w', newline='', encoding='utf-8') as csvfile:
-    writer = csv.writer(csvfile)
-    writer.writerow(column_names)  # Write header
-    writer.writerows(rows)  # Write data
-write_end_time = datetime.now()
-print(f"Data written to CSV at: {write_start_time}")
-print(f"Data written in: {write_end_time - write_start_time}")
-
-# Close the database connection
-cur.close()
-conn.close()
-
-# Record the end time of the job
-job_end_time = datetime.now()
-print(f"Job ended at: {job_end_time}")
-
-# Calculate the duration
-job_duration = job_end_time - job_start_time
-print(f"Job duration: {job_duration}")
-
-# Calculate the total number of records read
-record_count = len(rows)
-print(f"Total number of records read: {record_count}")
-
-# Output summary statistics
-print("\nSummary Statistics:")
-print(f"Job started at: {job_start_time}")
-print(f"Connection established at: {conn_start_time}")
-print(f"Connection established in: {conn_end_time - conn_start_time}")
-print(f"Query executed at: {query_start_time}")
-print(f"Query executed in: {query_end_time - query_start_time}")
-print(f"Data written to CSV at: {write_start_time}")
-print(f"Data written in: {write_end_time - write_start_time}")
-print(f"Job ended at: {job_end_time}")
-print(f"Job duration: {job_duration}")
-print(f"Total number of records read: {record_count}")
+select_query = "SELECT * FROM vehicles"
+
+# PostgreSQL type OIDs mapped to Parquet column types; anything else is written as text
+parquet_type_names = {16: 'bool', 20: 'int64', 21: 'int16', 23: 'int32', 700: 'float32', 701: 'float64'}
+
+def export_with_copy(conn, csv_file, query=select_query):
+    # The server formats the CSV and psycopg2 writes it to the file as it arrives
+    cur = conn.cursor()
+    with open(csv_file, 'w', newline='', encoding='utf-8') as csvfile:
+        cur.copy_expert(f"COPY ({query}) TO STDOUT WITH (FORMAT csv, HEADER)", csvfile)
+    record_count = cur.rowcount
+    cur.close()
+    return record_count
+
+def export_with_cursor(conn, csv_file, itersize, query=select_query):
+    # A named cursor keeps the result set on the server and hands it over itersize rows at a time
+    record_count = 0
+    with conn.cursor(name='vehicles_export') as cur:
+        cur.itersize = itersize
+        cur.execute(query)
+        rows = iter(cur)
+        first_row = next(rows, None)
+        with open(csv_file, 'w', newline='', encoding='utf-8') as csvfile:
+            writer = csv.writer(csvfile)
+            if first_row is not None:
+                # Column names are only known once the first rows have been fetched
+                writer.writerow([desc[0] for desc in cur.description])  # Write header
+                writer.writerow(first_row)
+                record_count = 1
+                for row in rows:
+                    writer.writerow(row)
+                    record_count += 1
+    return record_count
+
+def export_to_parquet(conn, parquet_file, itersize, query=select_query):
+    # Fetch itersize rows at a time from a named cursor and write each block as a Parquet row group
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    record_count = 0
+    with conn.cursor(name='vehicles_export') as cur:
+        cur.itersize = itersize
+        cur.execute(query)
+        rows = cur.fetchmany(itersize)
+        # The description is filled in by the first fetch, even when it returns no rows
+        schema = pa.schema([(desc.name, pa.type_for_alias(parquet_type_names.get(desc.type_code, 'string')))
+                            for desc in cur.description])
+        with pq.ParquetWriter(parquet_file, schema) as writer:
+            while rows:
+                arrays = []
+                for index, field in enumerate(schema):
+                    values = [row[index] for row in rows]
+                    if field.type == pa.string():
+                        values = [None if value is None else str(value) for value in values]
+                    arrays.append(pa.array(values, type=field.type))
+                writer.write_batch(pa.RecordBatch.from_arrays(arrays, schema=schema))
+                record_count += len(rows)
+                rows = cur.fetchmany(itersize)
+    return record_count
+
+def build_slice_queries(conn, workers, partition):
+    """Split the vehicles table into at most workers WHERE-restricted queries covering every row once."""
+    cur = conn.cursor()
+    if partition == 'id_range':
+        # Balanced boundaries from id quantiles, so each slice is an index range scan of similar size
+        fractions = [index / workers for index in range(1, workers)]
+        cur.execute("SELECT percentile_disc(%s::float8[]) WITHIN GROUP (ORDER BY id) FROM vehicles", (fractions,))
+        boundaries = sorted(set(cur.fetchone()[0] or []))
+        edges = [None] + boundaries + [None]
+        conditions = []
+        for lower, upper in zip(edges, edges[1:]):
+            parts = ([f"id >= {lower}"] if lower is not None else []) + ([f"id < {upper}"] if upper is not None else [])
+            conditions.append(' AND '.join(parts) or 'TRUE')
+    elif partition == 'hash':
+        conditions = [f"mod(id, {workers}) = {index}" for index in range(workers)]
+    elif partition == 'state':
+        # Spread states over the workers, largest first, so slices stay roughly even
+        cur.execute("SELECT state, count(*) FROM vehicles GROUP BY state ORDER BY count(*) DESC")
+        groups = [[] for _ in range(workers)]
+        sizes = [0] * workers
+        for state, count in cur.fetchall():
+            smallest = sizes.index(min(sizes))
+            groups[smallest].append(state)
+            sizes[smallest] += count
+        conditions = []
+        for states in groups:
+            if not states:
+                continue
+            named = [state for state in states if state is not None]
+            parts = ([cur.mogrify("state = ANY(%s)", (named,)).decode('utf-8')] if named else []) + \
+                    (["state IS NULL"] if None in states else [])
+            conditions.append(' OR '.join(parts))
+    else:
+        raise ValueError(f"Unknown partition scheme: {partition}")
+    cur.close()
+    return [f"{select_query} WHERE {condition}" for condition in conditions]
+
+def export_snapshot(conn):
+    # Open a REPEATABLE READ transaction on conn and publish its snapshot; it stays valid until that transaction ends
+    conn.set_session(isolation_level='REPEATABLE READ', readonly=True)
+    cur = conn.cursor()
+    cur.execute("SELECT pg_export_snapshot()")
+    snapshot = cur.fetchone()[0]
+    cur.close()
+    return snapshot
+
+def use_snapshot(conn, snapshot):
+    # SET TRANSACTION SNAPSHOT has to be the first statement of a REPEATABLE READ transaction
+    conn.set_session(isolation_level='REPEATABLE READ', readonly=True)
+    cur = conn.cursor()
+    cur.execute("SET TRANSACTION SNAPSHOT %s", (snapshot,))
+    cur.close()
+
+def export_slice(task):
+    # Runs in a worker process with its own connection, reading the coordinator's snapshot
+    index, query, shard_file, shard_format, itersize, snapshot = task
+    with span('postgres_extract', f'export_worker_{index}') as worker:
+        with span('postgres_extract', f'connect_worker_{index}') as connect:
+            conn = psycopg2.connect(**db_config)
+            use_snapshot(conn, snapshot)
+        if shard_format == 'parquet':
+            record_count = export_to_parquet(conn, shard_file, itersize, query)
+        else:
+            record_count = export_with_copy(conn, shard_file, query)
+        conn.close()
+        worker.add(rows=record_count, bytes=os.path.getsize(shard_file))
+    return {'worker': index, 'file': shard_file, 'rows': record_count, 'bytes': worker.bytes,
+            'connect_seconds': connect.seconds, 'seconds': worker.seconds}
+
+def merge_shards(shard_files, output_file, shard_format):
+    if shard_format == 'parquet':
+        import pyarrow.parquet as pq
+        writer = None
+        for shard_file in shard_files:
+            shard = pq.ParquetFile(shard_file)
+            writer = writer or pq.ParquetWriter(output_file, shard.schema_arrow)
+            for group in range(shard.num_row_groups):
+                writer.write_table(shard.read_row_group(group))
+        if writer is not None:
+            writer.close()
+        return
+
+    # Keep the header of the first shard only
+    with open(output_file, 'wb') as output:
+        for position, shard_file in enumerate(shard_files):
+            with open(shard_file, 'rb') as shard:
+                header = shard.readline()
+                if position == 0:
+                    output.write(header)
+                shutil.copyfileobj(shard, output, 1 << 20)
+
+def export_parallel(conn, output_file, workers, partition, shard_format, itersize, merge):
+    """Export slices of the table concurrently, one connection and one shard file per slice.
+
+    conn exports its snapshot and holds it open while the workers run; each worker
+    imports it, so the slices and their boundaries all see the table as of one moment,
+    even while loads write to it.
+    """
+    snapshot = export_snapshot(conn)
+    try:
+        queries = build_slice_queries(conn, workers, partition)
+        base_name, _ = os.path.splitext(output_file)
+        extension = '.parquet' if shard_format == 'parquet' else '.csv'
+        tasks = [(index, query, f"{base_name}_part{index}{extension}", shard_format, itersize, snapshot)
+                 for index, query in enumerate(queries)]
+        with mp.Pool(len(tasks)) as pool:
+            worker_stats = pool.map(export_slice, tasks)
+    finally:
+        conn.rollback()
+        conn.set_session(isolation_level='DEFAULT', readonly='DEFAULT')
+
+    shard_files = [stats['file'] for stats in worker_stats]
+    if merge:
+        merged_file = f"{base_name}{extension}"
+        merge_shards(shard_files, merged_file, shard_format)
+        for shard_file in shard_files:
+            os.remove(shard_file)
+        output_files = [merged_file]
+    else:
+        output_files = shard_files
+    return sum(stats['rows'] for stats in worker_stats), output_files, worker_stats
+
+def load_watermark(watermark_file):
+    if not os.path.exists(watermark_file):
+        return {'column': None, 'value': None, 'deltas': []}
+    with open(watermark_file, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def save_watermark(watermark_file, state):
+    # Replace the file in one step so an interrupted run keeps the previous mark
+    temp_file = f'{watermark_file}.tmp'
+    with open(temp_file, 'w', encoding='utf-8') as f:
+        json.dump(state, f, indent=2)
+    os.replace(temp_file, watermark_file)
+
+def delta_path(watermark_file, delta_file):
+    # Delta files are recorded relative to the watermark file, so the export can run from any working directory
+    return os.path.join(os.path.dirname(os.path.abspath(watermark_file)), delta_file)
+
+def export_incremental(conn, output_file, column, watermark_file, lag_seconds=0):
+    """Export the rows past the stored high-water mark into a dated delta file and advance the mark.
+
+    An updated_at mark relies on the loaders stamping rows with clock_timestamp() as
+    they write them. An id mark only works when ids are assigned in increasing order:
+    listing ids are not (vehiclestest.csv has 7222695916 before 7218891961), and a
+    row loaded later with a lower id than the mark is never exported. Whatever the
+    column, the mark only advances over rows written at least lag_seconds ago. Limits:
+    - A row only becomes visible when its transaction commits. If that commit lands
+      more than lag_seconds after the stamp, a later mark has already passed the
+      row, and the row is never exported. lag_seconds must exceed the longest load
+      transaction, which for postgres.py is commit_interval batches.
+    - The loaders skip ids that already exist, so a changed row is never restamped
+      or exported again.
+    - Deleted rows are never exported.
+    """
+    state = load_watermark(watermark_file)
+    if state['column'] != column:
+        # A mark on another column says nothing about this one, so start with a full delta
+        state = {'column': column, 'value': None, 'deltas': state['deltas']}
+    low = state['value']
+
+    # Fix the upper bound first so the delta and the new mark cover exactly the same rows
+    cur = conn.cursor()
+    # Rows written within the lag may belong to transactions whose other rows are not visible yet
+    lag_condition = " AND updated_at <= now() - make_interval(secs => %(lag)s)"
+    cur.execute(f"SELECT max({column})::text FROM vehicles WHERE (%(low)s IS NULL OR {column} > %(low)s){lag_condition}",
+                {'low': low, 'lag': lag_seconds})
+    high = cur.fetchone()[0]
+    if high is None:
+        cur.close()
+        print(f"No rows past the high-water mark {column} = {low}.")
+        return 0, []
+
+    if low is None:
+        condition = cur.mogrify(f"{column} <= %s", (high,)).decode('utf-8')
+    else:
+        condition = cur.mogrify(f"{column} > %s AND {column} <= %s", (low, high)).decode('utf-8')
+    cur.close()
+
+    base_name, extension = os.path.splitext(output_file)
+    delta_file = f"{base_name}_delta_{datetime.now():%Y%m%dT%H%M%S}{extension}"
+    record_count = export_with_copy(conn, delta_file, f"{select_query} WHERE {condition} ORDER BY {column}")
+
+    relative_file = os.path.relpath(os.path.abspath(delta_file), os.path.dirname(os.path.abspath(watermark_file)))
+    state.update(value=high, exported_at=datetime.now().isoformat(), deltas=state['deltas'] + [relative_file])
+    save_watermark(watermark_file, state)
+    print(f"Exported {record_count} rows with {column} in ({low}, {high}] to '{delta_file}'.")
+    return record_count, [delta_file]
+
+def compact_deltas(snapshot_file, watermark_file):
+    """Fold the delta files into the full snapshot; for an id present in several files the newest row wins."""
+    state = load_watermark(watermark_file)
+    deltas = [delta_path(watermark_file, delta_file) for delta_file in state['deltas']]
+    if not deltas:
+        return 0
+
+    def read_rows(csv_file):
+        with open(csv_file, 'r', newline='', encoding='utf-8') as f:
+            reader = csv.reader(f)
+            header = next(reader, None)
+            if header is None:
+                return
+            id_index = header.index('id')
+            yield header
+            for row in reader:
+                yield row[id_index], row
+
+    # Only the ids of the deltas are kept in memory, never the snapshot itself
+    newest_delta = {}
+    for position, delta_file in enumerate(deltas):
+        rows = read_rows(delta_file)
+        next(rows, None)
+        for row_id, _ in rows:
+            newest_delta[row_id] = position
+
+    # Snapshot rows survive unless a delta replaced them; delta rows survive unless a later delta did
+    sources = [(snapshot_file, None)] if os.path.exists(snapshot_file) else []
+    sources += [(delta_file, position) for position, delta_file in enumerate(deltas)]
+
+    temp_file = f'{snapshot_file}.tmp'
+    record_count = 0
+    with open(temp_file, 'w', newline='', encoding='utf-8') as output:
+        writer = csv.writer(output)
+        header_written = False
+        for source_file, position in sources:
+            rows = read_rows(source_file)
+            header = next(rows, None)
+            if header is None:
+                continue
+            if not header_written:
+                writer.writerow(header)
+                header_written = True
+            for row_id, row in rows:
+                if newest_delta.get(row_id) == position:
+                    writer.writerow(row)
+                    record_count += 1
+    os.replace(temp_file, snapshot_file)
+
+    for delta_file in deltas:
+        os.remove(delta_file)
+    state['deltas'] = []
+    save_watermark(watermark_file, state)
+    print(f"Compacted {len(deltas)} delta files into '{snapshot_file}' ({record_count} rows).")
+    return record_count
+
+def main():
+    with span('postgres_extract', 'job') as job:
+        print(f"Job started at: {job.started_at}")
+
+        # Connect to the PostgreSQL database
+        with span('postgres_extract', 'connect') as connect:
+            conn = psycopg2.connect(**db_config)
+
+        # Stream the table into the output file(s) without holding the rows in memory
+        worker_stats = []
+        with span('postgres_extract', 'export') as export:
+            if export_config['incremental']:
+                mode = f"incremental on {export_config['watermark_column']}"
+                record_count, output_files = export_incremental(
+                    conn, output_csv_file, export_config['watermark_column'], export_config['watermark_file'],
+                    export_config['watermark_lag_seconds'])
+            elif export_config['workers'] > 1:
+                mode = f"{export_config['workers']} workers, {export_config['partition']} slices, {export_config['shard_format']} shards"
+                record_count, output_files, worker_stats = export_parallel(
+                    conn, output_csv_file, export_config['workers'], export_config['partition'],
+                    export_config['shard_format'], export_config['itersize'], export_config['merge_shards'])
+            else:
+                mode = f"{export_config['mode']} mode"
+                if export_config['mode'] == 'copy':
+                    record_count = export_with_copy(conn, output_csv_file)
+                else:
+                    record_count = export_with_cursor(conn, output_csv_file, export_config['itersize'])
+                output_files = [output_csv_file]
+            export.add(rows=record_count, bytes=sum(os.path.getsize(file_name) for file_name in output_files))
+
+        if export_config['compact_deltas']:
+            with span('postgres_extract', 'compact') as compact:
+                compact.add(rows=compact_deltas(output_csv_file, export_config['watermark_file']))
+
+        # Close the database connection
+        conn.close()
+        job.add(rows=export.rows, bytes=export.bytes)
+
+    # Output summary statistics
+    print("\nSummary Statistics:")
+    print(f"Job started at: {job.started_at}")
+    print(f"Connection established at: {connect.started_at}")
+    print(f"Connection established in: {timedelta(seconds=connect.seconds)}")
+    print(f"Data exported at: {export.started_at}")
+    print(f"Data exported in: {timedelta(seconds=export.seconds)} ({mode})")
+    print(f"Job ended at: {job.started_at + timedelta(seconds=job.seconds)}")
+    print(f"Job duration: {timedelta(seconds=job.seconds)}")
+    print(f"Total number of records read: {record_count}")
+    print(f"Rows per second: {export.rows / export.seconds if export.seconds else 0:.0f}")
+    print(f"Bytes per second: {export.bytes / export.seconds if export.seconds else 0:.0f} ({export.bytes} bytes written)")
+    for stats in worker_stats:
+        # Similar per-worker MB/sec that drops as workers are added points at the disk; uneven seconds point at the slices or the DB
+        print(f"Worker {stats['worker']}: {stats['rows']} rows, {stats['bytes']} bytes in {stats['seconds']:.2f}s "
+              f"(connect {stats['connect_seconds']:.2f}s, "
+              f"{stats['rows'] / stats['seconds'] if stats['seconds'] else 0:.0f} rows/sec, "
+              f"{stats['bytes'] / stats['seconds'] / 1e6 if stats['seconds'] else 0:.2f} MB/sec)")
+    if worker_stats:
+        busy_seconds = sum(stats['seconds'] for stats in worker_stats)
+        print(f"Parallel efficiency: {busy_seconds / export.seconds if export.seconds else 0:.2f} "
+              f"worker-seconds per wall-clock second across {len(worker_stats)} workers")
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,8 @@
-import csv
+import time
 import psycopg2
+from psycopg2.extras import execute_values
+from checkpoint import load_checkpoint, save_checkpoint, clear_checkpoint
+from csvstream import iter_csv_rows
 
 # Define input file and database connection details
 input_csv_file = 'vehicles.csv'
@@ -15,14 +18,21 @@ db_config = {
 checkpoints = {
     'table_creation': True,
     'row_processing': True,
-    'processing_interval': 50000  # Interval for row processing messages
+    'processing_interval': 50000,  # Interval for row processing messages
+    'batch_size': 5000,            # Rows sent per multi-row INSERT and committed together
+    'ledger_file': 'vehicles_postgrestst_checkpoint.json'  # Durable resume point; None disables it
 }
 
-# Connect to the PostgreSQL database
-conn = psycopg2.connect(**db_config)
-cur = conn.cursor()
+# Define all required keys, in table column order
+required_keys = [
+    'id', 'url', 'region', 'price', 'year', 'manufacturer', 'model', 'condition',
+    'cylinders', 'fuel', 'odometer', 'title_status', 'transmission', 'vin', 'drive',
+    'size', 'type', 'paint_color', 'county', 'state', 'lat', 'long'
+]
 
 # Define the table creation query (if not already created)
+# updated_at defaults to clock_timestamp(), the moment each row is written, rather than now(), the start of the
+# loading transaction, which can be long before the commit that makes the row visible to incremental exports
 create_table_query = """
 CREATE TABLE IF NOT EXISTS vehicles (
     id BIGINT PRIMARY KEY,
@@ -46,67 +56,120 @@ CREATE TABLE IF NOT EXISTS vehicles (
     county TEXT,
     state TEXT,
     lat FLOAT,
-    long FLOAT
+    long FLOAT,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT clock_timestamp()
 );
+ALTER TABLE vehicles ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ NOT NULL DEFAULT now();
+ALTER TABLE vehicles ALTER COLUMN updated_at SET DEFAULT clock_timestamp();
+CREATE INDEX IF NOT EXISTS idx_vehicles_updated_at ON vehicles (updated_at);
 """
 
-# Create table if configured
-if checkpoints['table_creation']:
-    cur.execute(create_table_query)
-    conn.commit()
-    print("Table created successfully.")
-
-# Read the CSV data and insert into PostgreSQL table
-row_count = 0
-with open(input_csv_file, 'r', encoding='utf-8') as csvfile:
-    reader = csv.DictReader(csvfile)
-    for row in reader:
-        row_count += 1
+# Multi-row insert; existing ids are skipped by the server instead of a SELECT per row
+insert_query = f"""
+INSERT INTO vehicles ({', '.join(required_keys)})
+VALUES %s
+ON CONFLICT (id) DO NOTHING;
+"""
+
+def clean_row(row):
+    # Clean and prepare row as a tuple in column order, setting missing or empty values to None
+    row = {key.lower(): value for key, value in row.items() if key}
+    return tuple(row.get(key) or None for key in required_keys)
+
+def insert_batch(cur, rows):
+    # Insert all rows in a single statement and return how many were new
+    execute_values(cur, insert_query, rows, page_size=len(rows))
+    return cur.rowcount
+
+def insert_isolated(cur, rows):
+    """Insert rows under a savepoint; on failure bisect the batch so only the bad rows are rejected."""
+    cur.execute("SAVEPOINT vehicles_batch")
+    try:
+        inserted = insert_batch(cur, rows)
+        cur.execute("RELEASE SAVEPOINT vehicles_batch")
+        return inserted, []
+    except psycopg2.Error as e:
+        cur.execute("ROLLBACK TO SAVEPOINT vehicles_batch")
+        cur.execute("RELEASE SAVEPOINT vehicles_batch")
+        if len(rows) == 1:
+            print(f"Error inserting row with ID {rows[0][0]}: {e}")
+            return 0, rows
+
+    middle = len(rows) // 2
+    left_inserted, left_rejected = insert_isolated(cur, rows[:middle])
+    right_inserted, right_rejected = insert_isolated(cur, rows[middle:])
+    return left_inserted + right_inserted, left_rejected + right_rejected
+
+def load(conn, csv_file, batch_size=5000, ledger_file=None):
+    cur = conn.cursor()
+
+    # Skip straight to the end of the last committed batch of a previous run
+    checkpoint = load_checkpoint(ledger_file, csv_file)
+    start_offset = checkpoint['offset'] if checkpoint else 0
+    row_count = checkpoint['rows'] if checkpoint else 0
+    resumed_count = row_count
 
-        # Define all required keys and set default value to None
-        required_keys = [
-            'id', 'url', 'region', 'price', 'year', 'manufacturer', 'model', 'condition',
-            'cylinders', 'fuel', 'odometer', 'title_status', 'transmission', 'vin', 'drive',
-            'size', 'type', 'paint_color', 'county', 'state', 'lat', 'long'
-        ]
-
-        # Clean and prepare row
-        cleaned_row = {key: (row[key] if key in row and row[key] else None) for key in required_keys}
-
-        try:
-            # Check if the row with the same ID already exists
-            check_query = "SELECT 1 FROM vehicles WHERE id = %s"
-            cur.execute(check_query, (cleaned_row['id'],))
-            exists = cur.fetchone()
-
-            if exists:
-                print(f"Row with ID {cleaned_row['id']} already exists. Skipping insertion.")
-                continue
-
-            # Insert the cleaned row into the PostgreSQL table
-            insert_query = """
-            INSERT INTO vehicles (
-                id, url, region, price, year, manufacturer, model, condition,
-                cylinders, fuel, odometer, title_status, transmission, vin,
-                drive, size, type, paint_color, county, state, lat, long
-            ) VALUES (%(id)s, %(url)s, %(region)s, %(price)s, %(year)s, %(manufacturer)s,
-                      %(model)s, %(condition)s, %(cylinders)s, %(fuel)s, %(odometer)s,
-                      %(title_status)s, %(transmission)s, %(vin)s, %(drive)s, %(size)s,
-                      %(type)s, %(paint_color)s, %(county)s, %(state)s, %(lat)s, %(long)s);
-            """
-            cur.execute(insert_query, cleaned_row)
-            conn.commit()
-
-        except psycopg2.Error as e:
-            print(f"Error inserting row with ID {cleaned_row['id']}: {e}")
-            conn.rollback()  # Rollback the transaction to continue with the next row
+    start_time = time.perf_counter()
+    inserted_count = 0
+    rejected_count = 0
+    next_report = (row_count // checkpoints['processing_interval'] + 1) * checkpoints['processing_interval']
+    batch = []
+    last_offset = start_offset
+
+    def flush():
+        nonlocal inserted_count, rejected_count, next_report, batch
+        inserted, rejected = insert_isolated(cur, batch)
+        conn.commit()
+        if ledger_file:
+            save_checkpoint(ledger_file, csv_file, last_offset, batch[-1][0], row_count)
+        inserted_count += inserted
+        rejected_count += len(rejected)
+        batch = []
 
         # Print progress checkpoint
-        if checkpoints['row_processing'] and row_count % checkpoints['processing_interval'] == 0:
-            print(f"Successfully processed {row_count} rows.")
+        if checkpoints['row_processing'] and row_count >= next_report:
+            elapsed = time.perf_counter() - start_time
+            print(f"Successfully processed {row_count} rows "
+                  f"({(row_count - resumed_count) / elapsed if elapsed else 0:.0f} rows/sec).")
+            while next_report <= row_count:
+                next_report += checkpoints['processing_interval']
+
+    # Read the CSV data and insert into PostgreSQL table
+    for row, last_offset in iter_csv_rows(csv_file, start_offset):
+        row_count += 1
+        batch.append(clean_row(row))
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+
+    clear_checkpoint(ledger_file)
+    cur.close()
+    elapsed = time.perf_counter() - start_time
+    processed_count = row_count - resumed_count
+    skipped_count = processed_count - inserted_count - rejected_count
+    print(f"Inserted {inserted_count} rows, skipped {skipped_count} existing IDs, rejected {rejected_count} rows "
+          f"in {elapsed:.2f}s ({processed_count / elapsed if elapsed else 0:.0f} rows/sec).")
+    return row_count
+
+def main():
+    # Connect to the PostgreSQL database
+    conn = psycopg2.connect(**db_config)
+    cur = conn.cursor()
+
+    # Create table if configured
+    if checkpoints['table_creation']:
+        cur.execute(create_table_query)
+        conn.commit()
+        print("Table created successfully.")
+
+    row_count = load(conn, input_csv_file, checkpoints['batch_size'], checkpoints['ledger_file'])
+
+    # Close the database connection
+    cur.close()
+    conn.close()
 
-# Close the database connection
-cur.close()
-conn.close()
+    print(f"Data has been inserted into the PostgreSQL table. Total rows processed: {row_count}")
 
-print(f"Data has been inserted into the PostgreSQL table. Total rows processed: {row_count}")
+if __name__ == "__main__":
+    main()
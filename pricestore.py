@@ -0,0 +1,197 @@
+import glob
+import os
+import shutil
+import numpy as np
+import pandas as pd
+
+# Root directory of the store: one directory per ticker and interval, one binary file per column
+price_store_path = 'price_store'
+
+# Column files and their on-disk types. Everything is float64: adjusted prices and large quotes need its precision,
+# and Yahoo reports a missing Volume as NaN, which an integer column cannot hold
+price_columns = {
+    'Open': np.float64,
+    'High': np.float64,
+    'Low': np.float64,
+    'Close': np.float64,
+    'Adj Close': np.float64,
+    'Volume': np.float64
+}
+time_type = np.int64  # Seconds since 1970-01-01 UTC, so intraday bars keep their time of day
+
+class PriceStore:
+    """Append-only, column-oriented price history with the sorted timestamp column as its index.
+
+    Each column is a flat array in its own file, so a date range is two binary searches
+    on the memory-mapped timestamp file and a slice of every other column; nothing is
+    parsed. Appends only add bytes at the end of the files. The timestamp file is
+    written last and defines the row count, so a crash mid-append leaves extra bytes
+    in the other columns that the next append trims. Backfilled history is merged
+    into a rewritten copy of the series that replaces it.
+    """
+
+    def __init__(self, path=price_store_path):
+        self.path = path
+
+    def series_path(self, ticker_symbol, interval='1d'):
+        return os.path.join(self.path, ticker_symbol, interval)
+
+    def column_file(self, ticker_symbol, interval, column, series_path=None):
+        return os.path.join(series_path or self.series_path(ticker_symbol, interval), f"{column.lower().replace(' ', '_')}.bin")
+
+    def row_count(self, ticker_symbol, interval='1d'):
+        self.finish_rewrite(ticker_symbol, interval)
+        time_file = self.column_file(ticker_symbol, interval, 'timestamp')
+        return os.path.getsize(time_file) // np.dtype(time_type).itemsize if os.path.exists(time_file) else 0
+
+    def finish_rewrite(self, ticker_symbol, interval):
+        # A rewritten series is complete on disk before it is swapped in, so a swap cut short is finished here
+        series_path = self.series_path(ticker_symbol, interval)
+        if not os.path.exists(series_path) and os.path.exists(f'{series_path}.rewrite'):
+            os.replace(f'{series_path}.rewrite', series_path)
+        if os.path.exists(f'{series_path}.old') and os.path.exists(series_path):
+            shutil.rmtree(f'{series_path}.old')
+
+    def timestamps(self, ticker_symbol, interval='1d'):
+        rows = self.row_count(ticker_symbol, interval)
+        if not rows:
+            return np.empty(0, dtype=time_type)
+        return np.memmap(self.column_file(ticker_symbol, interval, 'timestamp'), dtype=time_type, mode='r', shape=(rows,))
+
+    def first_date(self, ticker_symbol, interval='1d'):
+        stored = self.timestamps(ticker_symbol, interval)
+        return pd.Timestamp(int(stored[0]), unit='s') if len(stored) else None
+
+    def last_date(self, ticker_symbol, interval='1d'):
+        stored = self.timestamps(ticker_symbol, interval)
+        return pd.Timestamp(int(stored[-1]), unit='s') if len(stored) else None
+
+    def tickers(self):
+        return sorted(os.listdir(self.path)) if os.path.isdir(self.path) else []
+
+    def append(self, ticker_symbol, ticker_data, interval='1d'):
+        """Add the rows of ticker_data (a Date column plus price_columns) not stored yet.
+
+        A row for the last stored timestamp replaces it in place, since the last bar of a
+        session still trading is partial; other stored rows keep their values. Rows newer
+        than the last one are appended. Rows older than it that are missing (a backfill of
+        earlier history or of a gap) make the series be rewritten with them merged in.
+        Returns the number of rows added.
+        """
+        os.makedirs(self.series_path(ticker_symbol, interval), exist_ok=True)
+        rows = self.row_count(ticker_symbol, interval)
+        times = self.seconds(ticker_data['Date'])
+        order = np.argsort(times, kind='stable')
+        times = times[order]
+        # Of several rows for one timestamp the last wins
+        unique = np.append(times[1:] != times[:-1], True)
+        order, times = order[unique], times[unique]
+        stored = self.timestamps(ticker_symbol, interval)
+        last_time = int(stored[-1]) if rows else None
+        backfill = last_time is not None and len(np.setdiff1d(times[times < last_time], stored))
+        del stored
+        if backfill:
+            return self.rewrite(ticker_symbol, ticker_data, interval)
+
+        # Rewrite the last row in place when the new data carries the same bar again
+        if last_time is not None and (times == last_time).any():
+            position = np.flatnonzero(times == last_time)[-1]
+            for column, column_type in price_columns.items():
+                value = np.asarray(ticker_data[column].to_numpy()[order][position:position + 1], dtype=column_type)
+                with open(self.column_file(ticker_symbol, interval, column), 'r+b') as f:
+                    f.seek((rows - 1) * np.dtype(column_type).itemsize)
+                    f.write(value.tobytes())
+
+        new = times > last_time if last_time is not None else np.ones(len(times), dtype=bool)
+        if not new.any():
+            return 0
+        for column, column_type in price_columns.items():
+            values = np.asarray(ticker_data[column].to_numpy()[order][new], dtype=column_type)
+            column_file = self.column_file(ticker_symbol, interval, column)
+            with open(column_file, 'ab') as f:
+                # Drop bytes left by an append that died before its timestamp file was written
+                f.truncate(rows * np.dtype(column_type).itemsize)
+                f.write(values.tobytes())
+        with open(self.column_file(ticker_symbol, interval, 'timestamp'), 'ab') as f:
+            f.write(times[new].tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        return int(new.sum())
+
+    def rewrite(self, ticker_symbol, ticker_data, interval='1d'):
+        """Merge ticker_data into the stored series, write the result beside it and swap it in.
+
+        Stored rows keep their values except the last one, as in append. Returns the
+        number of rows added.
+        """
+        stored = self.read(ticker_symbol, interval=interval)
+        incoming = pd.DataFrame({'Date': pd.to_datetime(self.seconds(ticker_data['Date']), unit='s'),
+                                 **{column: ticker_data[column].to_numpy() for column in price_columns}})
+        incoming = incoming.drop_duplicates('Date', keep='last')
+        if len(stored) and (incoming['Date'] == stored['Date'].iloc[-1]).any():
+            stored = stored.iloc[:-1]
+        merged = pd.concat([stored, incoming]).drop_duplicates('Date', keep='first').sort_values('Date', kind='stable')
+
+        series_path = self.series_path(ticker_symbol, interval)
+        rewrite_path = f'{series_path}.rewrite'
+        shutil.rmtree(rewrite_path, ignore_errors=True)
+        os.makedirs(rewrite_path)
+        for column, column_type in price_columns.items():
+            with open(self.column_file(ticker_symbol, interval, column, rewrite_path), 'wb') as f:
+                f.write(np.asarray(merged[column].to_numpy(), dtype=column_type).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+        with open(self.column_file(ticker_symbol, interval, 'timestamp', rewrite_path), 'wb') as f:
+            f.write(self.seconds(merged['Date']).tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+
+        rows = self.row_count(ticker_symbol, interval)
+        os.replace(series_path, f'{series_path}.old')
+        os.replace(rewrite_path, series_path)
+        shutil.rmtree(f'{series_path}.old')
+        return len(merged) - rows
+
+    def read(self, ticker_symbol, start=None, end=None, interval='1d', columns=None):
+        """Rows with start <= Date < end as a DataFrame shaped like the downloaded data."""
+        stored = self.timestamps(ticker_symbol, interval)
+        first = np.searchsorted(stored, self.seconds([start])[0], side='left') if start is not None else 0
+        last = np.searchsorted(stored, self.seconds([end])[0], side='left') if end is not None else len(stored)
+        ticker_data = pd.DataFrame({'Date': pd.to_datetime(np.asarray(stored[first:last]), unit='s')})
+        for column in columns or price_columns:
+            column_type = price_columns[column]
+            values = np.memmap(self.column_file(ticker_symbol, interval, column), dtype=column_type, mode='r',
+                               shape=(len(stored),)) if len(stored) else np.empty(0, dtype=column_type)
+            ticker_data[column] = np.array(values[first:last])
+        return ticker_data
+
+    @staticmethod
+    def seconds(values):
+        # Timezone-aware times (yfinance's intraday bars) are stored as UTC and read back as naive UTC
+        values = pd.DatetimeIndex(pd.to_datetime(values))
+        if values.tz is not None:
+            values = values.tz_convert('UTC').tz_localize(None)
+        return values.to_numpy(dtype='datetime64[s]').astype(time_type)
+
+def import_json_files(pattern='*_transactional_data.json', store=None):
+    """Load the per-ticker JSON files written by stocks.py into the store; returns rows added per ticker."""
+    store = store or PriceStore()
+    added = {}
+    for data_file in sorted(glob.glob(pattern)):
+        name = os.path.basename(data_file)[:-len('_transactional_data.json')]
+        ticker_symbol, _, interval = name.partition('_')
+        ticker_data = pd.read_json(data_file, orient='records', convert_dates=False)
+        ticker_data['Date'] = pd.to_datetime(ticker_data['Date'])
+        added[ticker_symbol] = store.append(ticker_symbol, ticker_data, interval or '1d')
+        print(f"Imported {added[ticker_symbol]} rows from '{data_file}'.")
+    return added
+
+def main():
+    store = PriceStore()
+    import_json_files(store=store)
+    for ticker_symbol in store.tickers():
+        size = sum(os.path.getsize(file_name) for file_name in glob.glob(os.path.join(store.series_path(ticker_symbol), '*.bin')))
+        print(f"{ticker_symbol}: {store.row_count(ticker_symbol)} rows up to {store.last_date(ticker_symbol).date()}, {size / 1024:.1f} KB")
+
+if __name__ == "__main__":
+    main()
@@ -1,31 +1,219 @@
-import yfinance as yf
+import argparse
+import json
+import os
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 import pandas as pd
 import plotly.graph_objs as go
 from datetime import datetime, timedelta
 from dateutil.relativedelta import relativedelta
+from downsample import downsample_indices, downsample_methods
+from indicators import frame_indicators
+from metrics import timed
+from pricestore import PriceStore, import_json_files
+
+# Configuration for fetching market data
+stocks_config = {
+    'provider': 'yahoo',                     # 'yahoo' downloads from Yahoo Finance, 'local' serves deterministic stub data offline
+    'tickers_file': 'companies500.csv',      # Symbols fetched in batch mode
+    'interval': '1d',
+    'history_years': 3,
+    'concurrency': 8,                        # Tickers fetched at the same time in batch mode
+    'price_store_path': 'price_store',      # Columnar price history written by pricestore.PriceStore
+    'cache_index_file': 'market_cache_index.json',  # Date range and fetch time of every ticker in the price store
+    'price_ttl_seconds': 6 * 3600,           # Cached prices younger than this are used without asking the provider
+    'financials_ttl_seconds': 7 * 86400,     # Cached quarterly/annual statements younger than this are reused
+    'plot_max_points': None,                 # Points per price/moving-average trace; None plots every bar
+    'downsample_method': 'lttb'              # 'lttb' keeps the shape of the line, 'minmax' keeps every bucket's extremes
+}
+
+class YahooProvider:
+    """Market data from Yahoo Finance through yfinance."""
+
+    def __init__(self):
+        import yfinance as yf
+        self.yf = yf
+
+    def download(self, ticker_symbol, start, end, interval='1d'):
+        # yf.download keeps its results in module-level dicts that concurrent calls overwrite, so batch mode's threads
+        # each ask their own Ticker; auto_adjust=False keeps 'Adj Close' next to the raw Close for the price store
+        ticker_data = self.yf.Ticker(ticker_symbol).history(start=start, end=end, interval=interval, auto_adjust=False,
+                                                            actions=False)
+        # Reset index to make Date a column; intraday intervals name it Datetime
+        return ticker_data.reset_index().rename(columns={'Datetime': 'Date'})
+
+    def ticker(self, ticker_symbol):
+        return self.yf.Ticker(ticker_symbol)
+
+class LocalTicker:
+    # Statements shaped like yfinance's: one row per line item, one column per period end
+    def __init__(self, ticker_symbol, rng):
+        self.rng = rng
+        scale = rng.uniform(1e9, 2e10)
+        self.info = {'profitMargins': round(rng.uniform(0.05, 0.35), 5), 'trailingPE': round(rng.uniform(8, 60), 5)}
+        self.quarterly_financials, self.quarterly_cashflow, self.quarterly_balance_sheet = self.statements(
+            pd.date_range(end=datetime.now(), periods=5, freq='QE'), scale / 4)
+        self.financials, self.cashflow, self.balance_sheet = self.statements(
+            pd.date_range(end=datetime.now(), periods=4, freq='YE'), scale)
+
+    def statements(self, periods, scale):
+        values = lambda low, high: self.rng.uniform(low, high, len(periods)) * scale
+        financials = pd.DataFrame([values(0.9, 1.1), values(0.05, 0.3)], index=['Total Revenue', 'Net Income'], columns=periods)
+        cashflow = pd.DataFrame([values(0.1, 0.4)], index=['Operating Cash Flow'], columns=periods)
+        balance_sheet = pd.DataFrame([values(0.2, 0.8)], index=['Long Term Debt'], columns=periods)
+        return financials, cashflow, balance_sheet
+
+class LocalProvider:
+    """Offline stand-in for YahooProvider: a deterministic random walk and statements per ticker, no network."""
+
+    def __init__(self):
+        self.calls = []
+
+    def rng(self, ticker_symbol, *key):
+        return np.random.default_rng([zlib.crc32(ticker_symbol.encode('utf-8')), *key])
+
+    def download(self, ticker_symbol, start, end, interval='1d'):
+        self.calls.append(('download', ticker_symbol, pd.Timestamp(start).date(), pd.Timestamp(end).date()))
+        # Every business day since 2000 has a fixed price, so overlapping requests agree with each other
+        days = pd.bdate_range(start=max(pd.Timestamp(start).normalize(), pd.Timestamp('2000-01-03')),
+                              end=pd.Timestamp(end).normalize() - timedelta(days=1))
+        offsets = (days - pd.Timestamp('2000-01-03')).days.to_numpy()
+        rng = self.rng(ticker_symbol)
+        walk = np.cumsum(rng.normal(0.0003, 0.02, 10000))
+        close = 50 * np.exp(walk[offsets % len(walk)])
+        noise = self.rng(ticker_symbol, 1).uniform(0, 0.02, (10000, 2))[offsets % len(walk)]
+        return pd.DataFrame({
+            'Date': days,
+            'Open': close * (1 - noise[:, 0] / 2),
+            'High': close * (1 + noise[:, 0]),
+            'Low': close * (1 - noise[:, 1]),
+            'Close': close,
+            'Adj Close': close,
+            'Volume': (1e6 * (1 + noise[:, 1] * 50)).astype(np.int64)
+        })
+
+    def ticker(self, ticker_symbol):
+        self.calls.append(('ticker', ticker_symbol))
+        return LocalTicker(ticker_symbol, self.rng(ticker_symbol, 2))
+
+providers = {'yahoo': YahooProvider, 'local': LocalProvider}
+_provider = None
+
+def get_provider():
+    # Created on first use so importing this module needs neither yfinance nor a network
+    global _provider
+    if _provider is None:
+        _provider = providers[stocks_config['provider']]()
+    return _provider
+
+def set_provider(provider):
+    # Inject any object with download() and ticker(), e.g. LocalProvider() in tests
+    global _provider
+    _provider = provider
+
+_cache_lock = threading.Lock()
+
+def load_cache_index():
+    if not os.path.exists(stocks_config['cache_index_file']):
+        return {}
+    with open(stocks_config['cache_index_file'], 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def update_cache_index(key, entry):
+    # Batch mode fetches tickers on several threads, so index updates are serialized and written atomically
+    with _cache_lock:
+        index = load_cache_index()
+        index[key] = entry
+        temp_file = f"{stocks_config['cache_index_file']}.{threading.get_ident()}.tmp"
+        with open(temp_file, 'w', encoding='utf-8') as f:
+            json.dump(index, f, indent=2, sort_keys=True)
+        os.replace(temp_file, stocks_config['cache_index_file'])
+
+def get_price_store():
+    return PriceStore(stocks_config['price_store_path'])
+
+def is_fresh(fetched_at, ttl_seconds):
+    return fetched_at is not None and (datetime.now() - datetime.fromisoformat(fetched_at)).total_seconds() < ttl_seconds
 
 # Function to pull last 3 years of daily transactional data for any ticker
-def fetch_transactional_data(ticker_symbol):
+@timed('stocks', count=len)
+def fetch_transactional_data(ticker_symbol, interval=None):
+    """Return the last history_years of bars, downloading only what the price store does not already cover.
+
+    The cache index, keyed by ticker and interval, records the date range the store
+    covers and when it was fetched. Within the TTL the store is read as is; after it,
+    only the tail from the last stored bar on is downloaded and appended (the last bar
+    is refetched because it may have been partial). When the store does not reach back
+    to start_date the whole range is downloaded and the older bars are merged in.
+    """
+    interval = interval or stocks_config['interval']
     # Calculate the date range for the last 3 years
     end_date = datetime.now()
-    start_date = end_date - relativedelta(years=3)
-    
-    # Download the historical market data from Yahoo Finance
-    ticker_data = yf.download(ticker_symbol, start=start_date, end=end_date, interval='1d')
-    
-    # Reset index to make Date a column and convert it to JSON format
-    ticker_data.reset_index(inplace=True)
-    
-    # Save to a JSON file
-    ticker_data.to_json(f'{ticker_symbol}_transactional_data.json', orient='records', date_format='iso')
-    
-    print(f"Transactional data for last 3 years saved to '{ticker_symbol}_transactional_data.json'.")
+    start_date = end_date - relativedelta(years=stocks_config['history_years'])
+    store = get_price_store()
+    key = f'{ticker_symbol}/{interval}'
+
+    # A JSON file from before the store existed is imported once
+    legacy_file = f'{ticker_symbol}_transactional_data.json' if interval == '1d' else f'{ticker_symbol}_{interval}_transactional_data.json'
+    if not store.row_count(ticker_symbol, interval) and os.path.exists(legacy_file):
+        import_json_files(legacy_file, store)
+
+    entry = load_cache_index().get(key)
+    first_date = store.first_date(ticker_symbol, interval)
+    last_date = store.last_date(ticker_symbol, interval)
+    # Imported data without an index entry is described by its own dates and treated as fetched on the last one
+    if entry is None and last_date is not None:
+        entry = {'start': first_date.isoformat(), 'end': last_date.isoformat(), 'fetched_at': last_date.isoformat()}
+
+    covers_start = entry is not None and last_date is not None \
+        and pd.Timestamp(entry['start']) <= pd.Timestamp(start_date) + timedelta(days=7)
+    if covers_start and is_fresh(entry['fetched_at'], stocks_config['price_ttl_seconds']):
+        print(f"Transactional data for '{ticker_symbol}' served from the price store.")
+    else:
+        fetch_start = last_date if covers_start else start_date
+        # Download the historical market data from the provider and append what is new
+        new_data = get_provider().download(ticker_symbol, start=fetch_start, end=end_date, interval=interval)
+        added = store.append(ticker_symbol, new_data, interval)
+        # Older bars are merged into the store, so a download from start_date covers everything the provider has
+        # from there (a ticker listed later starts later); an empty answer covers only what was already stored
+        if covers_start:
+            covered_start = entry['start']
+        elif len(new_data):
+            covered_start = pd.Timestamp(start_date).isoformat()
+        else:
+            covered_start = first_date.isoformat() if first_date is not None else None
+        if covered_start is not None:
+            update_cache_index(key, {'start': covered_start, 'end': end_date.isoformat(), 'fetched_at': datetime.now().isoformat()})
+        print(f"Transactional data for '{ticker_symbol}' updated in the price store "
+              f"({len(new_data)} bars downloaded from {pd.Timestamp(fetch_start).date()}, {added} new).")
+
+    ticker_data = store.read(ticker_symbol, start=pd.Timestamp(start_date).normalize(), interval=interval)
     return ticker_data
 
+def cached_financials(data_file):
+    # Statements are refreshed at most once per TTL; the file's modification time is its fetch time
+    if not os.path.exists(data_file):
+        return None
+    fetched_at = datetime.fromtimestamp(os.path.getmtime(data_file)).isoformat()
+    if not is_fresh(fetched_at, stocks_config['financials_ttl_seconds']):
+        return None
+    print(f"Financial data served from '{data_file}'.")
+    data = pd.read_json(data_file, orient='index', convert_dates=False)
+    data.index = pd.to_datetime(data.index)
+    return data
+
 # Function to pull quarterly financial data for specific metrics (last 12 quarters)
+@timed('stocks', count=len)
 def fetch_quarterly_financial_data(ticker_symbol):
+    data_file = f'{ticker_symbol}_quarterly_financial_data.json'
+    quarterly_data = cached_financials(data_file)
+    if quarterly_data is not None:
+        return quarterly_data
+
     # Download ticker object
-    ticker = yf.Ticker(ticker_symbol)
+    ticker = get_provider().ticker(ticker_symbol)
     
     # Fetch the financials (quarterly data)
     financials = ticker.quarterly_financials.T  # Transpose to make rows as quarters
@@ -56,28 +244,31 @@ def fetch_quarterly_financial_data(ticker_symbol):
     })
     
     # Save to a JSON file
-    quarterly_data.to_json(f'{ticker_symbol}_quarterly_financial_data.json', orient='index', date_format='iso')
+    quarterly_data.to_json(data_file, orient='index', date_format='iso')
     
-    print(f"Quarterly financial data for last 12 quarters saved to '{ticker_symbol}_quarterly_financial_data.json'.")
+    print(f"Quarterly financial data for last 12 quarters saved to '{data_file}'.")
     return quarterly_data
 
 # Function to plot the daily closing prices with moving averages (last 3 years) using Plotly
-def plot_transactional_data(ticker_data, ticker_symbol):
-    # Add moving averages to the data
-    ticker_data['50_MA'] = ticker_data['Close'].rolling(window=50).mean()
-    ticker_data['100_MA'] = ticker_data['Close'].rolling(window=100).mean()
-    ticker_data['200_MA'] = ticker_data['Close'].rolling(window=200).mean()
-    
+def transactional_figure(ticker_data, ticker_symbol):
+    # Moving averages from the indicator engine, kept apart from the caller's data
+    moving_averages = frame_indicators(ticker_data, {'sma': [50, 100, 200]})
+
+    # Thin long histories out before building traces; the moving averages use the price's points so hover stays aligned
+    keep = downsample_indices(ticker_data['Date'].to_numpy().astype('datetime64[ns]').astype(np.int64), ticker_data['Close'],
+                              stocks_config['plot_max_points'], stocks_config['downsample_method'])
+    dates = ticker_data['Date'].to_numpy()[keep]
+
     # Create interactive plot with Plotly
     fig = go.Figure()
 
     # Add closing price line
-    fig.add_trace(go.Scatter(x=ticker_data['Date'], y=ticker_data['Close'], mode='lines', name='Closing Price'))
+    fig.add_trace(go.Scatter(x=dates, y=ticker_data['Close'].to_numpy()[keep], mode='lines', name='Closing Price'))
     
     # Add moving averages
-    fig.add_trace(go.Scatter(x=ticker_data['Date'], y=ticker_data['50_MA'], mode='lines', name='50-Day MA'))
-    fig.add_trace(go.Scatter(x=ticker_data['Date'], y=ticker_data['100_MA'], mode='lines', name='100-Day MA'))
-    fig.add_trace(go.Scatter(x=ticker_data['Date'], y=ticker_data['200_MA'], mode='lines', name='200-Day MA'))
+    fig.add_trace(go.Scatter(x=dates, y=moving_averages['sma_50'].to_numpy()[keep], mode='lines', name='50-Day MA'))
+    fig.add_trace(go.Scatter(x=dates, y=moving_averages['sma_100'].to_numpy()[keep], mode='lines', name='100-Day MA'))
+    fig.add_trace(go.Scatter(x=dates, y=moving_averages['sma_200'].to_numpy()[keep], mode='lines', name='200-Day MA'))
 
     # Customize layout
     fig.update_layout(
@@ -86,15 +277,19 @@ def plot_transactional_data(ticker_data, ticker_symbol):
         yaxis_title='Price (USD)',
         hovermode='x unified'
     )
+    return fig
 
+@timed('stocks')
+def plot_transactional_data(ticker_data, ticker_symbol):
     # Show the interactive chart
-    fig.show()
+    transactional_figure(ticker_data, ticker_symbol).show()
 
 # Function to format numbers in billions for chart display
 def format_billions(x):
     return f'{x * 1e-9:.1f}B'  # Format numbers as billions (B)
 
 # Function to plot quarterly financial data as bar charts (last 12 quarters) using Plotly
+@timed('stocks')
 def plot_quarterly_financial_data(quarterly_data, ticker_symbol):
     # Convert the index to PeriodIndex to represent quarters as "Year-Q1", "Year-Q2", etc.
     quarterly_data.index = pd.PeriodIndex(quarterly_data.index, freq='Q').strftime('%Y-Q%q')
@@ -133,9 +328,15 @@ def plot_quarterly_financial_data(quarterly_data, ticker_symbol):
     fig.show()
 
 # Function to pull annual financial data for specific metrics (last 3 years)
+@timed('stocks', count=len)
 def fetch_annual_financial_data(ticker_symbol):
+    data_file = f'{ticker_symbol}_annual_financial_data.json'
+    annual_data = cached_financials(data_file)
+    if annual_data is not None:
+        return annual_data
+
     # Download ticker object
-    ticker = yf.Ticker(ticker_symbol)
+    ticker = get_provider().ticker(ticker_symbol)
     
     # Fetch the financials (annual data)
     financials = ticker.financials.T  # Transpose to make rows as years
@@ -161,12 +362,13 @@ def fetch_annual_financial_data(ticker_symbol):
     })
     
     # Save to a JSON file
-    annual_data.to_json(f'{ticker_symbol}_annual_financial_data.json', orient='index', date_format='iso')
+    annual_data.to_json(data_file, orient='index', date_format='iso')
     
-    print(f"Annual financial data for last 3 years saved to '{ticker_symbol}_annual_financial_data.json'.")
+    print(f"Annual financial data for last 3 years saved to '{data_file}'.")
     return annual_data
 
 # Function to plot annual financial data as bar charts (last 3 years) using Plotly
+@timed('stocks')
 def plot_annual_financial_data(annual_data, ticker_symbol):
     annual_data.index = pd.to_datetime(annual_data.index).strftime('%Y')  # Format date as year only
     
@@ -203,13 +405,37 @@ def plot_annual_financial_data(annual_data, ticker_symbol):
     # Show the interactive chart
     fig.show()
 
+def load_tickers(tickers_file=None):
+    # Yahoo writes share classes with a dash (BRK.B -> BRK-B)
+    companies = pd.read_csv(tickers_file or stocks_config['tickers_file'], usecols=['Symbol'])
+    return [symbol.replace('.', '-') for symbol in companies['Symbol'].dropna()]
+
+def fetch_ticker(ticker_symbol):
+    return (fetch_transactional_data(ticker_symbol), fetch_quarterly_financial_data(ticker_symbol),
+            fetch_annual_financial_data(ticker_symbol))
+
+def fetch_batch(tickers, concurrency=None):
+    """Fetch every ticker with at most concurrency in flight; a failing ticker is reported and skipped."""
+    def fetch(ticker_symbol):
+        try:
+            fetch_ticker(ticker_symbol)
+            return ticker_symbol, None
+        except Exception as e:
+            return ticker_symbol, e
+
+    failed = {}
+    with ThreadPoolExecutor(max_workers=concurrency or stocks_config['concurrency']) as executor:
+        for ticker_symbol, error in executor.map(fetch, tickers):
+            if error is not None:
+                failed[ticker_symbol] = error
+                print(f"Failed to fetch '{ticker_symbol}': {error}")
+    print(f"Fetched {len(tickers) - len(failed)} of {len(tickers)} tickers.")
+    return failed
+
 # Main function to fetch and plot data
-def main(ticker_symbol):
+def plot_ticker(ticker_symbol):
     # Fetch transactional and financial data
-    transactional_data = fetch_transactional_data(ticker_symbol)
-    quarterly_financial_data = fetch_quarterly_financial_data(ticker_symbol)
-    # Fetch annual financial data
-    annual_financial_data = fetch_annual_financial_data(ticker_symbol)
+    transactional_data, quarterly_financial_data, annual_financial_data = fetch_ticker(ticker_symbol)
 
     # Plot transactional data and financial data
     plot_transactional_data(transactional_data, ticker_symbol)
@@ -217,7 +443,24 @@ def main(ticker_symbol):
     # Plot annual financial data
     plot_annual_financial_data(annual_financial_data, ticker_symbol)
 
+def main():
+    parser = argparse.ArgumentParser(description='Fetch and plot market data for one ticker, or fetch a whole list.')
+    parser.add_argument('ticker', nargs='?', default='ADBE')
+    parser.add_argument('--batch', action='store_true', help='fetch every Symbol in the tickers file without plotting')
+    parser.add_argument('--tickers-file', default=stocks_config['tickers_file'])
+    parser.add_argument('--provider', choices=list(providers), default=stocks_config['provider'])
+    parser.add_argument('--max-points', type=int, default=stocks_config['plot_max_points'],
+                        help='downsample the price chart to about this many points per trace')
+    parser.add_argument('--downsample', choices=downsample_methods, default=stocks_config['downsample_method'])
+    args = parser.parse_args()
+    stocks_config['provider'] = args.provider
+    stocks_config['plot_max_points'] = args.max_points
+    stocks_config['downsample_method'] = args.downsample
+
+    if args.batch:
+        fetch_batch(load_tickers(args.tickers_file))
+    else:
+        plot_ticker(args.ticker)
 
-# Example usage with Meta's ticker 'META'
-ticker = 'ADBE'
-main(ticker)
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+import json
+import sqlite3
+import numpy as np
+import pandas as pd
+import pytest
+import anamolies
+
+def vehicle_rows(ids, seed):
+    rng = np.random.default_rng(seed)
+    return [(int(row_id), float(rng.normal(15000, 4000)), int(rng.integers(1995, 2022)), float(rng.normal(90000, 30000)))
+            for row_id in ids]
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    path = str(tmp_path / 'vehicles.db')
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE vehicles (id INTEGER PRIMARY KEY, price REAL, year INTEGER, odometer REAL)")
+    conn.executemany("INSERT INTO vehicles VALUES (?, ?, ?, ?)", vehicle_rows(range(7000000000, 7000002000, 2), 1))
+    conn.commit()
+    conn.close()
+    monkeypatch.setattr(anamolies, 'DATABASE_PATH', path)
+    monkeypatch.setitem(anamolies.analysis_config, 'model_file', str(tmp_path / 'model.pkl'))
+    monkeypatch.setitem(anamolies.analysis_config, 'n_jobs', 1)
+    return path
+
+def per_feature_results(vehicles_df):
+    # The analysis as it was before vectorizing: one DataFrame and one IsolationForest per feature
+    results = []
+    for feature in anamolies.features:
+        data = vehicles_df[feature].dropna().values.reshape(-1, 1)
+        data_df = vehicles_df[[feature, 'id']].dropna().reset_index(drop=True)
+        clf = anamolies.IsolationForest(contamination=0.1, random_state=42)
+        predictions = clf.fit(data).predict(data)
+        anomalies = data_df.loc[predictions == -1, ['id', feature]].to_dict(orient='records')
+        results.append((feature, np.mean(data), np.median(data), np.std(data), np.min(data), np.max(data),
+                        int(np.sum(predictions == -1)), json.dumps(anomalies)))
+    return results
+
+def test_vectorized_analysis_flags_the_same_rows_as_the_per_feature_loop(monkeypatch):
+    monkeypatch.setitem(anamolies.analysis_config, 'n_jobs', 1)
+    vehicles_df = pd.DataFrame(vehicle_rows(range(7000000000, 7000000500), 3), columns=['id'] + anamolies.features)
+    # Missing values differ per feature, so each detector sees its own subset of rows
+    vehicles_df.loc[::7, 'price'] = np.nan
+    vehicles_df.loc[::11, 'odometer'] = np.nan
+    vehicles_df.loc[3, 'price'] = 2.5e6
+
+    meta_data, anomaly_data, _ = anamolies.analyze(vehicles_df, '2026-10-18', 'run')
+    expected = per_feature_results(vehicles_df)
+    assert [row[3] for row in meta_data] == [row[0] for row in expected]
+    for row, (_, *statistics, anomaly_count, anomalies) in zip(meta_data, expected):
+        assert row[4:9] == pytest.approx(statistics, rel=1e-12)
+        assert row[9] == anomaly_count
+        assert row[10] == anomalies
+    assert len(anomaly_data) == sum(row[9] for row in meta_data)
+    assert (7000000003, 2.5e6) in {(row[4], row[5]) for row in anomaly_data if row[1] == 'price'}
+
+def test_incremental_run_scores_rows_inserted_with_lower_ids(database, monkeypatch):
+    anamolies.main()
+    # Listings loaded later can have lower ids than every row analyzed so far
+    late_rows = vehicle_rows(range(6000000000, 6000000010), 2)
+    late_rows[0] = (6000000000, 9.9e6, 1901, 5e6)
+    conn = sqlite3.connect(database)
+    conn.executemany("INSERT INTO vehicles VALUES (?, ?, ?, ?)", late_rows)
+    conn.commit()
+
+    monkeypatch.setitem(anamolies.analysis_config, 'incremental', True)
+    anamolies.main()
+    runs = conn.execute("SELECT DISTINCT run_id FROM data_meta ORDER BY run_id").fetchall()
+    assert len(runs) == 2
+    flagged = {row[0] for row in conn.execute("SELECT id FROM data_anomalies WHERE run_id = ?", runs[1])}
+    assert 6000000000 in flagged
+    assert flagged <= {row[0] for row in late_rows}
+    # The old format keeps the flagged rows as JSON in data_meta by default
+    assert all(row[0] is not None for row in conn.execute("SELECT anomalies FROM data_meta"))
+
+    # Nothing new: the next incremental run scores no rows, and the consumed log entries are gone
+    anamolies.main()
+    counts = conn.execute("SELECT anomaly_count FROM data_meta WHERE run_id = (SELECT max(run_id) FROM data_meta)").fetchall()
+    assert counts == [(0,)] * len(anamolies.features)
+    assert conn.execute("SELECT count(*) FROM vehicles_load_log").fetchone()[0] == 0
+    conn.close()
+
+def test_running_statistics_match_pandas():
+    rng = np.random.default_rng(4)
+    values = np.column_stack([rng.normal(15000, 4000, 50000), rng.integers(1995, 2022, 50000), rng.lognormal(11, 1, 50000)])
+    values[rng.random(values.shape) < 0.05] = np.nan
+    stats = anamolies.RunningStats(3)
+    for chunk in np.array_split(values, 37):
+        stats.update(chunk)
+    frame = pd.DataFrame(values)
+    # Welford/Chan merging is exact up to floating point rounding
+    assert stats.count.tolist() == frame.count().tolist()
+    np.testing.assert_allclose(stats.mean, frame.mean(), rtol=1e-12)
+    np.testing.assert_allclose(stats.std_dev, frame.std(ddof=0), rtol=1e-9)
+    np.testing.assert_array_equal(stats.min, frame.min())
+    np.testing.assert_array_equal(stats.max, frame.max())
+
+def test_sketched_median_is_within_one_percent_rank_of_pandas():
+    rng = np.random.default_rng(5)
+    values = rng.lognormal(11, 1, 200000)
+    values[rng.random(len(values)) < 0.05] = np.nan
+    sketch = anamolies.QuantileSketch(size=1024, seed=5)
+    for chunk in np.array_split(values, 50):
+        sketch.update(chunk)
+    present = pd.Series(values).dropna()
+    # The sketched median sits within 1% of the values, by rank, of the exact pandas median
+    assert abs((present < sketch.quantile(0.5)).mean() - 0.5) < 0.01
+    assert abs(sketch.quantile(0.5) / present.median() - 1) < 0.02
+
+def test_out_of_core_statistics_match_pandas_and_the_median_is_within_three_percent_rank(database, monkeypatch):
+    monkeypatch.setitem(anamolies.analysis_config, 'chunk_size', 100)
+    monkeypatch.setitem(anamolies.analysis_config, 'sample_size', 200)
+    monkeypatch.setitem(anamolies.analysis_config, 'sketch_size', 64)
+    reservoirs = []
+
+    class RecordedReservoir(anamolies.Reservoir):
+        def __init__(self, *args):
+            super().__init__(*args)
+            reservoirs.append(self)
+
+    monkeypatch.setattr(anamolies, 'Reservoir', RecordedReservoir)
+    conn = sqlite3.connect(database)
+    meta_data, _, _ = anamolies.analyze_out_of_core(conn, '2026-10-18', 'run')
+    vehicles_df = pd.read_sql_query("SELECT * FROM vehicles", conn)
+    conn.close()
+    for row in meta_data:
+        values = vehicles_df[row[3]]
+        assert row[4] == pytest.approx(values.mean(), rel=1e-12)
+        assert row[6] == pytest.approx(values.std(ddof=0), rel=1e-9)
+        # With 64 values per sketch level the median's rank is off by at most 3%; year has ties, so compare rank ranges
+        assert (values < row[5]).mean() <= 0.53 and (values <= row[5]).mean() >= 0.47
+    # Every column is complete, yet each detector trains on its own sample of rows;
+    # price and odometer values are distinct, so they map back to the sampled rows
+    price_rows, odometer_rows = (set(np.flatnonzero(np.isin(vehicles_df[column], reservoirs[index].sample[:, 0])))
+                                 for index, column in ((0, 'price'), (2, 'odometer')))
+    assert len(price_rows) == len(odometer_rows) == 200
+    assert price_rows != odometer_rows
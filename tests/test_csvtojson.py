@@ -0,0 +1,93 @@
+import glob
+import json
+import os
+import pandas as pd
+import pytest
+import csvtojson
+
+# Cases where a hand-written parser drifts from pandas: bools with gaps, padded numbers, duplicate and empty
+# headers, float rounding, non-ASCII, quoted newlines and blank lines
+edge_case_csv = (
+    'a,a,,flag,padded,number,text\n'
+    '1,x,u,True,  5,123456789.123456789,"line one\nline two"\n'
+    '2,y,v,,6 ,0.30000000000000004,café\n'
+    '\n'
+    '3,z,w,False, 7 ,1e16,"say ""hi"""\n'
+    '4,,,true,8,-0.0,/slash\\\n'
+    '5,q,r,FALSE,9,nan,\n'
+)
+
+def legacy_process_csv(csv_file_path, chunk_size=50000):
+    # The original implementation: pandas to_json, then json.loads + json.dumps for every record
+    chunk_number = 0
+    for chunk in pd.read_csv(csv_file_path, chunksize=chunk_size, encoding='utf-8'):
+        with open(f'output_{chunk_number}.json', 'w', encoding='utf-8') as json_file:
+            for json_obj in chunk.to_json(orient='records', lines=True).splitlines():
+                json_file.write(json.dumps(json.loads(json_obj), ensure_ascii=False) + '\n')
+        chunk_number += 1
+
+def read_outputs(directory):
+    files = sorted(glob.glob(os.path.join(directory, 'output_*.json')), key=lambda name: int(name.rsplit('_', 1)[1][:-5]))
+    return [open(file_name, encoding='utf-8').read() for file_name in files]
+
+@pytest.fixture
+def csv_file(tmp_path):
+    path = tmp_path / 'input.csv'
+    path.write_text(edge_case_csv, encoding='utf-8')
+    return str(path)
+
+@pytest.mark.parametrize('chunk_size', [2, 50000])
+def test_process_csv_matches_pandas_path(csv_file, tmp_path, monkeypatch, chunk_size):
+    for name, function in [('legacy', legacy_process_csv), ('current', csvtojson.process_csv)]:
+        os.makedirs(tmp_path / name)
+        monkeypatch.chdir(tmp_path / name)
+        function(csv_file, chunk_size)
+    assert read_outputs(tmp_path / 'current') == read_outputs(tmp_path / 'legacy')
+
+def test_process_csv_parallel_matches_pandas_path(csv_file, tmp_path, monkeypatch):
+    os.makedirs(tmp_path / 'legacy')
+    monkeypatch.chdir(tmp_path / 'legacy')
+    legacy_process_csv(csv_file, 2)
+    os.makedirs(tmp_path / 'parallel')
+    monkeypatch.chdir(tmp_path / 'parallel')
+    manifest = csvtojson.process_csv_parallel(csv_file, chunk_size=2, processes=2, manifest_file='manifest.json')
+    assert ''.join(read_outputs(tmp_path / 'parallel')) == ''.join(read_outputs(tmp_path / 'legacy'))
+    assert sum(entry['rows'] for entry in manifest) == 5
+
+def test_extra_fields_fail_like_pandas(tmp_path, monkeypatch):
+    path = tmp_path / 'extra.csv'
+    path.write_text('a,b\n1,2\n3,4,5\n', encoding='utf-8')
+    monkeypatch.chdir(tmp_path)
+    with pytest.raises(pd.errors.ParserError):
+        legacy_process_csv(str(path))
+    with pytest.raises(pd.errors.ParserError):
+        csvtojson.process_csv(str(path))
+
+def test_floats_match_to_json():
+    # to_json's double_precision=10 switches to ten significant digits below 1e-15 and from 1e16 up
+    values = [0.1 + 0.2, -0.0, 1e16, 9999999999999998.0, 1.2345678901234e-16, 5e-11, -2.5e-12, 123456789.123456789,
+              1e300, float('inf'), float('-inf'), float('nan')]
+    expected = json.loads(pd.DataFrame({'x': values}).to_json(orient='values'))
+    assert json.dumps([[value] for value in csvtojson.column_values(pd.Series(values))]) == json.dumps(expected)
+
+def test_parallel_shards_share_column_types(tmp_path, monkeypatch):
+    # The gap in 'count' falls in a later shard; per-shard inference would write 5.0 there instead of 5
+    rows = [f'{row},{row % 7 if row != 900 else ""},{"yes" if row % 2 else "no"},{row / 4}' for row in range(1000)]
+    path = tmp_path / 'gaps.csv'
+    path.write_text('id,count,label,ratio\n' + '\n'.join(rows) + '\n', encoding='utf-8')
+    monkeypatch.chdir(tmp_path)
+    csvtojson.process_csv_parallel(str(path), processes=2, shard_bytes=2048, sample_rows=100, manifest_file='manifest.json')
+    records = [json.loads(line) for text in read_outputs(tmp_path) for line in text.splitlines()]
+    assert [record['id'] for record in records] == list(range(1000))
+    assert all(isinstance(record['count'], int) for record in records if record['id'] != 900)
+    assert records[900]['count'] is None
+    assert records[5] == {'id': 5, 'count': 5, 'label': 'yes', 'ratio': 1.25}
+
+def test_stale_outputs_are_removed(csv_file, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    for number in range(5):
+        (tmp_path / f'output_{number}.json').write_text('stale\n', encoding='utf-8')
+    (tmp_path / 'output_notes.json').write_text('kept\n', encoding='utf-8')
+    manifest = csvtojson.process_csv_parallel(csv_file, processes=2, manifest_file='manifest.json')
+    assert sorted(glob.glob('output_*.json')) == ['output_0.json', 'output_notes.json']
+    assert [entry['file'] for entry in manifest] == ['output_0.json']
@@ -0,0 +1,61 @@
+import numpy as np
+import pandas as pd
+import pytest
+import indicators
+from pricestore import PriceStore, price_columns
+
+def bars(dates, seed):
+    rng = np.random.default_rng(seed)
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.02, len(dates))))
+    return pd.DataFrame({'Date': dates, 'Open': close, 'High': close * 1.01, 'Low': close * 0.99, 'Close': close,
+                         'Adj Close': close, 'Volume': rng.integers(1000, 100000, len(dates)).astype(float)})
+
+@pytest.fixture
+def history():
+    dates = pd.bdate_range('2022-01-03', periods=320)
+    return dates, {'A': bars(dates, 1), 'B': bars(dates, 2)}
+
+def assert_matches_full_run(store, dates, indicators_by_name):
+    tickers = ['A', 'B']
+    full_dates, panel = indicators.load_panel(tickers, store=store)
+    _, expected, _ = indicators.compute_indicators(tickers, full_dates, panel)
+    assert len(dates)
+    for name, values in indicators_by_name.items():
+        np.testing.assert_allclose(values, expected[name][:, -values.shape[1]:], rtol=1e-9, atol=1e-9, err_msg=name)
+
+def test_incremental_update_matches_full_run(tmp_path, history):
+    dates, frames = history
+    store = PriceStore(str(tmp_path / 'store'))
+    state_file = str(tmp_path / 'state.pkl')
+    for ticker_symbol, frame in frames.items():
+        store.append(ticker_symbol, frame[:300])
+    indicators.update_indicators(['A', 'B'], store, state_file=state_file)
+    for day in range(300, 320):
+        for ticker_symbol, frame in frames.items():
+            store.append(ticker_symbol, frame[day:day + 1])
+        new_dates, values = indicators.update_indicators(['A', 'B'], store, state_file=state_file)
+        assert len(new_dates) == 2
+        assert_matches_full_run(store, new_dates, values)
+
+def test_late_ticker_triggers_full_computation(tmp_path, history):
+    dates, frames = history
+    store = PriceStore(str(tmp_path / 'store'))
+    state_file = str(tmp_path / 'state.pkl')
+    # B's fetch failed for the last two days of the first run
+    store.append('A', frames['A'][:300])
+    store.append('B', frames['B'][:298])
+    indicators.update_indicators(['A', 'B'], store, state_file=state_file)
+
+    # B catches up and both get new days
+    store.append('A', frames['A'][300:305])
+    store.append('B', frames['B'][298:305])
+    new_dates, values = indicators.update_indicators(['A', 'B'], store, state_file=state_file)
+    assert_matches_full_run(store, new_dates, values)
+    assert not np.isnan(values['sma_50'][1, -1]) and not np.isnan(values['volatility_20'][1, -1])
+
+    # Later runs are incremental again and still match
+    store.append('A', frames['A'][305:306])
+    store.append('B', frames['B'][305:306])
+    new_dates, values = indicators.update_indicators(['A', 'B'], store, state_file=state_file)
+    assert len(new_dates) == 2
+    assert_matches_full_run(store, new_dates, values)
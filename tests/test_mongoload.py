@@ -0,0 +1,43 @@
+import mongomock
+import pytest
+import mongodbvehicles
+from mongoload import get_write_batch, load_batches
+
+csv_text = (
+    "id,region,price,year,manufacturer,model\n"
+    "7222695916,prescott,6000,2010,ford,ranger\n"
+    "7218891961,fayetteville,11900,2017,hyundai,elantra\n"
+    ",nowhere,500,1999,ford,escort\n"
+    "7221797935,florida keys,21000,2005,ford,excursion\n"
+    "7222270760,worcester,1500,2002,honda,odyssey\n"
+)
+
+@pytest.fixture
+def collection():
+    return mongomock.MongoClient()['vehicle_database']['vehicles']
+
+def test_loading_twice_leaves_the_collection_unchanged(tmp_path, collection):
+    csv_file = tmp_path / 'vehicles.csv'
+    csv_file.write_text(csv_text, encoding='utf-8')
+
+    first_count = mongodbvehicles.load(collection, str(csv_file), batch_size=2, mode='upsert')
+    documents = list(collection.find({}, {'_id': 0}).sort('id'))
+    second_count = mongodbvehicles.load(collection, str(csv_file), batch_size=2, mode='upsert')
+
+    # The row without an id is skipped on both runs instead of being upserted onto {id: None}
+    assert first_count == second_count == 4
+    assert collection.count_documents({}) == 4
+    assert collection.count_documents({'id': None}) == 0
+    assert list(collection.find({}, {'_id': 0}).sort('id')) == documents
+    assert documents[0] == {'id': 7218891961, 'region': 'fayetteville', 'price': 11900, 'year': 2017,
+                            'manufacturer': 'hyundai', 'model': 'elantra'}
+    index = collection.index_information()['id_1']
+    assert index['key'] == [('id', 1)]
+    assert index['unique']
+
+def test_upsert_skips_documents_without_a_key(collection, capsys):
+    batches = [([{'Symbol': 'MMM'}, {'Symbol': ''}, {'Name': 'no symbol'}], None), ([{'Symbol': 'AOS'}], None)]
+    doc_count = load_batches(collection, batches, write_batch=get_write_batch('upsert', 'Symbol'))
+    assert doc_count == 2
+    assert sorted(collection.distinct('Symbol')) == ['AOS', 'MMM']
+    assert 'Skipped 2 documents without a key.' in capsys.readouterr().out
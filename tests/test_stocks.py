@@ -0,0 +1,108 @@
+import sys
+from datetime import datetime, timedelta
+import pandas as pd
+import pytest
+import stocks
+
+class FailingProvider(stocks.LocalProvider):
+    # A provider whose downloads fail for some tickers, as Yahoo does for a delisted symbol
+    def __init__(self, failing):
+        super().__init__()
+        self.failing = failing
+
+    def download(self, ticker_symbol, start, end, interval='1d'):
+        if ticker_symbol in self.failing:
+            raise ConnectionError(f'no data for {ticker_symbol}')
+        return super().download(ticker_symbol, start, end, interval)
+
+@pytest.fixture
+def provider(tmp_path, monkeypatch):
+    # Statements are cached as JSON files in the working directory, so every test runs in its own
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setitem(stocks.stocks_config, 'price_store_path', str(tmp_path / 'price_store'))
+    monkeypatch.setitem(stocks.stocks_config, 'cache_index_file', str(tmp_path / 'market_cache_index.json'))
+    local_provider = stocks.LocalProvider()
+    stocks.set_provider(local_provider)
+    yield local_provider
+    stocks.set_provider(None)
+
+def downloads(provider):
+    return [call for call in provider.calls if call[0] == 'download']
+
+def test_first_fetch_records_the_range_in_the_cache_index(provider):
+    before = datetime.now()
+    data = stocks.fetch_transactional_data('ABC')
+    index = stocks.load_cache_index()
+    assert list(index) == ['ABC/1d']
+    entry = index['ABC/1d']
+    start_date = before - pd.DateOffset(years=stocks.stocks_config['history_years'])
+    assert abs(pd.Timestamp(entry['start']) - pd.Timestamp(start_date)) < timedelta(minutes=1)
+    assert pd.Timestamp(entry['end']) >= pd.Timestamp(before)
+    assert pd.Timestamp(entry['fetched_at']) >= pd.Timestamp(before)
+    assert len(downloads(provider)) == 1
+    assert len(data) > 700
+    assert data['Date'].min() >= pd.Timestamp(start_date).normalize()
+
+def test_fresh_cache_is_served_without_the_provider(provider):
+    first = stocks.fetch_transactional_data('ABC')
+    calls = len(provider.calls)
+    second = stocks.fetch_transactional_data('ABC')
+    assert len(provider.calls) == calls
+    pd.testing.assert_frame_equal(first, second)
+
+def test_stale_cache_fetches_only_the_tail(provider):
+    first = stocks.fetch_transactional_data('ABC')
+    entry = stocks.load_cache_index()['ABC/1d']
+    entry['fetched_at'] = (datetime.now() - timedelta(seconds=stocks.stocks_config['price_ttl_seconds'] + 60)).isoformat()
+    stocks.update_cache_index('ABC/1d', entry)
+
+    second = stocks.fetch_transactional_data('ABC')
+    tail = downloads(provider)[-1]
+    assert len(downloads(provider)) == 2
+    # The download starts at the last stored bar, which is refetched in case it was partial
+    assert tail[2] == first['Date'].max().date()
+    pd.testing.assert_frame_equal(first, second)
+    index = stocks.load_cache_index()
+    assert index['ABC/1d']['start'] == entry['start']
+    assert stocks.is_fresh(index['ABC/1d']['fetched_at'], stocks.stocks_config['price_ttl_seconds'])
+
+def test_fetch_batch_continues_past_a_failing_ticker(provider):
+    failing_provider = FailingProvider({'BAD'})
+    stocks.set_provider(failing_provider)
+    failed = stocks.fetch_batch(['AAA', 'BAD', 'CCC'], concurrency=2)
+    assert list(failed) == ['BAD']
+    assert isinstance(failed['BAD'], ConnectionError)
+    index = stocks.load_cache_index()
+    assert sorted(index) == ['AAA/1d', 'CCC/1d']
+    assert {call[1] for call in failing_provider.calls} == {'AAA', 'CCC'}
+
+class FakeYahooTicker:
+    # Shaped like yfinance's Ticker.history(auto_adjust=False, actions=False): flat columns, tz-aware index
+    def __init__(self, ticker_symbol, calls):
+        self.ticker_symbol = ticker_symbol
+        self.calls = calls
+
+    def history(self, start, end, interval='1d', auto_adjust=True, actions=True):
+        self.calls.append((self.ticker_symbol, auto_adjust, actions))
+        days = pd.bdate_range(pd.Timestamp(start).normalize(), pd.Timestamp(end).normalize() - timedelta(days=1),
+                              tz='America/New_York', name='Date')
+        close = float(sum(map(ord, self.ticker_symbol)))
+        return pd.DataFrame({'Open': close, 'High': close, 'Low': close, 'Close': close, 'Adj Close': close - 1,
+                             'Volume': 1000}, index=days)
+
+def test_yahoo_provider_feeds_the_price_store_from_concurrent_fetches(provider, monkeypatch):
+    calls = []
+    fake_yfinance = type('yfinance', (), {'Ticker': staticmethod(lambda ticker_symbol: FakeYahooTicker(ticker_symbol, calls))})
+    monkeypatch.setitem(sys.modules, 'yfinance', fake_yfinance)
+    stocks.set_provider(stocks.YahooProvider())
+    tickers = ['AAA', 'BBB', 'CCC', 'DDD']
+    monkeypatch.setattr(stocks, 'fetch_ticker', stocks.fetch_transactional_data)
+
+    assert stocks.fetch_batch(tickers, concurrency=4) == {}
+    assert sorted(calls) == [(ticker_symbol, False, False) for ticker_symbol in tickers]
+    # Every ticker's bars are stored under that ticker, with the adjusted close kept apart from the close
+    for ticker_symbol in tickers:
+        data = stocks.get_price_store().read(ticker_symbol)
+        close = float(sum(map(ord, ticker_symbol)))
+        assert len(data) > 700
+        assert (data['Close'] == close).all() and (data['Adj Close'] == close - 1).all()
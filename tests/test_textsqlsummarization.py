@@ -0,0 +1,139 @@
+import json
+import sqlite3
+import threading
+import urllib.error
+import urllib.request
+from collections import OrderedDict
+from http.server import ThreadingHTTPServer
+import pytest
+import textsqlsummarization as tss
+
+class WordTokenizer:
+    # Stands in for the T5 tokenizer: one token per word
+    def encode(self, text, add_special_tokens=True):
+        return text.split()
+
+@pytest.fixture
+def model(monkeypatch):
+    # Summaries are generated in-process by a fake model that keeps the first three words of each text
+    batches = []
+
+    def generate_summaries(texts):
+        batches.append(list(texts))
+        return [' '.join(text.split()[:3]) for text in texts]
+
+    monkeypatch.setitem(tss.summary_config, 'workers', 1)
+    monkeypatch.setitem(tss.summary_config, 'cache_file', None)
+    monkeypatch.setattr(tss, '_summary_cache', None)
+    monkeypatch.setattr(tss, 'generate_summaries', generate_summaries)
+    monkeypatch.setattr(tss, 'get_tokenizer', WordTokenizer)
+    return batches
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    path = str(tmp_path / 'vehicles.db')
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE vehicles (manufacturer TEXT, model TEXT, price REAL)")
+    conn.executemany("INSERT INTO vehicles VALUES (?, ?, ?)",
+                     [('ford', f'model{i}', 500 + 100 * i) for i in range(200)])
+    conn.commit()
+    conn.close()
+    monkeypatch.setitem(tss.service_config, 'database_path', path)
+    monkeypatch.setitem(tss.service_config, 'pool_size', 2)
+    monkeypatch.setitem(tss.summary_config, 'fetch_size', 7)
+    monkeypatch.setattr(tss, '_pool', None)
+    monkeypatch.setattr(tss, '_sql_cache', OrderedDict())
+    monkeypatch.setattr(tss, '_generate_sql', lambda question: tss.fallback_sql_query)
+    yield path
+    tss.get_pool().close()
+
+@pytest.fixture
+def server(model, database):
+    http_server = ThreadingHTTPServer(('127.0.0.1', 0), tss.QueryHandler)
+    thread = threading.Thread(target=http_server.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{http_server.server_port}'
+    http_server.shutdown()
+    http_server.server_close()
+
+def request(url, data=None):
+    try:
+        with urllib.request.urlopen(url, data) as response:
+            return response.status, json.load(response)
+    except urllib.error.HTTPError as e:
+        return e.code, json.load(e)
+
+def test_summaries_keep_input_order_across_batches(model):
+    texts = [f'text {i} with some words' for i in range(10)]
+    assert tss.summarize_texts(texts, batch_size=3) == [f'text {i} with' for i in range(10)]
+    assert [len(batch) for batch in model] == [3, 3, 3, 1]
+
+def test_cached_texts_skip_the_model(model, tmp_path, monkeypatch):
+    monkeypatch.setitem(tss.summary_config, 'cache_file', str(tmp_path / 'summary_cache.db'))
+    tss.summarize_texts(['one two three four', 'five six seven eight'])
+    assert tss.summarize_texts(['five six seven eight', 'nine ten eleven twelve']) == ['five six seven', 'nine ten eleven']
+    assert model == [['one two three four', 'five six seven eight'], ['nine ten eleven twelve']]
+
+    # A new process starts with an empty memory cache and reads the summaries back from the file
+    monkeypatch.setattr(tss, '_summary_cache', None)
+    assert tss.summarize_text('one two three four') == 'one two three'
+    assert len(model) == 2
+
+def test_query_service_answers_and_reuses_the_generated_sql(server, monkeypatch):
+    questions = []
+    monkeypatch.setattr(tss, '_generate_sql', lambda question: questions.append(question) or tss.fallback_sql_query)
+    assert request(f'{server}/health') == (200, {'status': 'ok', 'model_loaded': False})
+
+    status, response = request(f'{server}/query?q=Cheap+cars')
+    assert status == 200
+    assert response['sql'] == tss.fallback_sql_query
+    assert response['row_count'] == 95
+    assert response['summary']
+    assert set(response['timings']) == {'generate', 'execute', 'summarize', 'total'}
+
+    # Same question with other case and spacing: the generated SQL comes from the cache
+    status, response = request(f'{server}/query', json.dumps({'question': '  cheap   CARS '}).encode())
+    assert status == 200 and response['row_count'] == 95
+    assert questions == ['Cheap cars']
+
+def test_query_service_rejects_bad_requests(server):
+    assert request(f'{server}/query')[0] == 400
+    assert request(f'{server}/query', b'not json')[0] == 400
+    assert request(f'{server}/query', b'["a list"]')[0] == 400
+    assert request(f'{server}/query', b'{"question": 42}')[0] == 400
+    assert request(f'{server}/elsewhere')[0] == 404
+
+def test_query_service_reports_failures_as_json(server, monkeypatch):
+    def failing_sql(question):
+        raise RuntimeError('model unavailable')
+    monkeypatch.setattr(tss, '_generate_sql', failing_sql)
+    assert request(f'{server}/query?q=anything') == (500, {'error': 'internal error', 'detail': 'model unavailable'})
+
+def test_group_by_tokens_packs_consecutive_summaries(model):
+    summaries = ['a b c', 'd e', 'f g h i', 'j', 'k l m n o p']
+    # Each summary costs its words plus one for the joining space
+    assert tss.group_by_tokens(summaries, 7) == ['a b c d e', 'f g h i j', 'k l m n o p']
+    assert tss.group_by_tokens(summaries, 100) == [' '.join(summaries)]
+
+def test_reduce_summaries_levels_down_to_one_summary(model, monkeypatch):
+    monkeypatch.setitem(tss.summary_config, 'max_input_tokens', 12)
+    summaries = [f'part {i} of the results' for i in range(20)]
+    assert tss.reduce_summaries(summaries) == 'part 0 of'
+    # Every text sent to the model fits its input, prompt and end-of-sequence token included
+    assert all(len(text.split()) + 3 <= 12 for batch in model for text in batch)
+    assert len(model) > 2
+
+def test_rows_are_read_and_the_connection_released_before_summarizing(model, database, monkeypatch):
+    free_connections = []
+    fake_generate = tss.generate_summaries
+
+    def generate_summaries(texts):
+        free_connections.append(tss.get_pool().connections.qsize())
+        return fake_generate(texts)
+
+    monkeypatch.setattr(tss, 'generate_summaries', generate_summaries)
+    monkeypatch.setitem(tss.summary_config, 'batch_size', 1)
+    response = tss.answer_question('Cheap cars', max_words=40)
+    assert response['row_count'] == 95
+    assert response['summary']
+    assert free_connections and set(free_connections) == {tss.service_config['pool_size']}
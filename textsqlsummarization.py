@@ -1,94 +1,488 @@
+import argparse
+import hashlib
+import json
+import multiprocessing as mp
 import os
+import queue
 import sqlite3
-from transformers import T5ForConditionalGeneration, T5Tokenizer
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+from metrics import span
 
 # Suppress the symlink warning
 os.environ["HF_HUB_DISABLE_SYMLINKS_WARNING"] = "1"
 
-# Load the T5 model and tokenizer for both SQL generation and summarization
-t5_model = T5ForConditionalGeneration.from_pretrained('t5-small')
-t5_tokenizer = T5Tokenizer.from_pretrained('t5-small')
+# Configuration for summarization
+summary_config = {
+    'model_name': 't5-small',
+    'batch_size': 8,                     # Chunks padded together into one generate call
+    'workers': None,                     # Summarizing processes, each with its own model copy; None uses up to max_default_workers
+    'max_default_workers': 4,            # Cap on the default, since every worker holds a T5 copy in memory
+    'worker_threads': 1,                 # torch threads per worker process
+    'fetch_size': 1000,                  # Rows pulled from SQLite per fetchmany
+    'max_input_tokens': 512,             # T5 input limit; summaries are reduced in groups that fit it
+    'cache_size': 1024,                  # Summaries kept in memory, least recently used dropped first
+    'cache_file': 'summary_cache.db'     # Summaries kept across runs, keyed by chunk text hash; None disables it
+}
 
-# Connect to the SQLite database
-conn = sqlite3.connect('vehicles.db')
-cursor = conn.cursor()
+# Configuration for the query service
+service_config = {
+    'database_path': 'vehicles.db',
+    'host': '127.0.0.1',
+    'port': 8080,
+    'pool_size': 4,          # Read-only SQLite connections shared by the request threads
+    'sql_cache_size': 1024   # generate_sql results kept per normalized question
+}
 
-def generate_sql(natural_language_query):
-    input_text = f"translate English to SQL: {natural_language_query}"
+# Example natural language query
+nl_query = "Get the manufacturer and model of all vehicles priced under $10,000."
+fallback_sql_query = "SELECT manufacturer, model FROM vehicles WHERE price < 10000"
+
+# The T5 model and tokenizer for both SQL generation and summarization, loaded on first use
+_model = None
+_tokenizer = None
+_model_lock = threading.Lock()
+
+def get_tokenizer():
+    # The parent process only needs the tokenizer to size the reduce groups when workers summarize
+    global _tokenizer
+    with _model_lock:
+        if _tokenizer is None:
+            from transformers import T5Tokenizer
+            _tokenizer = T5Tokenizer.from_pretrained(summary_config['model_name'])
+    return _tokenizer
+
+def get_model():
+    # torch and transformers are imported here too, so starting the script or the service costs nothing until a question arrives
+    global _model
+    t5_tokenizer = get_tokenizer()
+    with _model_lock:
+        if _model is None:
+            from transformers import T5ForConditionalGeneration
+            t5_model = T5ForConditionalGeneration.from_pretrained(summary_config['model_name'])
+            t5_model.eval()
+            _model = (t5_model, t5_tokenizer)
+    return _model
+
+class ConnectionPool:
+    """A fixed set of read-only SQLite connections handed out to one thread at a time."""
+
+    def __init__(self, database_path, size):
+        self.connections = queue.Queue()
+        for _ in range(size):
+            # mode=ro rejects any statement that would write, whatever SQL the model produces
+            self.connections.put(sqlite3.connect(f'file:{database_path}?mode=ro', uri=True, check_same_thread=False))
+
+    @contextmanager
+    def connection(self):
+        conn = self.connections.get()
+        try:
+            yield conn
+        finally:
+            self.connections.put(conn)
+
+    def close(self):
+        while not self.connections.empty():
+            self.connections.get().close()
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    # Request threads may ask for the pool at the same time; only one of them creates it
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ConnectionPool(service_config['database_path'], service_config['pool_size'])
+    return _pool
+
+def normalize_question(natural_language_query):
+    # Questions differing only in case or spacing share one generated query
+    return ' '.join(natural_language_query.split()).casefold()
+
+# generate_sql results keyed by normalized question, least recently used dropped first
+_sql_cache = OrderedDict()
+_sql_cache_lock = threading.Lock()
+
+def _generate_sql(question):
+    import torch
+    t5_model, t5_tokenizer = get_model()
+    input_text = f"translate English to SQL: {question}"
     input_ids = t5_tokenizer.encode(input_text, return_tensors="pt", max_length=512, truncation=True)
-    output_ids = t5_model.generate(input_ids, max_length=150, num_beams=4, early_stopping=True)
+    with torch.inference_mode():
+        output_ids = t5_model.generate(input_ids, max_length=150, num_beams=4, early_stopping=True)
     sql_query = t5_tokenizer.decode(output_ids[0], skip_special_tokens=True)
     return sql_query
 
+def generate_sql(natural_language_query):
+    # The cache ignores case and spacing, but the model sees the question as asked: case carries meaning for T5
+    key = normalize_question(natural_language_query)
+    with _sql_cache_lock:
+        if key in _sql_cache:
+            _sql_cache.move_to_end(key)
+            return _sql_cache[key]
+    sql_query = _generate_sql(' '.join(natural_language_query.split()))
+    with _sql_cache_lock:
+        _sql_cache[key] = sql_query
+        _sql_cache.move_to_end(key)
+        while len(_sql_cache) > service_config['sql_cache_size']:
+            _sql_cache.popitem(last=False)
+    return sql_query
+
+def iter_sql_rows(sql_query, counter=None):
+    """Yield the result rows fetchmany batch by batch; counter, a metrics Span, counts them.
+
+    The pooled connection is held until the rows run out, so read them to the end
+    before doing slow work with them.
+    """
+    with get_pool().connection() as conn:
+        try:
+            cursor = conn.execute(sql_query)
+            while True:
+                rows = cursor.fetchmany(summary_config['fetch_size'])
+                if counter is not None:
+                    counter.add(rows=len(rows))
+                if not rows:
+                    break
+                yield from rows
+        except sqlite3.Error as e:
+            print(f"An error occurred: {e.args[0]}")
+
 def execute_sql(sql_query):
-    try:
-        cursor.execute(sql_query)
-        return cursor.fetchall()
-    except sqlite3.Error as e:
-        print(f"An error occurred: {e.args[0]}")
-        return []
-
-def chunk_results_by_words(results, max_words=400):
-    chunks = []
+    return list(iter_sql_rows(sql_query))
+
+def iter_word_chunks(rows, max_words=400):
+    # Join rows into texts of at most max_words words (a longer single row is its own chunk), one at a time
     current_chunk = []
     current_word_count = 0
 
-    for row in results:
+    for row in rows:
         row_text = ' '.join(map(str, row))
         word_count = len(row_text.split())
-        
-        if current_word_count + word_count > max_words:
-            chunks.append(current_chunk)
+
+        if current_chunk and current_word_count + word_count > max_words:
+            yield ' '.join(current_chunk)
             current_chunk = []
             current_word_count = 0
-        
+
         current_chunk.append(row_text)
         current_word_count += word_count
-    
+
     if current_chunk:
-        chunks.append(current_chunk)
+        yield ' '.join(current_chunk)
+
+class SummaryCache:
+    """Summaries keyed by the SHA-256 of the model name and chunk text: an in-memory LRU in front of a SQLite file."""
+
+    def __init__(self, cache_size=1024, cache_file=None):
+        self.cache_size = cache_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.db = None
+        if cache_file:
+            self.db = sqlite3.connect(cache_file, check_same_thread=False)
+            self.db.execute("CREATE TABLE IF NOT EXISTS summaries (key TEXT PRIMARY KEY, summary TEXT)")
+            self.db.commit()
+
+    @staticmethod
+    def key(text):
+        return hashlib.sha256(f"{summary_config['model_name']}\n{text}".encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return self.entries[key]
+            if self.db is not None:
+                row = self.db.execute("SELECT summary FROM summaries WHERE key = ?", (key,)).fetchone()
+                if row:
+                    self.remember(key, row[0])
+                    return row[0]
+        return None
+
+    def remember(self, key, summary):
+        self.entries[key] = summary
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.cache_size:
+            self.entries.popitem(last=False)
 
-    return chunks
+    def put_many(self, items):
+        with self.lock:
+            for key, summary in items:
+                self.remember(key, summary)
+            if self.db is not None:
+                self.db.executemany("INSERT OR REPLACE INTO summaries (key, summary) VALUES (?, ?)", items)
+                self.db.commit()
+
+_summary_cache = None
+
+def get_summary_cache():
+    global _summary_cache
+    if _summary_cache is None:
+        _summary_cache = SummaryCache(summary_config['cache_size'], summary_config['cache_file'])
+    return _summary_cache
+
+def generate_summaries(texts):
+    # One padded batch through the model; the attention mask keeps padding out of the result
+    import torch
+    t5_model, t5_tokenizer = get_model()
+    inputs = t5_tokenizer([f"summarize: {text}" for text in texts], return_tensors="pt", padding=True,
+                          max_length=512, truncation=True)
+    with torch.inference_mode():
+        summary_ids = t5_model.generate(**inputs, max_length=150, min_length=30, length_penalty=2.0, num_beams=4,
+                                        early_stopping=True)
+    return t5_tokenizer.batch_decode(summary_ids, skip_special_tokens=True)
+
+def _init_worker(threads, model_name):
+    # Spawned workers start from a fresh interpreter: they get the parent's model name and load the model up front
+    import torch
+    torch.set_num_threads(threads)
+    summary_config['model_name'] = model_name
+    get_model()
+
+_worker_pool = None
+_worker_pool_lock = threading.Lock()
+
+def worker_count():
+    return summary_config['workers'] or min(os.cpu_count() or 1, summary_config['max_default_workers'])
+
+def get_worker_pool():
+    """The summarizing process pool, created once and reused; None when one worker runs in-process.
+
+    The workers are spawned, not forked: the pool is first needed from a service request
+    thread, after torch has started its thread pools and while other requests may hold
+    _model_lock, and a forked child would inherit those locks held forever.
+    """
+    global _worker_pool
+    if worker_count() <= 1:
+        return None
+    with _worker_pool_lock:
+        if _worker_pool is None:
+            _worker_pool = mp.get_context('spawn').Pool(
+                worker_count(), initializer=_init_worker,
+                initargs=(summary_config['worker_threads'], summary_config['model_name']))
+    return _worker_pool
+
+def iter_summaries(texts, batch_size=None):
+    """Summarize texts as they arrive, in order, reusing cached summaries.
+
+    Uncached texts are generated in padded batches of batch_size, spread over the
+    worker pool with at most two batches per worker in flight, so neither the
+    input nor the pending results pile up in memory.
+    """
+    batch_size = batch_size or summary_config['batch_size']
+    summary_cache = get_summary_cache()
+    pool = get_worker_pool()
+    max_pending = 2 * worker_count() if pool is not None else 1
+    pending = deque()
+    text_count = 0
+    generated_count = 0
+    start_time = time.perf_counter()
+
+    def submit(batch):
+        keys = [summary_cache.key(text) for text in batch]
+        cached = [summary_cache.get(key) for key in keys]
+        missing = [text for text, summary in zip(batch, cached) if summary is None]
+        if not missing:
+            result = None
+        elif pool is not None:
+            result = pool.apply_async(generate_summaries, (missing,))
+        else:
+            result = generate_summaries(missing)
+        pending.append((keys, cached, result))
+
+    def collect():
+        nonlocal generated_count
+        keys, cached, result = pending.popleft()
+        generated = iter(result.get() if pool is not None and result is not None else result or [])
+        summaries = [summary if summary is not None else next(generated) for summary in cached]
+        new = [(key, summary) for key, summary, hit in zip(keys, summaries, cached) if hit is None]
+        summary_cache.put_many(new)
+        generated_count += len(new)
+        return summaries
+
+    with span('summarization', 'generate') as generate:
+        batch = []
+        for text in texts:
+            batch.append(text)
+            text_count += 1
+            if len(batch) >= batch_size:
+                submit(batch)
+                batch = []
+                if len(pending) >= max_pending:
+                    yield from collect()
+        if batch:
+            submit(batch)
+        while pending:
+            yield from collect()
+        generate.add(rows=generated_count)
+    elapsed = time.perf_counter() - start_time
+
+    if generated_count:
+        print(f"Summarized {generated_count} chunks in {elapsed:.2f}s ({generated_count / elapsed:.2f} chunks/sec), "
+              f"{text_count - generated_count} from cache.")
+
+def summarize_texts(texts, batch_size=None):
+    return list(iter_summaries(texts, batch_size))
 
 def summarize_text(text):
-    input_text = f"summarize: {text}"
-    input_ids = t5_tokenizer.encode(input_text, return_tensors="pt", max_length=512, truncation=True)
-    summary_ids = t5_model.generate(input_ids, max_length=150, min_length=30, length_penalty=2.0, num_beams=4, early_stopping=True)
-    summary = t5_tokenizer.decode(summary_ids[0], skip_special_tokens=True)
-    return summary
+    return summarize_texts([text])[0]
+
+def group_by_tokens(summaries, max_tokens):
+    # Consecutive summaries packed into groups whose joined text stays within max_tokens
+    t5_tokenizer = get_tokenizer()
+    groups = []
+    group = []
+    group_tokens = 0
+    for summary in summaries:
+        tokens = len(t5_tokenizer.encode(summary, add_special_tokens=False)) + 1
+        if group and group_tokens + tokens > max_tokens:
+            groups.append(' '.join(group))
+            group = []
+            group_tokens = 0
+        group.append(summary)
+        group_tokens += tokens
+    if group:
+        groups.append(' '.join(group))
+    return groups
+
+def reduce_summaries(summaries):
+    """Tree-reduce: summarize groups that fit the model input until a single summary is left."""
+    # Room for the "summarize: " prefix and the end-of-sequence token
+    max_tokens = summary_config['max_input_tokens'] - len(get_tokenizer().encode('summarize:', add_special_tokens=False)) - 2
+    while True:
+        groups = group_by_tokens(summaries, max_tokens)
+        summaries = summarize_texts(groups)
+        if len(groups) == 1:
+            return summaries[0]
 
 def summarize_results(results, max_words=400):
-    chunks = chunk_results_by_words(results, max_words)
-    summaries = []
-    for chunk in chunks:
-        text_chunk = ' '.join(chunk)
-        summaries.append(summarize_text(text_chunk))
-    
-    # Combine the individual chunk summaries into an overall summary
-    overall_summary = summarize_text(' '.join(summaries))
-    return overall_summary
+    # Map: summarize each word-bounded chunk as soon as it is read; reduce: combine the chunk summaries level by level
+    summaries = list(iter_summaries(iter_word_chunks(results, max_words)))
+    return reduce_summaries(summaries) if summaries else None
 
-# Example natural language query
-nl_query = "Get the manufacturer and model of all vehicles priced under $10,000."
+def answer_question(natural_language_query, max_words=400):
+    """Generate SQL for the question, run it and summarize the rows, timing each step in seconds."""
+    with span('nl_query', 'generate') as generate:
+        sql_query = generate_sql(natural_language_query)
+
+    # Ensure SQL is valid and in English
+    if "Erhalten" in sql_query or not sql_query.lower().startswith("select"):
+        print(f"Generated SQL query '{sql_query}' is invalid or not in English. Adjusting the query manually.")
+        sql_query = fallback_sql_query
+
+    # The rows are read and joined into chunk texts first, so the pooled connection goes back
+    # to the other requests before the slow summarizing starts
+    with span('nl_query', 'execute') as execute:
+        chunks = list(iter_word_chunks(iter_sql_rows(sql_query, execute), max_words))
+    with span('nl_query', 'summarize') as summarize:
+        summaries = list(iter_summaries(chunks))
+        summary = reduce_summaries(summaries) if summaries else None
+
+    timings = {
+        'generate': round(generate.seconds, 4),
+        'execute': round(execute.seconds, 4),
+        'summarize': round(summarize.seconds, 4)
+    }
+    timings['total'] = round(sum(timings.values()), 4)
+    return {
+        'question': natural_language_query,
+        'sql': sql_query,
+        'row_count': execute.rows,
+        'summary': summary,
+        'timings': timings
+    }
+
+class QueryHandler(BaseHTTPRequestHandler):
+    """GET /query?q=<question> or POST /query with {"question": ...}; GET /health answers without the model."""
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == '/health':
+            self.send_json(200, {'status': 'ok', 'model_loaded': _model is not None})
+        elif url.path == '/query':
+            self.answer(parse_qs(url.query).get('q', [''])[0])
+        else:
+            self.send_json(404, {'error': 'not found'})
+
+    def do_POST(self):
+        if urlparse(self.path).path != '/query':
+            self.send_json(404, {'error': 'not found'})
+            return
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        except json.JSONDecodeError:
+            self.send_json(400, {'error': 'body must be JSON'})
+            return
+        if not isinstance(body, dict):
+            self.send_json(400, {'error': 'body must be a JSON object'})
+            return
+        self.answer(body.get('question', ''))
+
+    def answer(self, question):
+        if not isinstance(question, str) or not question.strip():
+            self.send_json(400, {'error': 'missing question'})
+            return
+        try:
+            response = answer_question(question)
+        except Exception as e:
+            # The client gets a JSON error instead of a dropped connection and the error goes to the server log
+            self.log_error("Answering %r failed: %r", question, e)
+            self.send_json(500, {'error': 'internal error', 'detail': str(e)})
+            return
+        print(f"{question!r}: {response['row_count']} rows, "
+              + ', '.join(f"{step} {seconds * 1000:.0f} ms" for step, seconds in response['timings'].items()))
+        self.send_json(200, response)
+
+    def send_json(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+def serve():
+    # The model, the connection pool and both caches live as long as the process
+    server = ThreadingHTTPServer((service_config['host'], service_config['port']), QueryHandler)
+    print(f"Serving questions on http://{service_config['host']}:{service_config['port']}/query")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        close()
 
-# Generate SQL query from natural language query
-sql_query = generate_sql(nl_query)
-print(f"Generated SQL Query: {sql_query}")
+def close():
+    if _pool is not None:
+        _pool.close()
+    if _worker_pool is not None:
+        _worker_pool.close()
+        _worker_pool.join()
 
-# Ensure SQL is valid and in English
-if "Erhalten" in sql_query or not sql_query.lower().startswith("select"):
-    print("Generated SQL query is invalid or not in English. Adjusting the query manually.")
-    sql_query = "SELECT manufacturer, model FROM vehicles WHERE price < 10000"
+def main():
+    parser = argparse.ArgumentParser(description='Answer natural language questions over vehicles.db with T5.')
+    parser.add_argument('--serve', action='store_true', help='run the HTTP query service')
+    parser.add_argument('question', nargs='?', default=nl_query)
+    args = parser.parse_args()
 
-# Execute the SQL query and fetch results
-results = execute_sql(sql_query)
-print(f"Number of results: {len(results)}")
+    if args.serve:
+        serve()
+        return
 
-# Summarize the results
-if results:
-    summary = summarize_results(results, max_words=400)
-    print("Summary:")
-    print(summary)
+    response = answer_question(args.question)
+    print(f"Generated SQL Query: {response['sql']}")
+    print(f"Number of results: {response['row_count']}")
+    if response['summary']:
+        print("Summary:")
+        print(response['summary'])
+    print(f"Timings (s): {response['timings']}")
+    close()
 
-# Close the database connection
-conn.close()
+if __name__ == "__main__":
+    main()